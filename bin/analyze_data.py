@@ -9,6 +9,7 @@ import sys
 
 from mediasite_migration_scripts.data_analyzer import DataAnalyzer
 import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.catalog import Catalog, FORMAT_ANALYZER
 
 if __name__ == '__main__':
     def manage_opts():
@@ -50,6 +51,11 @@ if __name__ == '__main__':
             default='config.json',
             help='Json config file.'
         )
+        parser.add_argument(
+            '--catalog',
+            type=str,
+            help='Analyze the data of this catalog (see bin/build_catalog.py), only the folders to migrate are loaded.'
+        )
         return parser.parse_args()
 
     options = manage_opts()
@@ -58,7 +64,10 @@ if __name__ == '__main__':
     mediasite_data_file = options.mediasite_file
 
     should_run_import = False
-    if not os.path.isfile(mediasite_data_file):
+    if options.catalog:
+        # loaded once the config is read, to only load the folders to migrate
+        data = None
+    elif not os.path.isfile(mediasite_data_file):
         logging.info(f'Data file {options.mediasite_file} not found')
         should_run_import = True
     else:
@@ -99,6 +108,12 @@ if __name__ == '__main__':
     except Exception as e:
         logging.error(e)
 
+    if options.catalog:
+        catalog = Catalog.open(options.catalog)
+        catalog.check_format(FORMAT_ANALYZER)
+        data = list(catalog.iter_folders(folder_filter=lambda path: utils.is_folder_to_add(path, config_data)))
+        catalog.close()
+
     analyzer = DataAnalyzer(data, config_data)
 
     folder_in_channels = list()
@@ -1,7 +1,9 @@
 import argparse
 import logging
+from itertools import islice
 
 import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.catalog import Catalog, FORMAT_COLLECT
 import tests.common as test_utils
 
 logging.getLogger('root').handlers = []
@@ -26,13 +28,25 @@ if __name__ == '__main__':
             action='store_true',
             default=False,
             help='Get all data anonmyzed. By default you only get a small sample of anonymized data'
+        ),
+        parser.add_argument(
+            '--catalog',
+            help='Read the data from this catalog of the data file (see bin/build_catalog.py), only the sampled folders are loaded'
         )
         return parser.parse_args()
 
     options = manage_opts()
 
-    logger.info(f'Anonymizing data from {options.data_file}')
-    data = utils.read_json(options.data_file)
+    logger.info(f'Anonymizing data from {options.catalog or options.data_file}')
+    if options.catalog:
+        catalog = Catalog.open(options.catalog)
+        catalog.check_format(FORMAT_COLLECT)
+        # the small sample only keeps the first 2 folders
+        folders = catalog.iter_folders()
+        data = {'Folders': list(folders if options.all else islice(folders, 2)), 'UserProfiles': catalog.get_users()}
+        catalog.close()
+    else:
+        data = utils.read_json(options.data_file)
     anon_data = test_utils.anonymize_data(data)
     if not options.all:
         anon_data = test_utils.to_small_data(anon_data)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+'''
+This script imports a Mediasite data file into a SQLite catalog, used by the inspection tools (--catalog option)
+'''
+import argparse
+import sys
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.catalog import Catalog
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-i',
+        '--input-file',
+        type=str,
+        help='Mediasite data file to import (collect output or analyzer data)',
+        default='mediasite_data.json',
+    )
+    parser.add_argument(
+        '-o',
+        '--catalog-file',
+        type=str,
+        help='Path of the catalog (default: input file with a .sqlite extension)',
+    )
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Print all information to stdout.',
+    )
+    args = parser.parse_args()
+    utils.set_logger(verbose=args.verbose)
+
+    data = utils.read_json(args.input_file)
+    if data is None:
+        sys.exit(1)
+    catalog_path = args.catalog_file or Path(args.input_file).with_suffix('.sqlite')
+    print(f'Importing {args.input_file} into {catalog_path}')
+    catalog = Catalog(catalog_path)
+    try:
+        counts = catalog.import_data(data, source=args.input_file)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        catalog.close()
+    print(f'Imported {", ".join(f"{count} {table}" for table, count in counts.items())}')
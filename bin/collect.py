@@ -7,6 +7,7 @@ from pathlib import Path
 
 from mediasite_migration_scripts.data_extractor import DataExtractor
 import mediasite_migration_scripts.utils.common as utils
+import mediasite_migration_scripts.utils.mediasite as mediasite_utils
 
 if __name__ == '__main__':
     def manage_opts():
@@ -33,13 +34,43 @@ if __name__ == '__main__':
                             help='add custom mediasite data file.'),
         parser.add_argument('--max-folders',
                             help='specify maximum folders to collect infos'),
+        parser.add_argument('--shard',
+                            type=mediasite_utils.parse_shard,
+                            help='only collect the i-th of N disjoint parts of the folder tree (i/N, for example 1/4), see --merge.'),
+        parser.add_argument('--folders',
+                            nargs='+',
+                            help='only collect these folders (paths or ids) and their subfolders.'),
+        parser.add_argument('--profile',
+                            choices=list(mediasite_utils.COLLECT_PROFILES),
+                            help='resources to collect for each presentation (default: collect_profile in config, or full).'),
+        parser.add_argument('--output-prefix',
+                            help='prefix of the collected data files (default: data/mediasite, or data/mediasite_shard_i_of_N with --shard).'),
+        parser.add_argument('--merge',
+                            nargs='+',
+                            metavar='SHARD_FILE',
+                            help='merge the data files collected by shards (<prefix>_all_data.json) instead of collecting.'),
 
         return parser.parse_args()
     options = manage_opts()
     logger = utils.set_logger(options)
 
+    output_prefix = options.output_prefix or 'data/mediasite'
+    if options.shard and not options.output_prefix:
+        output_prefix = 'data/mediasite_shard_{}_of_{}'.format(*options.shard)
+        options.failed_csvfile = f'{output_prefix}_failed.csv'
+
+    if options.merge:
+        merged = mediasite_utils.merge_collected_data(utils.read_json(path) for path in options.merge)
+        folders_count = len(merged['Folders'])
+        presentations_count = sum(len(folder['Presentations']) for folder in merged['Folders'])
+        logger.info(f'Merged {len(options.merge)} files: {folders_count} folders, {presentations_count} presentations, {len(merged["UserProfiles"])} users')
+        utils.write_json(merged, f'{output_prefix}_all_data.json')
+        utils.write_json({'Folders': merged['Folders']}, f'{output_prefix}_folders_presentations.json')
+        utils.write_json({'UserProfiles': merged['UserProfiles']}, f'{output_prefix}_users.json')
+        sys.exit(0)
+
     try:
-        mst_file_path = Path(options.mediasite_file)
+        mst_file_path = Path(f'{output_prefix}_all_data.json')
         if mst_file_path.is_file():
             logger.info(f'Found collected data in {mst_file_path}')
 
@@ -53,12 +84,12 @@ if __name__ == '__main__':
 
         mediasite_data_to_store_attributs = ['all_data', 'folders_presentations', 'users']
         for data_attr in mediasite_data_to_store_attributs:
-            utils.store_object_data_in_json(obj=extractor, data_attr=data_attr, prefix_filename='data/mediasite')
+            utils.store_object_data_in_json(obj=extractor, data_attr=data_attr, prefix_filename=output_prefix)
 
         logger.info('--------- Data collection finished --------- ')
         failed_count = len(extractor.failed_presentations)
         if failed_count:
-            logger.warning(f'Some errors on data collect for {failed_count} presentations. See report in failed.csv')
+            logger.warning(f'Some errors on data collect for {failed_count} presentations. See report in {options.failed_csvfile}')
 
     except KeyboardInterrupt:
         logger.warning('Interrupted by user. Not keeping collected data.')
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''
+Run local Mediasite and MediaServer API emulators, and write a config file pointing to them,
+so that collect.py and migrate.py can be run without network access, e.g.:
+
+    python3 bin/emulate.py --data-file tests/mediasite_test_data.json --copies 1000
+    python3 bin/emulate.py --presentations 100000
+    python3 bin/collect.py --config-file config-emulated.json
+'''
+import argparse
+import json
+import logging
+import time
+
+import mediasite_migration_scripts.utils.common as utils
+from tests.datasets import DatasetGenerator
+from tests.emulators import MediasiteEmulator, MediaServerEmulator, scale_data
+
+
+if __name__ == '__main__':
+    def manage_opts():
+        parser = argparse.ArgumentParser(description='This script runs local Mediasite and MediaServer API emulators.')
+        parser.add_argument('-v', '--verbose',
+                            action='store_true',
+                            default=False,
+                            help='print all status messages to stdout.')
+        parser.add_argument('-q', '--quiet',
+                            action='store_true',
+                            default=False,
+                            help='print only error status messages to stdout.')
+        parser.add_argument('--data-file',
+                            default='tests/mediasite_test_data.json',
+                            help='Mediasite data file (collect output format) served by the Mediasite emulator.')
+        parser.add_argument('--copies',
+                            type=int,
+                            default=1,
+                            help='Replicate the data this amount of times (with new ids).')
+        parser.add_argument('--presentations',
+                            type=int,
+                            help='Serve generated data with this amount of presentations instead of --data-file (see bin/generate_data.py).')
+        parser.add_argument('--host',
+                            default='127.0.0.1',
+                            help='Address to listen on.')
+        parser.add_argument('--mediasite-port',
+                            type=int,
+                            default=8001)
+        parser.add_argument('--mediaserver-port',
+                            type=int,
+                            default=8002)
+        parser.add_argument('--latency-ms',
+                            type=int,
+                            default=0,
+                            help='Latency added to every response.')
+        parser.add_argument('--jitter-ms',
+                            type=int,
+                            default=0,
+                            help='Random latency added on top of --latency-ms.')
+        parser.add_argument('--error-rate',
+                            type=float,
+                            default=0,
+                            help='Ratio (0 to 1) of requests answered with an error.')
+        parser.add_argument('--error-codes',
+                            default='503',
+                            help='Status codes of the injected errors (csv).')
+        parser.add_argument('--missing-files-rate',
+                            type=float,
+                            default=0,
+                            help='Ratio (0 to 1) of video and slide files not found.')
+        parser.add_argument('--seed',
+                            type=int,
+                            default=0)
+        parser.add_argument('--config-file',
+                            default='config.json.example',
+                            help='Base config file, completed with the emulators urls and credentials.')
+        parser.add_argument('--output-config-file',
+                            default='config-emulated.json',
+                            help='Path of the generated config file.')
+        return parser.parse_args()
+
+    options = manage_opts()
+    logger = utils.set_logger(options)
+
+    injection = {
+        'host': options.host,
+        'latency_ms': options.latency_ms,
+        'jitter_ms': options.jitter_ms,
+        'error_rate': options.error_rate,
+        'error_codes': [int(code) for code in options.error_codes.split(',')],
+        'seed': options.seed,
+    }
+
+    if options.presentations:
+        data = DatasetGenerator(options.presentations, seed=options.seed).generate()
+    else:
+        data = scale_data(utils.read_json(options.data_file), options.copies)
+    users = data.get('UserProfiles') or []
+    usernames = users.keys() if isinstance(users, dict) else [u['UserName'] for u in users]
+
+    mediasite = MediasiteEmulator(data, port=options.mediasite_port, missing_files_rate=options.missing_files_rate, **injection)
+    mediaserver = MediaServerEmulator(usernames, port=options.mediaserver_port, **injection)
+    mediasite.start()
+    mediaserver.start()
+
+    config = utils.read_json(options.config_file) or dict()
+    config.update(mediasite.get_config())
+    config.update(mediaserver.get_config())
+    with open(options.output_config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+    logger.info(f'Serving {len(mediasite.folders)} folders and {len(mediasite.presentations)} presentations, config written in {options.output_config_file}')
+
+    try:
+        while True:
+            time.sleep(60)
+            logging.debug(f'Mediasite: {mediasite.get_stats()} / MediaServer: {mediaserver.get_stats()}')
+    except KeyboardInterrupt:
+        logger.info(f'Mediasite requests: {mediasite.get_stats()}')
+        logger.info(f'MediaServer requests: {mediaserver.get_stats()}')
+    finally:
+        mediasite.stop()
+        mediaserver.stop()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+'''
+Generate synthetic Mediasite data (mediasite_all_data.json format), e.g.:
+
+    python3 bin/generate_data.py --presentations 1000000 --folders 50000 --depth 4 --seed 1
+'''
+import argparse
+
+import mediasite_migration_scripts.utils.common as utils
+from tests.datasets import DatasetGenerator, PRESENTATIONS_TYPES
+
+
+if __name__ == '__main__':
+    def manage_opts():
+        parser = argparse.ArgumentParser(description='This script generates synthetic Mediasite data, at any scale.')
+        parser.add_argument('-v', '--verbose',
+                            action='store_true',
+                            default=False,
+                            help='print all status messages to stdout.')
+        parser.add_argument('-q', '--quiet',
+                            action='store_true',
+                            default=False,
+                            help='print only error status messages to stdout.')
+        parser.add_argument('--presentations',
+                            type=int,
+                            default=1000,
+                            help='Amount of presentations.')
+        parser.add_argument('--folders',
+                            type=int,
+                            help='Amount of folders, besides users folders (default: 1 per 20 presentations).')
+        parser.add_argument('--depth',
+                            type=int,
+                            default=3,
+                            help='Depth of the folders tree.')
+        parser.add_argument('--users',
+                            type=int,
+                            help='Amount of users folders in "Mediasite Users" (default: 1 per 5 folders).')
+        parser.add_argument('--types',
+                            help=f'Weights of the presentations types, e.g. "video=50,composite=50" (default: {",".join(f"{k}={v}" for k, v in PRESENTATIONS_TYPES.items())}).')
+        parser.add_argument('--seed',
+                            type=int,
+                            default=0,
+                            help='Same seed and options give the same data.')
+        parser.add_argument('-o', '--output',
+                            default='mediasite_generated_data.json',
+                            help='Path of the generated data file.')
+        return parser.parse_args()
+
+    options = manage_opts()
+    logger = utils.set_logger(options)
+
+    types_weights = None
+    if options.types:
+        types_weights = {name: int(weight) for name, weight in (t.split('=') for t in options.types.split(','))}
+
+    generator = DatasetGenerator(
+        presentations=options.presentations,
+        folders=options.folders,
+        depth=options.depth,
+        users=options.users,
+        seed=options.seed,
+        types_weights=types_weights,
+    )
+    generator.write(options.output)
@@ -4,10 +4,19 @@
 import json
 import sys
 from mediasite_migration_scripts.utils import common as utils
+from mediasite_migration_scripts.utils import nginx
 
 
 conf_template = '''
 # nginx config file for preserving original presentation and channel urls
+# the map of the redirections needs these settings in the http block:
+# map_hash_bucket_size %s;
+# map_hash_max_size %s;
+
+map $uri $mediasite_redirection {
+	default "";
+	include %s;
+}
 
 server {
 	listen 80;
@@ -26,16 +35,15 @@ server {
 	listen 443 ssl http2;
 	server_name %s;
 
-%s
-
 	location / {
+		if ($mediasite_redirection) {
+			return 301 $mediasite_redirection;
+		}
 		return 404;
 	}
 }
 '''
 
-block_template = '\tlocation ~* {from_url} {{ return 301 {to_url}; }}\n'
-
 argparser = utils.get_argparser()
 
 argparser.add_argument(
@@ -43,6 +51,12 @@ argparser.add_argument(
     help='File containing additional URLs (one by line, each line should finish with presentation id like https://mymsite.com/Site1/MyMediasite/presentations/7b81b5a84d454d4e8cae691c7e6efe2sj8)'
 )
 
+argparser.add_argument(
+    '--map-folder',
+    default='/etc/nginx',
+    help='Folder where the map file of the redirections will be copied, for the include directive of the config (default: /etc/nginx)'
+)
+
 args = argparser.parse_args()
 
 conf = utils.read_json('config.json')
@@ -54,6 +68,8 @@ if args.additional_redirections_file:
     with open(args.additional_redirections_file, 'r') as f:
         additional_redirections = f.read()
         for line in additional_redirections.split('\n'):
+            if not line.strip():
+                continue
             pid = line.rstrip('/').split('/')[-1]
             if additional_redirections_dict.get(pid) is None:
                 additional_redirections_dict[pid] = list()
@@ -65,24 +81,25 @@ if args.additional_redirections_file:
 
 from_root = '/'.join(conf['mediasite_api_url'].split('/')[:3])
 nginx_server_name = from_root.replace('https://', '')
-nginx_block = ''
-
-redirections_copy = dict(redirections)
-for from_url, to_url in redirections.items():
-    pid = from_url.split('/')[-1]
-    if additional_redirections_dict.get(pid) is not None:
-        add = additional_redirections_dict[pid]
-        for r in add:
-            redirections_copy[r] = to_url
-
-for from_url, to_url in redirections_copy.items():
-    if from_root not in from_url:
-        print(f'Configuration mismatch, {from_root} not found')
-        sys.exit(1)
-    from_url = from_url.replace(from_root, '')
-    nginx_block += block_template.format(**locals())
-
-nginx_conf = conf_template % (nginx_server_name, nginx_server_name, nginx_block)
+
+try:
+    exact, regexes = nginx.get_map_entries(redirections, from_root, additional_redirections_dict)
+except ValueError as e:
+    print(e)
+    sys.exit(1)
+print(f'{len(exact)} exact entries and {len(regexes)} regex entries in the redirections map')
+
+hash_sizes = nginx.get_map_hash_sizes(list(exact))
+if hash_sizes is None:
+    print('Could not find map hash sizes, set map_hash_bucket_size and map_hash_max_size manually')
+    sys.exit(1)
+print(f'Add to the http block of nginx.conf: map_hash_bucket_size {hash_sizes[0]}; map_hash_max_size {hash_sizes[1]};')
+
+map_path = f'{nginx_server_name}_redirections.map'
+print(f'Writing redirections map into {map_path}')
+nginx.write_map(map_path, exact, regexes)
+
+nginx_conf = conf_template % (*hash_sizes, f'{args.map_folder.rstrip("/")}/{map_path}', nginx_server_name, nginx_server_name)
 
 nginx_conf_path = f'{nginx_server_name}.conf'
 with open(nginx_conf_path, 'w') as f:
@@ -2,6 +2,7 @@
 import json
 import argparse
 import mediasite_migration_scripts.utils.mediasite as mediasite
+from mediasite_migration_scripts.utils.catalog import Catalog
 
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -35,6 +36,12 @@ parser.add_argument(
     default='name,path,id'
 )
 
+parser.add_argument(
+    '--catalog',
+    type=str,
+    help='Search into this catalog (see bin/build_catalog.py) instead of loading the json file',
+)
+
 args = parser.parse_args()
 input_file = args.input_file
 fields = args.search_fields.split(',')
@@ -46,41 +53,59 @@ search_results_folders = list()
 search_results_presentations = list()
 search_results_channels = list()
 
-with open(input_file, 'r') as f:
-    print(f'Loading {input_file}')
-    d = json.load(f)
-    s = args.search
-    if s:
-        print(f'Searching for {s} in fields {fields}')
-    for f in d:
-        folders += 1
-        presentations += len(f.get('presentations', []))
-        channels += len(f.get('channels', []))
 
+def hide_slides(presentation):
+    p_copy = dict(presentation)
+    slides_count = mediasite.get_slides_count(presentation)
+    p_copy['slides'] = [f'{slides_count} slides (hidden)']
+    return p_copy
+
+
+if args.catalog:
+    catalog = Catalog.open(args.catalog)
+    counts = catalog.counts()
+    folders, presentations, channels = counts['folders'], counts['presentations'], counts['channels']
+    if args.search:
+        print(f'Searching for {args.search} in fields {fields} of {args.catalog}')
+        found = catalog.search(args.search, fields)
+        search_results_folders = found['folders']
+        search_results_presentations = [hide_slides(p) for p in found['presentations']]
+        search_results_channels = found['channels']
+    catalog.close()
+else:
+    with open(input_file, 'r') as f:
+        print(f'Loading {input_file}')
+        d = json.load(f)
+        s = args.search
         if s:
-            # hide content that is too verbose
-            f_copy = dict(f)
-            f_copy['presentations'] = [f'{len(f["presentations"])} presentations (hidden)']
-
-            for field in fields:
-                val = f.get('field')
-                if val and s in val:
-                    if f_copy not in search_results_folders:
-                        search_results_folders.append(f_copy)
-                        print(f'Found term "{s}" in field "{field}" of folder {f_copy["id"]}')
-                for p in f.get('presentations', []):
-                    p_copy = dict(p)
-                    slides_count = mediasite.get_slides_count(p)
-                    p_copy['slides'] = [f'{slides_count} slides (hidden)']
-                    if s in p.get(field, ''):
-                        if p_copy not in search_results_presentations:
-                            search_results_presentations.append(p_copy)
-                            print(f'Found term "{s}" in field "{field}" of presentation {p_copy["id"]}')
-                for c in f.get('channels', []):
-                    if s in c.get(field, ''):
-                        if c not in search_results_channels:
-                            search_results_channels.append(c)
-                            print(f'Found term "{s}" in field "{field}" of channel {c["id"]}')
+            print(f'Searching for {s} in fields {fields}')
+        for f in d:
+            folders += 1
+            presentations += len(f.get('presentations', []))
+            channels += len(f.get('channels', []))
+
+            if s:
+                # hide content that is too verbose
+                f_copy = dict(f)
+                f_copy['presentations'] = [f'{len(f["presentations"])} presentations (hidden)']
+
+                for field in fields:
+                    val = f.get('field')
+                    if val and s in val:
+                        if f_copy not in search_results_folders:
+                            search_results_folders.append(f_copy)
+                            print(f'Found term "{s}" in field "{field}" of folder {f_copy["id"]}')
+                    for p in f.get('presentations', []):
+                        p_copy = hide_slides(p)
+                        if s in p.get(field, ''):
+                            if p_copy not in search_results_presentations:
+                                search_results_presentations.append(p_copy)
+                                print(f'Found term "{s}" in field "{field}" of presentation {p_copy["id"]}')
+                    for c in f.get('channels', []):
+                        if s in c.get(field, ''):
+                            if c not in search_results_channels:
+                                search_results_channels.append(c)
+                                print(f'Found term "{s}" in field "{field}" of channel {c["id"]}')
 
 
 def print_short(items, max_items=10):
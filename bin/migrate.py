@@ -3,10 +3,12 @@ import argparse
 import os
 import sys
 import logging
+import time
 import traceback
 
 from mediatransfer import MediaTransfer
 import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.workqueue import WorkQueueServer
 
 if __name__ == '__main__':
     def manage_opts():
@@ -49,6 +51,13 @@ if __name__ == '__main__':
                  instead, MediaServer will be queried to check if media have already been uploaded.
                  Use it if the redirection or mediaserver data files are outdated.'''
         )
+        parser.add_argument(
+            '--clear-mapping-cache',
+            action='store_true',
+            default=False,
+            help='''Map all presentations again, instead of reusing the mapping (and resources checks) of previous runs.
+                 The cache is also cleared when the Mediasite data file or the formats settings change.'''
+        )
         parser.add_argument(
             '--download-folder',
             type=str,
@@ -73,6 +82,52 @@ if __name__ == '__main__':
             default=False,
             help='Skip importing media that are not composite videos.'
         )
+        parser.add_argument(
+            '--coordinator',
+            action='store_true',
+            default=False,
+            help='''Only queue the presentations to migrate in the work queue, they will be migrated by workers (see --worker).
+                 Can be run again to add new presentations.'''
+        )
+        parser.add_argument(
+            '--worker',
+            action='store_true',
+            default=False,
+            help='''Migrate presentations claimed from the work queue filled by the coordinator.
+                 Several workers can share the same work queue: processes of the coordinator host use the work queue file,
+                 workers of other hosts the work queue served by the coordinator (see --serve-queue and --queue-url).'''
+        )
+        parser.add_argument(
+            '--worker-id',
+            type=str,
+            default=None,
+            help='Worker name in the work queue (default: hostname-pid).'
+        )
+        parser.add_argument(
+            '--work-queue',
+            type=str,
+            default=None,
+            help='Path to the work queue file, on a local disk of the coordinator host (default: work_queue_file in config, or <download folder>/work_queue.sqlite).'
+        )
+        parser.add_argument(
+            '--reset-queue',
+            action='store_true',
+            default=False,
+            help='With --coordinator, clear the work queue before filling it.'
+        )
+        parser.add_argument(
+            '--serve-queue',
+            action='store_true',
+            default=False,
+            help='''With --coordinator, serve the work queue to the workers of other hosts once filled (on work_queue_port of config, 8765 by default),
+                 until interrupted.'''
+        )
+        parser.add_argument(
+            '--queue-url',
+            type=str,
+            default=None,
+            help='With --worker, url of the work queue served by the coordinator, e.g. http://coordinator:8765 (default: work_queue_url in config).'
+        )
         return parser.parse_args()
 
     options = manage_opts()
@@ -116,6 +171,24 @@ if __name__ == '__main__':
 
     mediatransfer = MediaTransfer(config, mediasite_data)
 
+    if options.coordinator:
+        counts = mediatransfer.fill_work_queue(reset=options.reset_queue)
+        print(f'Work queue: {counts}')
+        if options.serve_queue:
+            server = WorkQueueServer.from_config(config, mediatransfer.work_queue)
+            server.start()
+            print(f'Serving the work queue on port {server.port}, interrupt once all the workers are done')
+            try:
+                while True:
+                    time.sleep(60)
+                    mediatransfer.log_work_queue_counts()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.stop()
+        logger.info('----- END SCRIPT ' + 50 * '-' + '\n')
+        sys.exit(0)
+
     logger.info('Uploading videos')
     try:
         uploaded_medias_stats = mediatransfer.upload_medias(options.max_videos)
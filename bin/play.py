@@ -4,9 +4,10 @@ import argparse
 import os
 import sys
 from pathlib import Path
-import requests
 import mediasite_migration_scripts.utils.common as utils
 import mediasite_migration_scripts.utils.media as media
+from mediasite_migration_scripts.utils import http
+from mediasite_migration_scripts.utils.catalog import Catalog, FORMAT_ANALYZER
 
 
 def get_video_urls(presentation):
@@ -60,6 +61,19 @@ if __name__ == '__main__':
         default='mediasite_data.json',
     )
 
+    parser.add_argument(
+        '--catalog',
+        type=str,
+        help='Look up presentations in this catalog of the mediasite json data (see bin/build_catalog.py) instead of loading the json file',
+    )
+
+    parser.add_argument(
+        '--config-file',
+        type=str,
+        help='Json config file (HTTP settings).',
+        default='config.json',
+    )
+
     parser.add_argument(
         '--input-file',
         type=str,
@@ -79,18 +93,30 @@ if __name__ == '__main__':
         parser.print_help()
         sys.exit(1)
 
+    config = utils.read_json(args.config_file) if os.path.isfile(args.config_file) else dict()
+
     presentations = list()
-    print(f'Searching for {len(presentation_ids)} presentations in {args.data_file}')
-    with open(args.data_file, 'r') as f:
-        data = json.load(f)
-        for folder in data:
-            for pres in folder['presentations']:
-                if pres['id'] in presentation_ids:
-                    # needed to get path etc
-                    pres['folder_path'] = folder['path']
-                    pres['folder_id'] = folder['id']
-                    pres['folder_channels'] = folder['channels']
-                    presentations.append(pres)
+    print(f'Searching for {len(presentation_ids)} presentations in {args.catalog or args.data_file}')
+    if args.catalog:
+        catalog = Catalog.open(args.catalog)
+        catalog.check_format(FORMAT_ANALYZER)
+        found = catalog.get_presentations(presentation_ids)
+        catalog.close()
+    else:
+        found = list()
+        ids = set(presentation_ids)
+        with open(args.data_file, 'r') as f:
+            data = json.load(f)
+            for folder in data:
+                for pres in folder['presentations']:
+                    if pres['id'] in ids:
+                        found.append((folder, pres))
+    for folder, pres in found:
+        # needed to get path etc
+        pres['folder_path'] = folder['path']
+        pres['folder_id'] = folder['id']
+        pres['folder_channels'] = folder['channels']
+        presentations.append(pres)
     print(f'Found {len(presentations)} presentations')
     if presentations:
         for index, presentation in enumerate(presentations):
@@ -116,7 +142,7 @@ if __name__ == '__main__':
                 else:
                     print(utils.get_progress_string(index, len(presentations)) + f' Downloading {pres_id}')
                     root.mkdir(parents=True, exist_ok=True)
-                    with requests.Session() as session:
+                    with http.create_session(config) as session:
                         with open(root / 'mediasite_metadata.json', 'w') as f:
                             json.dump(presentation, f, sort_keys=True, indent=4)
                         for name, url in video_urls.items():
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 import json
-import logging
 from mediasite_migration_scripts.utils import common as utils
+from mediasite_migration_scripts.utils import http
+from mediasite_migration_scripts.utils.catalog import Catalog
 from mediasite_migration_scripts.ms_client.client import MediaServerClient
 from mediasite_migration_scripts.utils.mediasite import MediasiteClient
+from mediasite_migration_scripts.utils.ratelimit import RateLimiter
+from mediasite_migration_scripts.utils.report import ReportVerifier
+from mediasite_migration_scripts.utils.state import StateStore
 
 argparser = utils.get_argparser()
 argparser.add_argument(
@@ -16,16 +20,23 @@ argparser.add_argument(
     action='store_true',
     help='Update MediaServer media published status to match the Private status in MediaSite',
 )
+argparser.add_argument(
+    '--reset',
+    action='store_true',
+    help='Verify all presentations again, instead of resuming the previous report (recorded in report_state_file of config, or report_state.sqlite)',
+)
+argparser.add_argument(
+    '--catalog',
+    help='Read the presentations from this catalog of the mediasite data (see bin/build_catalog.py) instead of mediasite_data.json',
+)
 args = argparser.parse_args()
 
-utils.setup_logging(args.verbose)
+utils.set_logger(options=args)
 
 config = utils.read_json('config.json')
-mediasite_data = utils.read_json('mediasite_data.json')
 redirections = utils.read_json('redirections.json')
-redirections_copy = dict(redirections)
 
-mediasite_client = MediasiteClient(config)
+mediasite_client = MediasiteClient(config, rate_limiter=RateLimiter.from_config(config, 'mediasite'))
 mediasite_cname = utils.get_mediasite_host(config['mediasite_api_url'])
 mediasite_play_url_pattern = f'https://{mediasite_cname}/Site1/Play/'
 
@@ -35,93 +46,61 @@ ms_config = {
     'SERVER_URL': config['mediaserver_url'],
     'TIMEOUT': 60,
 }
-ms_client = MediaServerClient(local_conf=ms_config, setup_logging=False)
-
-
-def get_mediaserver_media(oid):
-    return ms_client.api('medias/get/', params={'oid': oid, 'path': 'yes'}, ignored_status_codes=[404])
-
+# one client per verification thread, their sessions are not shared
+ms_clients = http.ThreadClients(lambda: MediaServerClient(local_conf=ms_config, setup_logging=False))
 
-def get_mediaserver_path(media):
-    path_str = ''
-    if media and media['success']:
-        path = media['info']['path']
-        for p in path:
-            path_str += p['title'] + '/'
-        return path_str + oid
-    else:
-        return
 
+def ms_api(suffix, **kwargs):
+    return ms_clients.api(suffix, ignored_status_codes=[404], **kwargs)
 
-def set_media_published(oid, published_bool):
-    logging.info(f'Setting {oid} to validated: {published_bool}')
-    r = ms_client.api('medias/edit/', method='post', data={'oid': oid, 'validated': 'yes' if published_bool else 'no'})
-    if not r or not r['success']:
-        logging.error(r)
 
-
-rows = list()
-folders_to_process = list()
-total_presentations = processed_presentations = skipped_presentations = 0
+presentations = list()
+folders_count = 0
 print('Filtering folders')
-for folder in mediasite_data:
-    if utils.is_folder_to_add(folder['path'], config):
-        folders_to_process.append(folder)
-        total_presentations += len(folder['presentations'])
-
-print(f'Verifying {len(folders_to_process)} folders and {total_presentations} presentations')
-for f in folders_to_process:
-    for p in f['presentations']:
-        oid = mediaserver_path = 'SKIPPED'
-        print(utils.get_progress_string(processed_presentations, total_presentations), end='\r')
-        processed_presentations += 1
-        p_id = p['id']
-        should_be_published = False
-        if args.fix_private:
-            presentation = mediasite_client.get_presentation(p_id)
-            if presentation:
-                private = presentation['Private']
-                status = presentation['Status']
-                should_be_published = (status == 'Viewable') and not private
-            else:
-                # presentation does not exist
-                pass
-        p_path = f['path'] + '/' + p_id
-        mediasite_url = mediasite_play_url_pattern + p_id
-        mediaserver_url = redirections.get(mediasite_url)
-        if mediaserver_url:
-            oid = mediaserver_url.split('/')[4]
-            media = get_mediaserver_media(oid)
-            if args.fix_private:
-                is_published = media['info']['validated']
-                if is_published != should_be_published:
-                    print(f'Video {oid} published status mismatch: {is_published} vs expected {should_be_published}')
-                    if args.apply_changes:
-                        set_media_published(oid, should_be_published)
-                    else:
-                        logging.info(f'Dry run: not setting {oid} published to {should_be_published}')
-            mediaserver_path = get_mediaserver_path(media)
-            if not mediaserver_path:
-                print(f'{oid} missing, it will be removed from the redirections')
-                redirections_copy.pop(mediasite_url)
-        else:
-            mediaserver_url = 'SKIPPED'
-            skipped_presentations += 1
-
-        rows.append({
-            'mediasite_path': p_path,
-            'mediaserver_path': mediaserver_path,
-            'mediasite_url': mediasite_url,
-            'mediaserver_url': mediaserver_url
-        })
-
-print()
-print(f'{skipped_presentations}/{total_presentations} presentations have not been migrated')
-
-print('Writing csv')
+if args.catalog:
+    catalog = Catalog.open(args.catalog)
+    presentations = [(path, p_id) for path, p_id in catalog.list_presentations() if utils.is_folder_to_add(path, config)]
+    folders_count = len(set(path for path, p_id in presentations))
+    catalog.close()
+else:
+    mediasite_data = utils.read_json('mediasite_data.json')
+    for folder in mediasite_data:
+        if utils.is_folder_to_add(folder['path'], config):
+            folders_count += 1
+            presentations.extend((folder['path'], p['id']) for p in folder['presentations'])
+
+print(f'Verifying {folders_count} folders and {len(presentations)} presentations')
+state = StateStore(config.get('report_state_file') or 'report_state.sqlite')
+verifier = ReportVerifier.from_config(
+    config,
+    ms_api,
+    redirections,
+    mediasite_play_url_pattern,
+    get_presentation=mediasite_client.get_presentation,
+    state=state,
+    fix_private=args.fix_private,
+    apply_changes=args.apply_changes,
+)
 csv_filename = 'report.csv'
-fieldnames = ['mediasite_path', 'mediaserver_path', 'mediasite_url', 'mediaserver_url']
-utils.write_csv(csv_filename, fieldnames, rows)
+print(f'Writing csv {csv_filename}')
+try:
+    results = verifier.run(presentations, csv_filename, reset=args.reset)
+finally:
+    ms_clients.close()
+    state.close()
+
+print(f'{verifier.stats["skipped"]}/{len(presentations)} presentations have not been migrated')
+if args.fix_private:
+    print(f'{verifier.stats["mismatches"]} published status mismatches, {verifier.stats["fixed"]} fixed')
+if verifier.stats['errors']:
+    print(f'{verifier.stats["errors"]} presentations could not be verified, run the report again to verify them')
+
+redirections_copy = dict(redirections)
+for result in results.values():
+    if result['missing']:
+        mediasite_url = result['row']['mediasite_url']
+        print(f'{redirections[mediasite_url].split("/")[4]} missing, it will be removed from the redirections')
+        redirections_copy.pop(mediasite_url)
 
 if redirections_copy != redirections:
     fixed_redirections_path = 'redirections_fixed.json'
@@ -1,7 +1,7 @@
-import requests
 import logging
 from mediasite_migration_scripts.utils.mediasite import get_age_days
 import mediasite_migration_scripts.utils.mediasite as mediasite
+from mediasite_migration_scripts.utils import http
 import json
 
 logger = logging.getLogger(__name__)
@@ -54,21 +54,27 @@ class DataAnalyzer():
         downloadable_mp4 = list()
         status_codes = dict()
         logger.info(f'Counting downloadable mp4s (among {len(self.mp4_urls)} urls)')
-        with requests.Session() as session:
+        # not the entries of the HEAD requests made by collect and migrate
+        cache = http.UrlStatusCache.from_config(self.config or dict(), namespace=http.UrlStatusCache.GET_NAMESPACE)
+        with http.create_session(self.config or dict()) as session:
             for index, url in enumerate(self.mp4_urls):
                 print(f'[{index + 1}]/[{len(self.mp4_urls)}] -- {int(100 * (index + 1) / len(self.mp4_urls))}%', end='\r')
-                ok = False
-                # IIS returns 401 when trying head(), so let us just test the smallest GET possible
-                with session.get(url, stream=True) as r:
-                    code = str(r.status_code)
-                    if not status_codes.get(code):
-                        status_codes[code] = 0
-                    status_codes[code] += 1
-                    ok = r.ok
-
-                if ok:
+                entry = cache.get_fresh(url) if cache else None
+                if entry is None:
+                    # IIS returns 401 when trying head(), so let us just test the smallest GET possible
+                    with session.get(url, stream=True) as r:
+                        entry = cache.set(url, r) if cache else {'status': r.status_code}
+                code = str(entry['status'])
+                if not status_codes.get(code):
+                    status_codes[code] = 0
+                status_codes[code] += 1
+
+                if entry['status'] < 400:
                     downloadable_mp4.append(url)
+            http.log_pool_stats(session, 'Mediasite files session')
 
+        if cache:
+            cache.log_stats()
         return {'downloadable_mp4': downloadable_mp4, 'status_codes': status_codes}
 
     def analyse_folders(self):
@@ -350,8 +356,7 @@ class DataAnalyzer():
 
     @staticmethod
     def find_best_format(video):
-        formats_priority = ['video/mp4', 'video/x-ms-wmv', 'video/x-mp4-fragmented']
-        for priority in formats_priority:
+        for priority in mediasite.VIDEO_FORMATS_PRIORITY:
             for file in video['videos'][0]['files']:
                 if file['format'] == priority:
                     return file['format']
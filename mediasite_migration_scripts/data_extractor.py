@@ -1,13 +1,17 @@
 import logging
+import queue
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dataclasses import dataclass, asdict, fields
-from functools import lru_cache
 
 from mediasite_migration_scripts.assets.mediasite import controller as mediasite_client
+import utils.cache as cache
 import utils.common as utils
 import utils.http as http
+import utils.ratelimit as ratelimit
 import utils.mediasite as mediasite_utils
+from utils.state import StateStore
 
 logger = logging.getLogger(__name__)
 
@@ -26,13 +30,46 @@ class DataExtractor():
         self.mediasite_client = mediasite_client.controller(config)
         self.mediasite_client_config = config
 
-        self.session = http.get_session(config['mediasite_api_user'], config['mediasite_api_password'])
+        # API calls, urls checks and slides downloads share the same rate, adjusted to the server health
+        self.rate_limiter = ratelimit.RateLimiter.from_config(config, 'mediasite')
+        self.session = http.get_session(config['mediasite_api_user'], config['mediasite_api_password'], config=config, rate_limiter=self.rate_limiter)
+        # large listings are fetched by parallel pages windows (mediasite_listing_workers set to 0 to list with the Mediasite client)
+        self.listing_client = None
+        if config.get('mediasite_listing_workers', 4):
+            self.listing_client = mediasite_utils.MediasiteClient(config, rate_limiter=self.rate_limiter)
+        # videos and slides urls checks are kept between runs (and shared with migrate and analyze)
+        self.url_status_cache = http.UrlStatusCache.from_config(config)
+        http.set_url_status_cache(self.session, self.url_status_cache)
+        # users profiles can be kept for the next runs (cache_persist)
+        cache_state = None
+        if config.get('cache_persist'):
+            cache_state = StateStore(config.get('collect_cache_file') or Path(config.get('download_folder', '/downloads')) / 'collect_cache.sqlite')
+        # content servers and encoding settings are shared by many presentations
+        self.caches = cache.get_caches(config, ['users', 'content_servers', 'encoding_settings'], state=cache_state, persisted=['users'])
         self.max_folders = options.max_folders
+        # several collects (processes or hosts) can each crawl a disjoint part of the folder tree
+        self.shard = getattr(options, 'shard', None)
+        self.subtrees = getattr(options, 'folders', None)
+
+        # per-presentation resources and users to fetch (collect_profile: full, migrate-minimal or analyze)
+        self.collect_profile_name = getattr(options, 'profile', None) or config.get('collect_profile', 'full')
+        self.collect_profile = mediasite_utils.get_collect_profile(self.collect_profile_name)
+        logger.info(f'Collect profile: {self.collect_profile_name}')
 
         self.resources_to_get = ['Folders', 'Channels', 'Presentations']
-        self.users_types_to_fetch = ['Creator', 'Owner', 'PrimaryPresenter']
+        self.listings_params = {'Presentations': {'$select': 'full'}}
+        # presentations contents expanded inline in the presentations listing (mediasite_expand), requested one by one otherwise
+        self.expanded_contents = [
+            name for name in config.get('mediasite_expand', mediasite_utils.EXPANDABLE_CONTENTS)
+            if name not in mediasite_utils.PRESENTATION_RESOURCES or name in self.collect_profile['resources']
+        ]
+        if self.listing_client and self.expanded_contents:
+            self.listings_params['Presentations']['$expand'] = ','.join(self.expanded_contents)
+        self.contents_stats = {'inline': 0, 'requested': 0}
+        # pages of the presentations listing, consumed while the listing goes on
+        self.presentations_pages = None
+        self.users_types_to_fetch = self.collect_profile['users']
         self.presentation_videos_endpoint = 'OnDemandContent'
-        self.presentation_content_endpoints = ['TimedEvents', 'Presenters']
 
         self.failed_presentations = list()
         self.failed_presentations_errors = {
@@ -49,7 +86,8 @@ class DataExtractor():
 
         self.all_data = dict()
         self.folders_presentations = dict()
-        self.users = {'UserProfiles': list()}
+        # one profile per username, whatever the amount of presentations
+        self.users = {'UserProfiles': dict()}
         self.linked_channels = list()
 
         self.download_folder = dl = Path(config.get('download_folder', '/downloads'))
@@ -62,8 +100,18 @@ class DataExtractor():
     def run(self):
         self.folders_presentations = self.timeit(self.extract_mediasite_data)
         self.all_data = {**self.folders_presentations, **self.users}
-        self.download_all_slides()
+        logger.info(f'Downloaded {self.nb_all_downloaded_slides} / {self.all_slides_count} slides of valid presentations')
         self.write_csv_report()
+        if self.url_status_cache:
+            self.url_status_cache.log_stats()
+        if self.rate_limiter:
+            self.rate_limiter.log_stats()
+        for c in self.caches.values():
+            c.log_stats()
+        http.log_pool_stats(self.session, 'Mediasite files session')
+        if self.listing_client:
+            http.log_pool_stats(self.listing_client.session, 'Mediasite listings session')
+        logger.info(f'Presentations contents: {self.contents_stats["inline"]} expanded in listings, {self.contents_stats["requested"]} requested')
 
     def timeit(self, method):
         before = time.time()
@@ -79,6 +127,14 @@ class DataExtractor():
             logger.info(f'{method} took {took_min} minutes')
         return results
 
+    def call_api(self, method, *args, **kwargs):
+        '''
+        Call a Mediasite client method when the rate limiter allows it.
+        '''
+        if self.rate_limiter is None:
+            return method(*args, **kwargs)
+        return self.rate_limiter.call(method, *args, **kwargs)
+
     def write_csv_report(self):
         fieldnames = [field.name for field in fields(Failed)]
         failed_presentations_dict_rows = [asdict(p) for p in self.failed_presentations]
@@ -107,11 +163,17 @@ class DataExtractor():
         logger.info('Extracting and ordering metadata.')
 
         self.get_resources()
+        if self.shard or self.subtrees:
+            all_folders_count = len(self.folders)
+            self.folders = mediasite_utils.select_folders(self.folders, shard=self.shard, subtrees=self.subtrees)
+            logger.info(f'Collecting {len(self.folders)} of {all_folders_count} folders (shard: {self.shard}, subtrees: {self.subtrees})')
 
-        for i, folder in enumerate(self.folders):
-            if i > 1:
-                utils.print_progress_string(i, len(self.folders))
+        if self.max_folders:
+            self.folders = self.folders[:int(self.max_folders) + 1]
+        # presentations are collected while their listing goes on
+        self.collected_presentations = self.collect_folders_presentations({folder['Id'] for folder in self.folders})
 
+        for folder in self.folders:
             logger.debug('-' * 50)
             logger.debug(f"Found folder : {folder['Name']}")
 
@@ -119,18 +181,100 @@ class DataExtractor():
             for resource_name in self.resources_to_get:
                 if not resource_name == 'Folders':
                     get_folder_resources = self.get_resource_method('folder', resource_name)
-                    presentations_folders[i][resource_name] = get_folder_resources(folder['Id'])
-
-            if self.max_folders and i >= int(self.max_folders):
-                break
+                    folder[resource_name] = get_folder_resources(folder['Id'])
 
         return all_data
 
     def get_resources(self):
-        for resource_name in self.resources_to_get:
-            get_resource = self.get_resource_method('all', resource_name)
-            resource_items = get_resource()
-            setattr(self, resource_name.lower(), resource_items)
+        '''
+        Fetch the Folders, Channels and Presentations listings at the same time.
+        Folders and channels listings are waited for, presentations pages are queued in self.presentations_pages
+        and consumed by iter_presentations (which fills self.presentations).
+        '''
+        self.presentations = list()
+        self.presentations_pages = queue.Queue()
+        executor = ThreadPoolExecutor(max_workers=len(self.resources_to_get))
+        futures = {resource_name: executor.submit(self.fetch_listing, resource_name) for resource_name in self.resources_to_get}
+        executor.shutdown(wait=False)
+        for resource_name, future in futures.items():
+            if resource_name != 'Presentations':
+                setattr(self, resource_name.lower(), future.result())
+
+    def fetch_listing(self, resource_name):
+        '''
+            returns:
+                -> list : all items of the resource, presentations are queued page by page instead
+        '''
+        before = time.time()
+        items = list()
+        try:
+            for page in self.iter_listing_pages(resource_name):
+                if resource_name == 'Presentations':
+                    self.presentations_pages.put(page)
+                else:
+                    items.extend(page)
+        except Exception as e:
+            logger.error(f'Failed to list {resource_name}: {e}')
+            if resource_name != 'Presentations':
+                raise
+            self.presentations_pages.put(e)
+        finally:
+            if resource_name == 'Presentations':
+                self.presentations_pages.put(None)
+        logger.info(f'Listing {resource_name} took {int(time.time() - before)}s')
+        return items
+
+    def iter_listing_pages(self, resource_name):
+        if self.listing_client is None:
+            yield self.get_resource_method('all', resource_name)()
+            return
+
+        params = self.listings_params.get(resource_name) or dict()
+        pages = self.listing_client.iter_pages(resource_name, params)
+        try:
+            first_page = next(pages)
+        except RuntimeError as e:
+            if '$expand' not in params:
+                raise
+            logger.warning(f'Listing {resource_name} with {params["$expand"]} expanded failed ({e}), contents will be requested one by one')
+            params = {k: v for k, v in params.items() if k != '$expand'}
+            pages = self.listing_client.iter_pages(resource_name, params)
+            first_page = next(pages)
+        yield first_page
+        yield from pages
+
+    def iter_presentations(self):
+        '''
+        Presentations as their listing pages arrive (or already listed presentations).
+        '''
+        if self.presentations_pages is None:
+            yield from self.presentations
+            return
+        while True:
+            page = self.presentations_pages.get()
+            if page is None:
+                break
+            if isinstance(page, Exception):
+                raise page
+            self.presentations.extend(page)
+            yield from page
+        self.presentations_pages = None
+
+    def collect_folders_presentations(self, folders_ids):
+        '''
+            returns:
+                -> dict : collected presentations per folder id (in listing order)
+        '''
+        folders_presentations = {folder_id: list() for folder_id in folders_ids}
+        for i, presentation in enumerate(self.iter_presentations()):
+            if i > 1:
+                utils.print_progress_string(i, len(self.presentations))
+            folder_presentations = folders_presentations.get(presentation.get('ParentFolderId'))
+            if folder_presentations is not None:
+                presentation_resources = self.collect_presentation(presentation)
+                if presentation_resources:
+                    folder_presentations.append(presentation_resources)
+        return folders_presentations
 
     def get_resource_method(self, prefix, resource_name):
         resource_attr = resource_name.lower()
@@ -156,35 +300,31 @@ class DataExtractor():
         return folder_channels
 
     def get_folder_presentations(self, folder_id):
-        folder_presentations = list()
-        children_presentations = list()
-        # find presentations in folder
-        for presentation in self.presentations:
-            if presentation.get('ParentFolderId') == folder_id:
-                children_presentations.append(presentation)
-
-        logger.debug(f'Gettings infos for {len(children_presentations)} presentations for folder: {folder_id}')
-
-        for p in children_presentations:
-            pid = p.get('Id')
-            presentation_resources = dict()
-            try:
-                presentation_resources = self.get_presentation_resources(p)
-            except Exception:
-                logger.error(f'Getting presentation info for {pid} failed, sleeping 5 minutes before retrying')
-                # time.sleep(5 * 60)
-                try:
-                    presentation_resources = self.get_presentation_resources(p)
-                    logger.info(f'Second try for {pid} passed')
-                    folder_presentations.append(presentation_resources)
-                except Exception as e:
-                    logger.error(f'Failed to get info for presentation {pid}, moving to the next one: {e}')
-                    self.failed_presentations.append(Failed(pid, error=self.failed_presentations_errors['request'], critical=True))
+        return self.collected_presentations.get(folder_id, list())
 
-            if presentation_resources and self._to_collect(pid):
-                folder_presentations.append(presentation_resources)
+    def collect_presentation(self, presentation):
+        '''
+            returns:
+                -> dict : presentation with its resources, empty if it cannot be migrated
+        '''
+        pid = presentation.get('Id')
+        presentation_resources = dict()
+        try:
+            presentation_resources = self.get_presentation_resources(presentation)
+        except Exception:
+            logger.error(f'Getting presentation info for {pid} failed, waiting before retrying')
+            if self.rate_limiter:
+                self.rate_limiter.backoff(attempt=4)
+            try:
+                presentation_resources = self.get_presentation_resources(presentation)
+                logger.info(f'Second try for {pid} passed')
+            except Exception as e:
+                logger.error(f'Failed to get info for presentation {pid}, moving to the next one: {e}')
+                self.failed_presentations.append(Failed(pid, error=self.failed_presentations_errors['request'], critical=True))
 
-        return folder_presentations
+        if presentation_resources and self._to_collect(pid):
+            return presentation_resources
+        return dict()
 
     def _to_collect(self, presentation_id):
         for failed_p in self.failed_presentations:
@@ -198,7 +338,7 @@ class DataExtractor():
         logger.debug('-' * 50)
         logger.debug(f"Getting resources for presentation {pid}")
 
-        presentation[self.presentation_videos_endpoint] = videos = self.get_content(presentation['Id'], self.presentation_videos_endpoint)
+        presentation[self.presentation_videos_endpoint] = videos = self.get_presentation_content(presentation, self.presentation_videos_endpoint) or list()
 
         # getting content server for urls
         for video_file in videos:
@@ -212,26 +352,56 @@ class DataExtractor():
                 video_file['ContentEncodingSettings'] = self.get_encoding_settings(encoding_settings_id)
 
             slides_endpoint = 'SlideDetailsContent' if mediasite_utils.has_slides_details(presentation) else 'SlideContent'
-            presentation[slides_endpoint] = self._get_presentation_slides(pid, slides_endpoint)
+            slides_content = self.get_presentation_content(presentation, slides_endpoint)
+            # both slides contents may have been expanded
+            presentation.pop('SlideContent' if slides_endpoint == 'SlideDetailsContent' else 'SlideDetailsContent', None)
+            presentation[slides_endpoint] = self._get_presentation_slides(slides_content, slides_endpoint)
 
             if not self.slides_are_ok(presentation):
                 return {}
 
-            for content_endpoint in self.presentation_content_endpoints:
-                presentation[content_endpoint] = self.get_content(pid, content_endpoint)
-            presentation['PresentationAnalytics'] = self.mediasite_client.presentation.get_analytics(pid)
-            presentation['Presenters'] = self.get_presenters(pid)
-            presentation['Availability'] = self.mediasite_client.presentation.get_availability(pid)
+            for resource_name in self.collect_profile['resources']:
+                presentation[resource_name] = self.get_presentation_resource(presentation, resource_name)
+            # not collected is not the same as empty
+            not_collected = [r for r in mediasite_utils.PRESENTATION_RESOURCES if r not in self.collect_profile['resources']]
+            if not_collected:
+                presentation['NotCollected'] = not_collected
 
             self.fetch_users(presentation)
 
         return presentation
 
+    def get_presentation_resource(self, presentation, resource_name):
+        pid = presentation['Id']
+        if resource_name == 'PresentationAnalytics':
+            return self.call_api(self.mediasite_client.presentation.get_analytics, pid)
+        elif resource_name == 'Presenters':
+            if resource_name in presentation:
+                self.contents_stats['inline'] += 1
+                return self.filter_presenters(presentation[resource_name])
+            return self.get_presenters(pid)
+        elif resource_name == 'Availability':
+            return self.call_api(self.mediasite_client.presentation.get_availability, pid)
+        return self.get_presentation_content(presentation, resource_name)
+
+    def get_presentation_content(self, presentation, content_name):
+        '''
+        Content of a presentation, taken from the presentations listing if it was expanded inline, requested otherwise.
+        '''
+        if content_name in presentation:
+            self.contents_stats['inline'] += 1
+            return presentation[content_name]
+        self.contents_stats['requested'] += 1
+        return self.get_content(presentation['Id'], content_name)
+
     def get_content(self, *args, **kwargs):
-        return self.mediasite_client.presentation.get_content(*args, **kwargs)
+        return self.call_api(self.mediasite_client.presentation.get_content, *args, **kwargs)
 
-    def get_content_server(self, *args, **kwargs):
-        return self.mediasite_client.content.get_content_server(*args, **kwargs)
+    @cache.cached('content_servers', key=lambda server_id, slide=False: f'{server_id}|{slide}')
+    def get_content_server(self, server_id, slide=False):
+        if slide:
+            return self.call_api(self.mediasite_client.content.get_content_server, server_id, slide=True)
+        return self.call_api(self.mediasite_client.content.get_content_server, server_id)
 
     def videos_urls_are_ok(self, presentation):
         pid = presentation['Id']
@@ -254,45 +424,48 @@ class DataExtractor():
     def fetch_users(self, presentation):
         logger.debug(f"Fetching all users infos for presentation {presentation.get('Id')}.")
         for user_type in self.users_types_to_fetch:
-            user = self._get_user(presentation.get(user_type, ''))
-            if user:
-                self.users['UserProfiles'].append(user)
+            username = presentation.get(user_type, '')
+            if username not in self.users['UserProfiles']:
+                user = self._get_user(username)
+                if user:
+                    self.users['UserProfiles'][user.get('UserName', username)] = user
 
-    @lru_cache
+    @cache.cached('users')
     def _get_user(self, username):
         user = dict()
 
         if not username.startswith('Default Presenter'):
             logger.debug(f'Getting user info for {username}')
 
-            user_result = self.mediasite_client.user.get_profile_by_username(username)
+            user_result = self.call_api(self.mediasite_client.user.get_profile_by_username, username)
             if user_result:
                 user = user_result
 
         return user
 
     def get_presenters(self, presentation_id):
-        presenters = self.mediasite_client.presentation.get_presenters(presentation_id)
+        self.contents_stats['requested'] += 1
+        return self.filter_presenters(self.call_api(self.mediasite_client.presentation.get_presenters, presentation_id))
+
+    def filter_presenters(self, presenters):
         if presenters:
-            for i, presenter in enumerate(presenters):
-                if presenter.get('DisplayName', '').startswith('Default Presenter'):
-                    presenters.pop(i)
+            presenters = [p for p in presenters if not p.get('DisplayName', '').startswith('Default Presenter')]
         return presenters
 
+    @cache.cached('encoding_settings')
     def get_encoding_settings(self, settings_id):
         encoding_settings = {}
 
         if settings_id:
             logger.debug(f'Getting encoding infos from api with settings id: {settings_id}')
-            encoding_settings = self.mediasite_client.content.get_content_encoding_settings(settings_id)
+            encoding_settings = self.call_api(self.mediasite_client.content.get_content_encoding_settings, settings_id)
         return encoding_settings
 
-    def _get_presentation_slides(self, pid, slides_endpoint):
-        slides_content = self.get_content(pid, slides_endpoint)
+    def _get_presentation_slides(self, slides_content, slides_endpoint):
         slides = dict()
 
         if slides_content:
-            if slides_endpoint == "SlideContent":
+            if slides_endpoint == "SlideContent" and isinstance(slides_content, list):
                 # SlideDetailsContent returns a dict whereas SlideContent return a list (key 'value' in JSON response)
                 slides_content = slides_content[0]
 
@@ -311,7 +484,7 @@ class DataExtractor():
             returns:
                 -> bool : slide stream source is not from camera
         """
-        encoding_settings = self.mediasite_client.content.get_content_encoding_settings(slides['ContentEncodingSettingsId'])
+        encoding_settings = self.get_encoding_settings(slides['ContentEncodingSettingsId'])
         if encoding_settings:
             source = encoding_settings.get('Name', '')
             return (source != '[Default] Use Recorder\'s Settings')
@@ -319,7 +492,7 @@ class DataExtractor():
 
     def slides_are_ok(self, presentation):
         """
-            Check slides urls, stream source, and timecodes
+            Check slides (by downloading them), stream source, and timecodes
 
             returns:
                 slides_ok -> bool : presentation has valid slides for migration
@@ -330,7 +503,8 @@ class DataExtractor():
 
         if slides:
             presentation_failure = None
-            if not mediasite_utils.slides_urls_exists(slides, self.session):
+            # the download validates the slides urls, no need for a HEAD request per slide
+            if not self._download_presentation_slides(slides):
                 slides_stream_type = slides.get('StreamType', '')
                 if slides_stream_type == 'Slide':
                     logger.error(f'Slide from jpeg not found for presentation {pid}')
@@ -355,59 +529,27 @@ class DataExtractor():
 
         return slides_ok
 
-    def download_all_slides(self):
-        all_ok = True
-        for folder in self.folders_presentations['Folders']:
-            for p in folder.get('Presentations', []):
-                slides = p.get('SlideContent', p.get('SlideDetailsContent'))
-                slides_count = int(slides.get('Length', '0'))
-                if slides_count > 0:
-                    ok = self._download_presentation_slides(slides)
-                    all_ok *= ok
-
-        if all_ok:
-            logger.info(f'Sucessfully downloaded all slides: [{self.nb_all_downloaded_slides}]')
-        else:
-            logger.error(f'Failed to download all slides from Mediasite: [{self.nb_all_downloaded_slides}] / [{self.all_slides_count}]')
-        return all_ok
-
     def _download_presentation_slides(self, slides):
-        ok = False
-        pid = slides['ParentResourceId']
+        '''
+        Download the slides of a presentation, stopping at the first missing one.
+        Slides already downloaded by a previous run are not requested again.
 
+            returns:
+                -> bool : all slides are downloaded
+        '''
+        pid = slides['ParentResourceId']
         presentation_slides_urls = mediasite_utils.get_slides_urls(slides)
-        if presentation_slides_urls:
-            nb_slides_downloaded = 0
-            nb_slides = len(presentation_slides_urls)
-
-            presentation_slides_download_folder = self.slides_download_folder / pid
-            presentation_slides_download_folder.mkdir(parents=True, exist_ok=True)
-
-            logger.debug(f'Downloading slides for presentation: {pid}')
-            for url in presentation_slides_urls:
-                filename = url.split('/').pop()
-                file_path = presentation_slides_download_folder / filename
+        if not presentation_slides_urls:
+            return True
 
-                print('Downloading slides : ', end='')
-                utils.print_progress_string(self.nb_all_downloaded_slides, self.all_slides_count)
+        presentation_slides_download_folder = self.slides_download_folder / pid
+        presentation_slides_download_folder.mkdir(parents=True, exist_ok=True)
 
-                # do not re-download
-                file_size = file_path.stat().st_size
-                if file_path.is_file() and file_size > 0:
-                    nb_slides_downloaded += 1
-                else:
-                    r = self.session.get(url)
-                    if r.ok:
-                        with open(file_path, 'wb') as f:
-                            f.write(r.content)
-                        nb_slides_downloaded += 1
-                        self.nb_all_downloaded_slides += 1
-                    else:
-                        logger.error(f'Failed to download {url}')
-
-            logger.debug(f'Downloaded [{nb_slides_downloaded}] / [{nb_slides}] slides.')
-            ok = (nb_slides_downloaded == nb_slides)
-            if not ok:
-                logger.error(f'Failed to download all slides for presentation {pid}: [{nb_slides_downloaded}] / [{nb_slides}]')
-
-        return ok
+        logger.debug(f'Downloading slides for presentation: {pid}')
+        for url in presentation_slides_urls:
+            filename = url.split('/').pop()
+            if not http.download_url(url, presentation_slides_download_folder / filename, self.session):
+                logger.debug(f'Failed to download {url}')
+                return False
+        self.nb_all_downloaded_slides += len(presentation_slides_urls)
+        return True
@@ -1,17 +1,24 @@
+import contextlib
+import itertools
 import logging
 import json
+import os
 import time
 import requests
-from requests.packages.urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
 import sys
+import threading
 from pathlib import Path
 from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 from mediasite_migration_scripts.ms_client.client import MediaServerClient
 from mediasite_migration_scripts.video_compositor import VideoCompositor
 
-from mediasite_migration_scripts.utils import http, order
+from mediasite_migration_scripts.utils import cache, http, order, ratelimit
+from mediasite_migration_scripts.utils.external_refs import ExternalRefIndex
+from mediasite_migration_scripts.utils.records import MediaData, MediaRecord, MediaRef, PayloadStore
+from mediasite_migration_scripts.utils.state import StateStore
+from mediasite_migration_scripts.utils.workqueue import WorkQueue, get_worker_id, open_work_queue
 import mediasite_migration_scripts.utils.common as utils
 import mediasite_migration_scripts.utils.mediasite as mediasite_utils
 
@@ -24,20 +31,14 @@ class MediaTransfer():
     def __init__(self, config=dict(), mediasite_data=dict()):
         self.config = config
         self.mediasite_folders = mediasite_data.get('Folders')
-        self.mediasite_users = mediasite_data.get('UserProfiles')
+        self.mediasite_users = mediasite_utils.get_users_by_username(mediasite_data.get('UserProfiles'))
         self.mediasite_auth = requests.auth.HTTPBasicAuth(self.config.get('mediasite_api_user'), self.config.get('mediasite_api_password'))
         self.mediasite_userfolder = self.config.get('mediasite_userfolder', '/Mediasite Users/')
         self.formats_allowed = self.config.get('videos_formats_allowed', {})
 
-        retry_strategy = Retry(
-            total=3,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET"]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.dl_session = requests.Session()
-        self.dl_session.mount('https://', adapter)
-        self.dl_session.mount('http://', adapter)
+        # Mediasite urls checks and downloads, at the rate the server can handle
+        self.rate_limiter = ratelimit.RateLimiter.from_config(config, 'mediasite')
+        self.dl_session = http.create_session(config, rate_limiter=self.rate_limiter)
         if config.get('download_folder'):
             self.download_folder = dl = Path(config.get('download_folder'))
         else:
@@ -45,9 +46,34 @@ class MediaTransfer():
             sys.exit(1)
 
         self.slides_folder = dl / 'slides'
+        # mapping cache, and large media fields (external data, slides details, chapters) kept on disk until upload
+        self.state = StateStore(config.get('state_file') or dl / 'migration_state.sqlite')
+        self.payloads = PayloadStore(self.state)
+        # MediaServer lookups, users and channels can be kept for the next runs (cache_persist)
+        self.caches = cache.get_caches(
+            config,
+            ['personal_channels', 'user_ids', 'user_channels', 'external_refs', 'channels'],
+            state=self.state,
+            persisted=['personal_channels', 'user_ids', 'user_channels', 'channels'],
+        )
+        self.url_status_cache = http.UrlStatusCache.from_config(config)
+        http.set_url_status_cache(self.dl_session, self.url_status_cache)
         self.composites_folder = dl / 'composite'
 
+        # distributed mode: presentations are claimed from a queue shared with other workers
+        self.work_queue = None
+        self.worker_id = config.get('worker_id') or get_worker_id()
+        if config.get('coordinator'):
+            # the coordinator holds the work queue file, and serves it to the workers of other hosts (see WorkQueueServer)
+            self.work_queue = WorkQueue.from_config(config, config.get('work_queue'))
+        elif config.get('worker'):
+            self.work_queue = open_work_queue(config, config.get('work_queue'), config.get('queue_url'))
+        # oids of the channels created for Mediasite folders paths, shared with the other workers in distributed mode
+        self.channels_store = self.work_queue if self.work_queue is not None else self.state
+
         self.compositor = None
+        # external_ref -> oid of the channels and medias already on MediaServer, see load_external_refs_index
+        self.external_refs = None
         self.composites_medias = list()
         self.medias_folders = list()
         self.created_channels = dict()
@@ -76,9 +102,13 @@ class MediaTransfer():
                 self.redirections = json.load(f)
         else:
             self.redirections = dict()
+        # Mediasite id -> oid of the redirections, to know the migrated presentations without scanning the redirections
+        self.redirected_ids = mediasite_utils.get_redirected_ids(self.redirections)
 
         self.ms_config = utils.to_mediaserver_conf(self.config)
-        self.ms_client = MediaServerClient(local_conf=self.ms_config, setup_logging=False)
+        # threads creating channels concurrently use their own client (see prepare_channels)
+        self.local = threading.local()
+        self.ms_client = self.create_ms_client()
 
         root_channel_oid = config.get('mediaserver_parent_channel')
         if root_channel_oid:
@@ -86,12 +116,40 @@ class MediaTransfer():
         else:
             self.root_channel = self.get_root_channel()
 
+        self.load_channels_state()
+
         self.all_paths = {folder['Id']: self.find_folder_path(folder['Id']) for folder in self.mediasite_folders}
         self.public_paths = [self.find_folder_path(
             folder['Id']) for folder in self.mediasite_folders if len(folder.get('Channels', [])) > 0]
-        self.mediaserver_data = self.to_mediaserver_keys()
+        # presentations are mapped lazily, when uploading
+        self.mediaserver_data = list()
+        self.mapped_medias = dict()
+        self.load_mapping_cache()
+        self.listed_channels_paths = self.get_listed_channels_paths()
+
+    @property
+    def ms_client(self):
+        return getattr(self.local, 'ms_client', None) or self._ms_client
+
+    @ms_client.setter
+    def ms_client(self, client):
+        self._ms_client = client
+
+    def create_ms_client(self):
+        client = MediaServerClient(local_conf=self.ms_config, setup_logging=False)
+        # the client retries by itself (MAX_RETRY), its session only gets the pool and keep-alive settings
+        if getattr(client, 'session', None) is None:
+            client.session = http.create_session(self.config, retries=0)
+        else:
+            http.configure_session(client.session, self.config, retries=0)
+        return client
 
     def write_redirections_file(self):
+        if self.work_queue is not None:
+            # each worker writes the redirections of all the workers
+            self.work_queue.set_many('redirections', self.redirections.items())
+            self.redirections.update(self.work_queue.items('redirections'))
+            self.redirected_ids = mediasite_utils.get_redirected_ids(self.redirections)
         if self.redirections:
             logger.info(f'Writing redirections file {self.redirections_file}')
             with open(self.redirections_file, 'w') as f:
@@ -116,12 +174,33 @@ class MediaTransfer():
             except Exception as e:
                 logger.error(f'{max_videos} is not a valid number for videos maximum.')
                 logger.debug(e)
-        else:
-            total_count = len(self.mediaserver_data)
+                max_videos = None
+        if not max_videos:
+            if self.work_queue is not None:
+                total_count = self.work_queue.count_remaining()
+            else:
+                total_count = self.count_presentations_to_map()
 
         logger.info(f'{total_count} medias found for uploading.')
 
-        for index, media in enumerate(self.mediaserver_data):
+        if not max_videos:
+            # answer existence checks without a search/ request per presentation
+            self.load_external_refs_index()
+        # channels are created by the coordinator in distributed mode, and on demand for quick tests
+        if self.work_queue is None and not max_videos and not self.config.get('skip_channels_preparation'):
+            self.prepare_channels()
+
+        # presentations are mapped (and their resources checked) as the upload goes
+        if self.work_queue is not None:
+            logger.info(f'Worker {self.worker_id} processing presentations from work queue {self.work_queue.path}')
+            medias = self.iter_queued_medias()
+        else:
+            medias = self.iter_medias()
+        if max_videos:
+            # stop mapping as soon as enough medias are found
+            medias = itertools.islice(medias, max_videos)
+
+        for index, media in enumerate(medias):
             if sys.stdout.isatty():
                 utils.print_progress_string(
                     index,
@@ -129,107 +208,32 @@ class MediaTransfer():
                     title='Uploading non-composites presentations or preparing folders')
             self.processed_count += 1
 
-            if max_videos and index >= max_videos:
-                break
-
-            if not media.get('ref', {}).get('media_oid'):
-                try:
-                    data = media.get('data', {})  # mediaserver data
-                    presentation_id = json.loads(data.get('external_data', {})).get('Id')
-
-                    channel_path = media['ref'].get('channel_path')
-                    if channel_path.startswith(self.mediasite_userfolder):
-                        if self.config.get('skip_userfolders'):
-                            continue
-                        folder_id = self.get_folder_by_path(channel_path).get('Id')
-                        existing_channel = self.get_ms_channel_by_ref(folder_id)
-                        if existing_channel:
-                            target_channel = 'mscid-' + existing_channel['oid']
-                        else:
-                            target_channel = self.get_personal_channel_target(channel_path, folder_id)
-                            if target_channel is None:
-                                logger.warning(f'Could not find personal target channel for path {channel_path}, skipping media')
-                                continue
-                    else:
-                        channel_oid = self.create_channels(
-                            channel_path) or self.root_channel.get('oid')
-                        target_channel = 'mscid-' + channel_oid
-
-                    logger.debug(f'Will publish {presentation_id} into channel {target_channel}')
-                    data['channel'] = target_channel
-
-                    if data.get('video_type').startswith('composite_'):
-                        if self.config.get('skip_composites'):
-                            continue
-                        logger.debug(f'Presentation {presentation_id} is a composite video.')
-
-                        # do not provide url to MS, file will be treated locally, we'll add it later
-                        data.pop('file_url', None)
-
-                        # we store composites medias infos, to migrate them later
-                        already_added = False
-                        for v_composites in self.composites_medias:
-                            if data.get('slug') == v_composites.get('data', {}).get('slug'):
-                                already_added = True
-                                break
-                        if not already_added:
-                            self.composites_medias.append(media)
-                    else:
-                        if self.config.get('skip_others'):
-                            continue
-                        existing_media = self.get_ms_media_by_ref(presentation_id)
-                        if existing_media:
-                            media_oid = media['ref']['media_oid'] = existing_media['oid']
-                            logger.warning(f'Presentation {presentation_id} already present on MediaServer (oid: {media_oid}), not reuploading')
-                        else:
-                            # store original presentation id to avoid duplicates
-                            data['external_ref'] = presentation_id
-
-                            # mediaserver currently crashes when providing more than 254 characters in keywords
-                            # keeping in mind that it replaces "," by ", " (2 chars) we need to truncate it by
-                            # 254 - count(',') * 2
-                            if data['keywords']:
-                                truncate_to = 254 - \
-                                    data['keywords'].count(',') * 2
-                                data['keywords'] = data['keywords'][:truncate_to]
-
-                            # lower transcoding priority
-                            data['priority'] = 'low'
-                            result = self.ms_client.api(
-                                'medias/add', method='post', data=data)
-                            if result.get('success'):
-                                self.uploaded_count += 1
-                                media_oid = result['oid']
-                                self.add_presentation_redirection(presentation_id, media_oid)
-                                media['ref']['media_oid'] = media_oid
-                                media['ref']['slug'] = result.get('slug')
-                                if data.get('api_key'):
-                                    del data['api_key']
-
-                                if data.get('video_type') == 'audio_only':
-                                    thumb_ok = self._send_audio_thumb(media['ref']['media_oid'])
-                                    if not thumb_ok:
-                                        logger.warning('Failed to upload audio thumbail for audio presentation')
-
-                                if len(data.get('chapters')) > 0:
-                                    self.add_chapters(media['ref']['media_oid'], chapters=data['chapters'])
-
-                                self.migrate_slides(media)
-                            else:
-                                logger.error(f"Failed to upload media: {presentation_id}")
-                                self.failed.append(presentation_id)
-
-                except requests.exceptions.ReadTimeout:
-                    logger.warning('Request timeout. Another attempt will be lauched at the end.')
-                    continue
+            status = self.upload_media(media)
+            # composite videos are acknowledged once merged and uploaded
+            if self.work_queue is not None and status != 'composite':
+                self.finish_task(media.get('data', {}).presentation_id, status)
 
         self.migrate_composites_videos()
+        if self.work_queue is not None:
+            for media in self.composites_medias:
+                presentation_id = media.get('data', {}).presentation_id
+                uploaded = media['ref'].get('media_oid') or self.get_ms_media_by_ref(presentation_id, in_root=self.is_in_root(media['ref'].get('channel_path')))
+                self.finish_task(presentation_id, 'uploaded' if uploaded else 'failed')
+            self.log_work_queue_counts()
 
         print('')
 
+        http.log_pool_stats(self.ms_client.session, 'MediaServer session')
+        http.log_pool_stats(self.dl_session, 'Mediasite files session')
         self.ms_client.session.close()
         if self.dl_session is not None:
             self.dl_session.close()
+        if self.url_status_cache:
+            self.url_status_cache.log_stats()
+        if self.rate_limiter:
+            self.rate_limiter.log_stats()
+        for c in self.caches.values():
+            c.log_stats()
 
         took = time.time() - before
         logger.info(f'Finished processing {self.processed_count} media in {int(took)}s / {utils.get_timecode_from_sec(took)}')
@@ -254,7 +258,123 @@ class MediaTransfer():
 
         return stats
 
-    @lru_cache
+    def upload_media(self, media):
+        '''
+        Publish a mapped media into its channel. Composite videos are only stored, they are merged and uploaded at the end.
+
+            returns:
+                -> str : outcome (uploaded, existing, skipped, composite, failed or timeout)
+        '''
+        if media.get('ref', {}).get('media_oid'):
+            return 'existing'
+        try:
+            data = media.get('data', {})  # mediaserver data
+            presentation_id = data.presentation_id
+
+            channel_path = media['ref'].get('channel_path')
+            if channel_path.startswith(self.mediasite_userfolder) and self.config.get('skip_userfolders'):
+                return 'skipped'
+            target_channel = self.get_target_channel(channel_path)
+            if target_channel is None:
+                logger.warning(f'Could not find personal target channel for path {channel_path}, skipping media')
+                return 'skipped'
+
+            logger.debug(f'Will publish {presentation_id} into channel {target_channel}')
+            data['channel'] = target_channel
+
+            if data.get('video_type').startswith('composite_'):
+                if self.config.get('skip_composites'):
+                    return 'skipped'
+                logger.debug(f'Presentation {presentation_id} is a composite video.')
+
+                # do not provide url to MS, file will be treated locally, we'll add it later
+                data.pop('file_url', None)
+
+                # we store composites medias infos, to migrate them later
+                already_added = False
+                for v_composites in self.composites_medias:
+                    if data.get('slug') == v_composites.get('data', {}).get('slug'):
+                        already_added = True
+                        break
+                if not already_added:
+                    self.composites_medias.append(media)
+                return 'composite'
+
+            if self.config.get('skip_others'):
+                return 'skipped'
+            existing_media = self.get_ms_media_by_ref(presentation_id, in_root=self.is_in_root(channel_path))
+            if existing_media:
+                media_oid = media['ref']['media_oid'] = existing_media['oid']
+                logger.warning(f'Presentation {presentation_id} already present on MediaServer (oid: {media_oid}), not reuploading')
+                return 'existing'
+
+            # store original presentation id to avoid duplicates
+            data['external_ref'] = presentation_id
+
+            # mediaserver currently crashes when providing more than 254 characters in keywords
+            # keeping in mind that it replaces "," by ", " (2 chars) we need to truncate it by
+            # 254 - count(',') * 2
+            if data['keywords']:
+                truncate_to = 254 - \
+                    data['keywords'].count(',') * 2
+                data['keywords'] = data['keywords'][:truncate_to]
+
+            # lower transcoding priority
+            data['priority'] = 'low'
+            # lazy fields (external data, slides, chapters) are read here
+            result = self.ms_client.api(
+                'medias/add', method='post', data=dict(data))
+            if not result.get('success'):
+                logger.error(f"Failed to upload media: {presentation_id}")
+                self.failed.append(presentation_id)
+                return 'failed'
+
+            self.uploaded_count += 1
+            media_oid = result['oid']
+            self.add_presentation_redirection(presentation_id, media_oid)
+            self.add_external_ref('media', presentation_id, media_oid)
+            media['ref']['media_oid'] = media_oid
+            media['ref']['slug'] = result.get('slug')
+            if data.get('api_key'):
+                del data['api_key']
+
+            if data.get('video_type') == 'audio_only':
+                thumb_ok = self._send_audio_thumb(media['ref']['media_oid'])
+                if not thumb_ok:
+                    logger.warning('Failed to upload audio thumbail for audio presentation')
+
+            chapters = data.get('chapters')
+            if chapters:
+                self.add_chapters(media['ref']['media_oid'], chapters=chapters)
+
+            self.migrate_slides(media)
+            return 'uploaded'
+
+        except requests.exceptions.ReadTimeout:
+            logger.warning('Request timeout. Another attempt will be lauched at the end.')
+            return 'timeout'
+
+    def get_target_channel(self, channel_path):
+        '''
+        Find or create the channel of channel_path (personal channels for user folders).
+        In distributed mode, workers create channels one at a time, so that a channel is not created twice.
+
+            returns:
+                -> str : channel target for medias/add (mscid-<oid>), None if not found
+        '''
+        with self.channels_lock():
+            if channel_path.startswith(self.mediasite_userfolder):
+                folder_id = self.get_folder_by_path(channel_path).get('Id')
+                existing_channel = self.get_ms_channel_by_ref(folder_id, in_root=False)
+                if existing_channel:
+                    return 'mscid-' + existing_channel['oid']
+                return self.get_personal_channel_target(channel_path, folder_id)
+
+            channel_oid = self.create_channels(
+                channel_path) or self.root_channel.get('oid')
+            return 'mscid-' + channel_oid
+
+    @cache.cached('personal_channels', key=lambda channel_path, folder_id: channel_path)
     def get_personal_channel_target(self, channel_path, folder_id):
         logger.debug(f'Get personal channel target for {channel_path}')
         #"/Mediasite Users/USERNAME/SUBFOLDER"
@@ -278,6 +398,7 @@ class MediaTransfer():
                     for s in subfolders[1:]:
                         spath += s + '/'
                         channel_oid = self._create_channel(channel_oid, s, True, spath, external_ref=folder_id)['oid']
+                        self.add_external_ref('channel', folder_id, channel_oid)
                 target = f'mscid-{channel_oid}'
             else:
                 logger.warning(f'User {username} is probably not allowed to have a personal channel')
@@ -294,7 +415,7 @@ class MediaTransfer():
             target = f'mscpath-{base_path}/{self.unknown_users_channel_title}/{subfolders_path}'
         return target
 
-    @lru_cache
+    @cache.cached('user_ids')
     def _get_user_id(self, username):
         users = self.ms_client.api('users/', method='get', params={'search': username, 'search_in': 'username'})['users']
         # this is search, so multiple users may share username prefixes; find the exact match
@@ -302,7 +423,7 @@ class MediaTransfer():
             if user['username'] == username:
                 return user['id']
 
-    @lru_cache
+    @cache.cached('user_channels', key=lambda user_email=None, user_id=None: f'{user_email}|{user_id}')
     def get_user_channel_oid(self, user_email=None, user_id=None):
         logger.debug(f'Getting user channel for user id {user_id}')
         params = {'create': 'yes'}
@@ -351,26 +472,56 @@ class MediaTransfer():
                 return path
         return ''
 
-    def get_ms_media_by_ref(self, external_ref):
-        oid = self.search_mediasite_id_in_redirections(external_ref)
-        if oid:
-            return {'oid': oid}
-        return self.search_by_external_ref(external_ref, object_type='media')
+    def get_ms_media_by_ref(self, external_ref, in_root=True):
+        return self.get_ms_item_by_ref(external_ref, 'media', in_root)
+
+    def get_ms_channel_by_ref(self, external_ref, in_root=True):
+        return self.get_ms_item_by_ref(external_ref, 'channel', in_root)
 
-    def get_ms_channel_by_ref(self, external_ref):
+    def get_ms_item_by_ref(self, external_ref, object_type, in_root=True):
+        '''
+        Find a media or channel on MediaServer by its Mediasite id (external_ref).
+        Items under the root channel (in_root) are only looked up in the external refs index when it is loaded,
+        other items (personal channels) are searched if they are not in the index.
+        '''
         oid = self.search_mediasite_id_in_redirections(external_ref)
         if oid:
             return {'oid': oid}
-        return self.search_by_external_ref(external_ref, object_type='channel')
+        if self.external_refs is not None:
+            oid = self.external_refs.get(object_type, external_ref)
+            if oid:
+                return {'oid': oid}
+            if in_root and self.external_refs.is_complete(object_type):
+                return None
+        return self.search_by_external_ref(external_ref, object_type=object_type)
+
+    def is_in_root(self, channel_path):
+        # medias of users folders are published in personal channels, outside of the root channel
+        return not (channel_path or '').startswith(self.mediasite_userfolder)
+
+    def load_external_refs_index(self):
+        # channels are listed concurrently, each thread with its own client
+        clients = http.ThreadClients(self.create_ms_client)
+        self.external_refs = ExternalRefIndex.from_config(self.config, clients.api, self.root_channel.get('oid'))
+        if self.external_refs is not None:
+            try:
+                self.external_refs.load()
+            finally:
+                clients.close()
+
+    def add_external_ref(self, object_type, external_ref, oid):
+        if self.external_refs is not None and external_ref and oid:
+            self.external_refs.add(object_type, external_ref, oid)
 
     def search_mediasite_id_in_redirections(self, mediasite_id):
         # it is much faster to lookup the local redirections file than to perform an API request
-        for from_url, to_url in self.redirections.items():
-            if mediasite_id in from_url:
-                oid = to_url.split('/')[4]
-                return oid
+        return self.redirected_ids.get(mediasite_id)
 
-    @lru_cache
+    def add_redirection(self, from_url, to_url):
+        self.redirections[from_url] = to_url
+        self.redirected_ids.update(mediasite_utils.get_redirected_ids({from_url: to_url}))
+
+    @cache.cached('external_refs', key=lambda external_ref, object_type='channel': f'{object_type}|{external_ref}')
     def search_by_external_ref(self, external_ref, object_type='channel'):
         data = {
             'search': external_ref,
@@ -399,9 +550,13 @@ class MediaTransfer():
             if sys.stdout.isatty():
                 utils.print_progress_string(index, total_composite, title='Uploading composite')
 
+            if self.work_queue is not None:
+                # merging takes a while, keep the composite presentations claimed
+                self.work_queue.renew(self.worker_id)
+
             media_data = media.get('data', {})
-            presentation_id = json.loads(media_data.get('external_data', {})).get('Id')
-            existing_media = self.get_ms_media_by_ref(presentation_id)
+            presentation_id = media_data.presentation_id
+            existing_media = self.get_ms_media_by_ref(presentation_id, in_root=self.is_in_root(media['ref'].get('channel_path')))
             if existing_media:
                 logger.warning(f'Composite presentation {presentation_id} already found on MediaServer (oid: {existing_media["oid"]}, skipping')
                 self.skipped_count += 1
@@ -433,14 +588,16 @@ class MediaTransfer():
 
                         oid = result['oid']
                         self.add_presentation_redirection(presentation_id, oid)
+                        self.add_external_ref('media', presentation_id, oid)
 
                         media['ref']['media_oid'] = oid
                         media['ref']['slug'] = result.get('slug')
                         if media_data.get('api_key'):
                             del media_data['api_key']
 
-                        if len(media_data.get('chapters')) > 0:
-                            self.add_chapters(media['ref']['media_oid'], chapters=media_data['chapters'])
+                        chapters = media_data.get('chapters')
+                        if chapters:
+                            self.add_chapters(media['ref']['media_oid'], chapters=chapters)
                     else:
                         logger.error(f"Failed to upload media: {presentation_id}")
                         self.failed.append(presentation_id)
@@ -457,7 +614,7 @@ class MediaTransfer():
             utils.print_progress_string(i, len(self.composites_medias), title='Downloading composite')
 
             data = v_composite.get('data', {})
-            presentation_id = json.loads(data.get('external_data', {})).get('Id')
+            presentation_id = data.presentation_id
             logger.debug(f"Downloading for presentation {presentation_id}")
             media_folder = self.composites_folder / presentation_id
             media_folder.mkdir(parents=True, exist_ok=True)
@@ -572,15 +729,10 @@ class MediaTransfer():
             logger.debug(f'Overriding channel name with the most recent channel name {name}')
         return name
 
-    @lru_cache
     def channel_has_channel(self, channel_path):
-        for f in self.mediaserver_data:
-            if f.get('ref').get('channel_path') == channel_path:
-                has_channel = not f['data']['channel_unlisted']
-                return has_channel
-        return False
+        return channel_path in self.listed_channels_paths
 
-    @lru_cache
+    @cache.cached('channels')
     def create_channels(self, channel_path):
         '''
         Creates all intermediary channels and
@@ -610,41 +762,141 @@ class MediaTransfer():
 
         oid = self.root_channel.get('oid')
         for leaf in tree_list:
-            folder_id = external_data = None
-            urls = list()
-            folder = self.get_folder_by_path(leaf)
-            if folder:
-                folder_id = folder['Id']
-                external_data = json.dumps({
-                    'id': folder['Id'],
-                    'name': folder['Name'],
-                    'channels': folder['Channels']},
-                    indent=2)
-                for c in folder['Channels']:
-                    urls.append(c['ChannelUrl'])
-            existing_channel = self.get_ms_channel_by_ref(folder_id)
-            if existing_channel:
-                new_oid = existing_channel['oid']
-                logger.debug(f'Channel with external_ref {folder_id} already exists on MediaServer (oid: {new_oid}), skipping creation')
-            else:
-                channel_title = self.get_channel_title_by_path(leaf)
-                new_oid = self._create_channel(
-                    parent_channel=oid,
-                    channel_title=channel_title,
-                    is_unlisted=is_unlisted,
-                    original_path=leaf,
-                    external_ref=folder_id,
-                    external_data=external_data,
-                ).get('oid')
-                for url in urls:
-                    self.redirections[url] = self.get_full_ms_url(
-                        f'/permalink/{new_oid}/iframe/?header=no')
-            oid = new_oid
+            oid = self.get_or_create_channel(leaf, oid, is_unlisted)
 
         # last item in list is the final channel, return it's oid
         # because he will be the parent of the video
         return oid
 
+    def get_or_create_channel(self, path, parent_oid, is_unlisted):
+        '''
+        Find the channel of a Mediasite folder path (created by a previous run, another worker, or referencing the folder),
+        or create it under parent_oid.
+
+            returns:
+                -> str : channel oid
+        '''
+        stored_oid = self.channels_store.get('channels', path)
+        if stored_oid:
+            logger.debug(f'Channel {path} already created (oid: {stored_oid}), skipping creation')
+            return stored_oid
+
+        folder_id = external_data = None
+        urls = list()
+        folder = self.get_folder_by_path(path)
+        if folder:
+            folder_id = folder['Id']
+            external_data = json.dumps({
+                'id': folder['Id'],
+                'name': folder['Name'],
+                'channels': folder['Channels']},
+                indent=2)
+            for c in folder['Channels']:
+                urls.append(c['ChannelUrl'])
+        existing_channel = self.get_ms_channel_by_ref(folder_id)
+        if existing_channel:
+            oid = existing_channel['oid']
+            logger.debug(f'Channel with external_ref {folder_id} already exists on MediaServer (oid: {oid}), skipping creation')
+        else:
+            channel_title = self.get_channel_title_by_path(path)
+            oid = self._create_channel(
+                parent_channel=parent_oid,
+                channel_title=channel_title,
+                is_unlisted=is_unlisted,
+                original_path=path,
+                external_ref=folder_id,
+                external_data=external_data,
+            ).get('oid')
+            for url in urls:
+                self.add_redirection(url, self.get_full_ms_url(f'/permalink/{oid}/iframe/?header=no'))
+            self.add_external_ref('channel', folder_id, oid)
+        if oid:
+            self.channels_store.set('channels', path, oid)
+        return oid
+
+    def load_channels_state(self):
+        # channels oids, and the users and channels lookups persisted by the caches (cache_persist),
+        # are only valid for the MediaServer and parent channel they were created in
+        fingerprint = {'mediaserver_url': self.config.get('mediaserver_url'), 'root_channel': self.root_channel.get('oid')}
+        if self.channels_store.get('channels_meta', 'fingerprint') != fingerprint:
+            if self.channels_store.count('channels'):
+                logger.info('MediaServer or parent channel changed, forgetting created channels')
+            self.channels_store.clear('channels')
+            self.channels_store.set('channels_meta', 'fingerprint', fingerprint)
+        # in distributed mode, the caches are persisted in the state file of the worker, not in the work queue
+        if self.state.get('caches_meta', 'fingerprint') != fingerprint:
+            for name in ['channels', 'personal_channels', 'user_ids', 'user_channels']:
+                self.caches[name].clear()
+            self.state.set('caches_meta', 'fingerprint', fingerprint)
+
+    def get_channels_plan(self):
+        '''
+        Channels needed by the presentations to migrate (presentations of users folders go to personal channels),
+        with all their parents. A channel is listed if one of its subchannels path is listed (see create_channels).
+        Channels are planned from the folders paths, without mapping the presentations (their resources are checked as the upload goes):
+        only the presentations known without valid video by the mapping cache of a previous run are left out.
+
+            returns:
+                -> dict : is_unlisted per channel path
+        '''
+        plan = dict()
+        for presentation, folder, folder_path in self.iter_presentations_to_map():
+            cached = self.state.get('mapping', presentation['Id'])
+            if cached is not None and cached.get('skipped'):
+                continue
+            channel_path = self.get_channel_path(folder, folder_path)
+            if channel_path.startswith(self.mediasite_userfolder):
+                continue
+            tree = channel_path.lstrip('/').split('/')
+            paths = ['/' + '/'.join(tree[:i]) for i in range(1, len(tree) + 1)]
+            is_unlisted = not any(self.channel_has_channel(path) for path in paths)
+            for path in paths:
+                plan[path] = plan.get(path, True) and is_unlisted
+        return plan
+
+    def prepare_channels(self):
+        '''
+        Create all the channels needed by the presentations to migrate before uploading, level by level,
+        the channels of the same depth being created concurrently. Uploads then only look up the channels oids.
+
+            returns:
+                -> int : amount of channels
+        '''
+        before = time.time()
+        plan = self.get_channels_plan()
+        levels = dict()
+        for path, is_unlisted in plan.items():
+            levels.setdefault(path.count('/'), list()).append((path, is_unlisted))
+        logger.info(f'Preparing {len(plan)} channels ({len(levels)} levels)')
+
+        root_oid = self.root_channel.get('oid')
+        clients = list()
+
+        def init_thread():
+            # the MediaServer client is not shared between threads
+            self.local.ms_client = self.create_ms_client()
+            clients.append(self.local.ms_client)
+
+        def prepare(item):
+            path, is_unlisted = item
+            parent_path = path.rsplit('/', 1)[0]
+            parent_oid = self.channels_store.get('channels', parent_path) if parent_path else root_oid
+            return self.get_or_create_channel(path, parent_oid or root_oid, is_unlisted)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.config.get('channels_creation_workers', 8), initializer=init_thread) as executor:
+                for depth in sorted(levels):
+                    # parents are all created before their children
+                    oids = list(executor.map(prepare, levels[depth]))
+                    failed = sum(1 for oid in oids if not oid)
+                    if failed:
+                        logger.error(f'Failed to create {failed} channels of depth {depth}, they will be created when uploading')
+        finally:
+            for client in clients:
+                client.session.close()
+        logger.info(f'Prepared {len(plan)} channels in {int(time.time() - before)}s')
+        return len(plan)
+
     def _create_channel(self, parent_channel, channel_title, is_unlisted, original_path, external_ref=None, external_data=None):
         logger.debug(
             f'Creating channel {channel_title} with parent {parent_channel} / is_unlisted : {is_unlisted}')
@@ -726,7 +978,7 @@ class MediaTransfer():
             logger.error(f'Unknown error when trying to edit channel perms {channel_oid} with data {data}: {result}')
 
     def migrate_slides(self, media):
-        presentation_id = json.loads(media['data']['external_data'])['Id']
+        presentation_id = media['data'].presentation_id
         media_slides = media['data'].get('slides')
         nb_slides_uploaded, nb_slides = 0, 0
 
@@ -850,89 +1102,257 @@ class MediaTransfer():
     def add_presentation_redirection(self, presentation_id, oid):
         mediasite_presentation_url = self.get_presentation_url(presentation_id)
         if mediasite_presentation_url:
-            self.redirections[mediasite_presentation_url] = self.get_full_ms_url(f'/permalink/{oid}/iframe/')
+            self.add_redirection(mediasite_presentation_url, self.get_full_ms_url(f'/permalink/{oid}/iframe/'))
+
+    def get_mapping_fingerprint(self):
+        '''
+        Mapping results depend on these settings and on the Mediasite data file, the cache is dropped if they change.
+        '''
+        fingerprint = {key: self.config.get(key) for key in ['videos_formats_allowed', 'external_data', 'mediasite_userfolder']}
+        mediasite_file = self.config.get('mediasite_file')
+        if mediasite_file and os.path.isfile(mediasite_file):
+            stat = os.stat(mediasite_file)
+            fingerprint['mediasite_file'] = [str(Path(mediasite_file).resolve()), stat.st_size, stat.st_mtime]
+        return fingerprint
+
+    def load_mapping_cache(self):
+        fingerprint = self.get_mapping_fingerprint()
+        if self.config.get('clear_mapping_cache') or self.state.get('mapping_meta', 'fingerprint') != fingerprint:
+            if self.state.count('mapping'):
+                logger.info('Mediasite data or mapping settings changed, clearing mapping cache')
+            self.state.clear('mapping')
+            self.payloads.clear()
+            self.state.set('mapping_meta', 'fingerprint', fingerprint)
+        else:
+            logger.info(f'{self.state.count("mapping")} presentations found in mapping cache {self.state.path}')
+
+    def is_unlisted_channel(self, folder, folder_path):
+        if folder.get('Channels'):
+            return False
+        for p in self.public_paths:
+            if folder_path.startswith(p):
+                return False
+        return True
+
+    def get_listed_channels_paths(self):
+        '''
+            returns:
+                -> set : channels paths which are listed, i.e. with a channel in Mediasite or under a folder with a channel
+        '''
+        listed_paths = set()
+        for presentation, folder, folder_path in self.iter_presentations_to_map():
+            if not self.is_unlisted_channel(folder, folder_path):
+                listed_paths.add(folder_path)
+        return listed_paths
+
+    def iter_presentations_to_map(self):
+        '''
+        Yield presentations of the whitelisted folders which are not migrated yet, without any request.
+
+            returns:
+                -> generator : (presentation, folder, folder path) tuples
+        '''
+        for folder in self.mediasite_folders:
+            folder_path = self.all_paths[folder['Id']]
+            if utils.is_folder_to_add(folder_path, config=self.config):
+                for presentation in folder.get('Presentations', []):
+                    # there is no use in checking if the video is available if we already processed it
+                    if not self.is_migrated(presentation):
+                        yield presentation, folder, folder_path
+
+    def is_migrated(self, presentation):
+        if presentation['Id'] in self.redirected_ids:
+            return True
+        # redirections are keyed by the Play url of the presentations
+        return presentation.get('#Play', {}).get('target') in self.redirections
+
+    def count_presentations_to_map(self):
+        return sum(1 for _ in self.iter_presentations_to_map())
+
+    def iter_medias(self):
+        '''
+        Map presentations to MediaServer medias one by one, when they are needed.
+        Medias mapped in a previous run are read from the mapping cache (state file).
+
+            returns:
+                -> generator : MediaRecord for each presentation with a valid video
+        '''
+        for presentation, folder, folder_path in self.iter_presentations_to_map():
+            media = self.get_media(presentation, folder, folder_path)
+            if media is not None:
+                yield media
+
+    def iter_queued_medias(self):
+        '''
+        Map the presentations claimed from the work queue, until no presentation is left for this worker.
+        Presentations claimed by other workers are waited for, they are claimed again if their worker dies.
+
+            returns:
+                -> generator : MediaRecord for each claimed presentation with a valid video
+        '''
+        presentations = {presentation['Id']: (presentation, folder, folder_path) for presentation, folder, folder_path in self.iter_presentations_to_map()}
+        batch_size = self.config.get('work_queue_batch_size', 5)
+        poll_seconds = self.config.get('work_queue_poll_seconds', 10)
+        claimed = list()
+        try:
+            while True:
+                if not claimed:
+                    claimed = self.work_queue.claim(self.worker_id, batch_size)
+                    if not claimed:
+                        remaining = self.work_queue.count_remaining(exclude_worker=self.worker_id)
+                        if not remaining:
+                            break
+                        logger.debug(f'{remaining} presentations processed by other workers, waiting')
+                        time.sleep(poll_seconds)
+                        continue
+                self.work_queue.renew(self.worker_id)
+                presentation_id = claimed.pop(0)
+                if presentation_id not in presentations:
+                    # already migrated (in redirections), or not whitelisted for this worker
+                    self.finish_task(presentation_id, 'skipped')
+                    continue
+                media = self.get_media(*presentations[presentation_id])
+                if media is None:
+                    self.finish_task(presentation_id, 'skipped')
+                else:
+                    yield media
+        finally:
+            if claimed:
+                self.work_queue.release(self.worker_id, claimed)
+
+    def fill_work_queue(self, reset=False):
+        '''
+        Coordinator: queue the presentations to migrate, for workers started with --worker.
+        Running it again only adds the new presentations.
+
+            returns:
+                -> dict : amount of tasks per status
+        '''
+        if reset:
+            logger.info(f'Clearing work queue {self.work_queue.path}')
+            self.work_queue.reset()
+        added = self.work_queue.add_tasks(presentation['Id'] for presentation, folder, folder_path in self.iter_presentations_to_map())
+        logger.info(f'{added} presentations added to work queue {self.work_queue.path}')
+        if not self.config.get('skip_channels_preparation'):
+            self.load_external_refs_index()
+            self.prepare_channels()
+        self.log_work_queue_counts()
+        return self.work_queue.get_counts()
+
+    def finish_task(self, presentation_id, status):
+        if status in ('failed', 'timeout'):
+            self.work_queue.fail(self.worker_id, presentation_id, status)
+        else:
+            self.work_queue.ack(self.worker_id, presentation_id, status)
+
+    def log_work_queue_counts(self):
+        counts = self.work_queue.get_counts()
+        logger.info(f'Work queue: {counts["done"]} done, {counts["failed"]} failed, {counts["pending"]} pending, {counts["leased"]} processed by workers')
+
+    def channels_lock(self):
+        '''
+        Channels are created by one worker at a time, so that two workers do not create the same channel.
+        '''
+        if self.work_queue is None:
+            return contextlib.nullcontext()
+        return self.work_queue.locked('channels', self.worker_id)
+
+    def get_media(self, presentation, folder, folder_path):
+        pid = presentation['Id']
+        # None for presentations without valid video
+        if pid in self.mapped_medias:
+            return self.mapped_medias[pid]
+
+        cached = self.state.get('mapping', pid)
+        if cached is None or cached.get('skipped'):
+            # presentations without valid video are checked again, their videos may have been fixed on Mediasite since
+            # (checks of missing urls are cached for url_status_negative_ttl_hours by the urls status cache)
+            media = self.to_mediaserver_media(presentation, folder, folder_path)
+            self.state.set('mapping', pid, media.to_state() if media else {'skipped': True})
+        else:
+            media = MediaRecord.from_state(cached, self.payloads)
+
+        self.mapped_medias[pid] = media
+        if media is not None:
+            self.mediaserver_data.append(media)
+        return media
 
     def to_mediaserver_keys(self):
+        '''
+        Map all presentations at once (instead of lazily while uploading).
+
+            returns:
+                -> list : MediaRecord of all the presentations to migrate
+        '''
         logger.debug('Matching Mediasite data to MediaServer keys mapping.')
         logger.debug(f'Whitelist: {self.config.get("whitelist")}')
 
-        mediaserver_data = list()
-        if hasattr(self, 'mediaserver_data'):
-            mediaserver_data = self.mediaserver_data
+        total_count = self.count_presentations_to_map()
+        for index, media in enumerate(self.iter_medias()):
+            utils.print_progress_string(index, total_count, title='Mapping data and checking resources')
+        return self.mediaserver_data
+
+    def to_mediaserver_media(self, presentation, folder, folder_path):
+        '''
+        Map a presentation to MediaServer media fields, checking its resources.
+
+            returns:
+                -> MediaRecord : None if the presentation has no valid video
+        '''
+        pid = presentation['Id']
+        v_url, v_composites_urls, v_type = self._get_video_urls_and_type(presentation)
+        if not v_url:
+            logger.warning(f'No valid video for presentation {pid}, skipping')
+            self.skipped_count += 1
+            return None
+
+        # external data is serialized when read, at upload time
+        if self.config.get('external_data') is True:
+            ext_data = self.payloads.write(presentation)
         else:
-            logger.info('No Mediaserver mapping. Generating mapping.')
-            for index, folder in enumerate(self.mediasite_folders):
-                utils.print_progress_string(index, len(
-                    self.mediasite_folders), title='Mapping data and checking resources')
-
-                folder_path = self.find_folder_path(
-                    folder['Id'], self.mediasite_folders)
-                if utils.is_folder_to_add(folder_path, config=self.config):
-                    has_channel = (len(folder.get('Channels', [])) > 0)
-                    is_unlisted_channel = not has_channel
-                    for p in self.public_paths:
-                        if folder_path.startswith(p):
-                            is_unlisted_channel = False
-                            break
+            ext_data = {key: presentation.get(key) for key in [
+                'Id', 'Creator', 'PresentationAnalytics']}
+            # analytics are not collected by all collect profiles
+            for key in ['TotalViews', 'LastWatched']:
+                ext_data[key] = (ext_data['PresentationAnalytics'] or dict()).get(key)
 
-                    for presentation in folder['Presentations']:
-                        data = dict()
-                        pid = presentation['Id']
-                        # there is no use in checking if the video is available if we already processed it
-                        if self.search_mediasite_id_in_redirections(pid):
-                            continue
-
-                        v_url, v_composites_urls, v_type = self._get_video_urls_and_type(presentation)
-                        if v_url:
-                            if self.config.get('external_data') is True:
-                                ext_data = presentation
-                            else:
-                                ext_data = {key: presentation.get(key) for key in [
-                                    'Id', 'Creator', 'PresentationAnalytics']}
-                                for key in ['TotalViews', 'LastWatched']:
-                                    ext_data[key] = ext_data['PresentationAnalytics'][key]
-
-                            data = {
-                                'title': presentation.get('Title', ''),
-                                'channel_title': folder.get('Name', ''),
-                                'channel_unlisted': is_unlisted_channel,
-                                'creation': mediasite_utils.get_most_distant_date(presentation),
-                                'validated': 'yes' if self._is_validated(presentation) else 'no',
-                                'description': self.get_presentation_description(presentation),
-                                'keywords': ','.join(presentation.get('TagList', [])),
-                                'slug': 'mediasite-' + presentation.get('Id'),
-                                'external_data': json.dumps(ext_data, indent=2, sort_keys=True),
-                                'transcode': self._do_transcode(v_type, v_url),
-                                'origin': 'mediasite-migration-client',
-                                'detect_slides': 'yes' if v_type in ['computer_slides', 'composite_slides'] else 'no',
-                                'slides': presentation.get('SlideDetailsContent'),
-                                'layout': self._find_video_type_layout(v_type),
-                                'chapters': self.get_chapters(presentation),
-                                'video_type': v_type,
-                                'file_url': v_url,
-                                'composites_videos_urls': v_composites_urls
-                            }
-                            speaker_data = self.get_speaker_data(presentation.get('Owner'))
-                            data.update(speaker_data)
-
-                            if has_channel:
-                                channel_path_splitted = folder_path.split('/')
-                                channel_path_splitted[-1] = data['channel_title']
-                                channel_path = '/'.join(channel_path_splitted)
-                            else:
-                                channel_path = folder_path
-
-                            if v_type == 'audio_only':
-                                data['thumb'] = 'mediasite_migration_scripts/files/utils/audio.jpg'
-
-                            mediaserver_data.append(
-                                {'data': data, 'ref': {'channel_path': channel_path, 'folder_path': folder_path}})
-                        else:
-                            logger.warning(f"No valid video for presentation {presentation.get('Id')}, skipping")
-                            self.skipped_count += 1
-                            continue
-
-        return mediaserver_data
+        slides = presentation.get('SlideDetailsContent')
+        chapters = self.get_chapters(presentation)
+        data = MediaData(
+            presentation_id=pid,
+            title=presentation.get('Title', ''),
+            channel_title=folder.get('Name', ''),
+            channel_unlisted=self.is_unlisted_channel(folder, folder_path),
+            creation=mediasite_utils.get_most_distant_date(presentation),
+            validated='yes' if self._is_validated(presentation) else 'no',
+            description=self.get_presentation_description(presentation),
+            keywords=','.join(presentation.get('TagList', [])),
+            slug='mediasite-' + presentation.get('Id'),
+            external_data=ext_data,
+            transcode=self._do_transcode(v_type, v_url),
+            origin='mediasite-migration-client',
+            detect_slides='yes' if v_type in ['computer_slides', 'composite_slides'] else 'no',
+            slides=self.payloads.write(slides) if slides else slides,
+            layout=self._find_video_type_layout(v_type),
+            chapters=self.payloads.write(chapters) if chapters else chapters,
+            video_type=v_type,
+            file_url=v_url,
+            composites_videos_urls=v_composites_urls,
+        )
+        speaker_data = self.get_speaker_data(presentation.get('Owner'))
+        data.update(speaker_data)
+
+        if v_type == 'audio_only':
+            data['thumb'] = 'mediasite_migration_scripts/files/utils/audio.jpg'
+
+        return MediaRecord(data, MediaRef(channel_path=self.get_channel_path(folder, folder_path), folder_path=folder_path))
+
+    def get_channel_path(self, folder, folder_path):
+        if folder.get('Channels'):
+            channel_path_splitted = folder_path.split('/')
+            channel_path_splitted[-1] = folder.get('Name', '')
+            return '/'.join(channel_path_splitted)
+        return folder_path
 
     def _get_video_urls_and_type(self, presentation):
         v_url = v_composites_urls = None
@@ -1047,7 +1467,7 @@ class MediaTransfer():
     def get_presentation_description(self, presentation):
         description = str()
         presenters = list()
-        for p in presentation.get('Presenters'):
+        for p in presentation.get('Presenters') or list():
             presenter_name = p.get('DisplayName')
             if presenter_name:
                 presenters.append(presenter_name)
@@ -1062,17 +1482,17 @@ class MediaTransfer():
 
     def get_speaker_data(self, username):
         speaker_data = dict()
-        for user in self.mediasite_users:
-            if username == user['UserName']:
-                speaker_data = {
-                    'speaker_id': username,
-                    'speaker_name': user.get('DisplayName'),
-                    'speaker_email': user.get('Email').lower(),
-                }
+        user = self.mediasite_users.get(username)
+        if user:
+            speaker_data = {
+                'speaker_id': username,
+                'speaker_name': user.get('DisplayName'),
+                'speaker_email': user.get('Email').lower(),
+            }
         return speaker_data
 
     def get_chapters(self, presentation):
-        chapters = order.to_chapters(presentation['TimedEvents'])
+        chapters = order.to_chapters(presentation.get('TimedEvents') or list())
         for chapter in chapters:
             videos = presentation['OnDemandContent']
             for video in videos:
@@ -0,0 +1,175 @@
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class InFlight():
+    def __init__(self):
+        self.event = threading.Event()
+        self.thread = threading.get_ident()
+        self.value = None
+        self.error = None
+
+
+class Cache():
+    '''
+    Thread-safe cache with explicit keys, bounded in size (least recently used entries are dropped first) and in time (ttl_seconds).
+    Concurrent calls of get_or_compute for the same key are coalesced: only the first one computes the value, the others wait for it.
+    With a state store, entries are persisted (in the cache_<name> namespace) and reused by the next runs.
+    '''
+    NAMESPACE_PREFIX = 'cache_'
+
+    def __init__(self, name, maxsize=10000, ttl_seconds=None, state=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self.state = state
+        self.namespace = self.NAMESPACE_PREFIX + name
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.in_flight = dict()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evicted': 0, 'expired': 0}
+
+    @classmethod
+    def from_config(cls, config, name, state=None, persist=True):
+        '''
+        Caches are bounded by cache_maxsize entries and cache_ttl_hours (no expiry by default),
+        and persisted in state if cache_persist is enabled and the cache can be persisted (persist).
+        '''
+        ttl_hours = config.get('cache_ttl_hours')
+        return cls(
+            name,
+            maxsize=config.get('cache_maxsize', 10000),
+            ttl_seconds=ttl_hours * 3600 if ttl_hours else None,
+            state=state if persist and config.get('cache_persist') else None,
+        )
+
+    def _get_entry(self, key, now):
+        # called with the lock held
+        entry = self.entries.get(key)
+        if entry is None and self.state is not None:
+            entry = self.state.get(self.namespace, key)
+            if entry is not None:
+                entry = (entry['value'], entry['expires'])
+                self.entries[key] = entry
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < now:
+            self.stats['expired'] += 1
+            self._delete(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self._get_entry(key, time.time())
+        return default if entry is None else entry[0]
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while self.maxsize and len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.stats['evicted'] += 1
+            if self.state is not None:
+                self.state.set(self.namespace, key, {'value': value, 'expires': expires})
+
+    def _delete(self, key):
+        self.entries.pop(key, None)
+        if self.state is not None:
+            self.state.delete(self.namespace, key)
+
+    def delete(self, key):
+        with self.lock:
+            self._delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.state is not None:
+                self.state.clear(self.namespace)
+
+    def get_or_compute(self, key, func, *args, **kwargs):
+        '''
+        Return the cached value of key, or compute it with func(*args, **kwargs).
+        Exceptions are not cached, threads waiting for the same key get them too.
+        '''
+        with self.lock:
+            entry = self._get_entry(key, time.time())
+            if entry is not None:
+                self.stats['hits'] += 1
+                return entry[0]
+            in_flight = self.in_flight.get(key)
+            # a method computing key may call itself with the same key (after fixing permissions for example)
+            if in_flight is not None and in_flight.thread != threading.get_ident():
+                self.stats['coalesced'] += 1
+            else:
+                self.stats['misses'] += 1
+                in_flight = None
+                if key not in self.in_flight:
+                    owned = self.in_flight[key] = InFlight()
+                else:
+                    owned = None
+
+        if in_flight is not None:
+            in_flight.event.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value
+
+        try:
+            value = func(*args, **kwargs)
+        except Exception as e:
+            if owned is not None:
+                owned.error = e
+            raise
+        else:
+            self.set(key, value)
+            if owned is not None:
+                owned.value = value
+            return value
+        finally:
+            if owned is not None:
+                with self.lock:
+                    self.in_flight.pop(key, None)
+                owned.event.set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def log_stats(self):
+        stats = self.stats
+        logger.info(
+            f'{self.name} cache: {len(self.entries)} entries, {stats["hits"]} hits, {stats["misses"]} misses, '
+            f'{stats["coalesced"]} coalesced, {stats["evicted"]} evicted, {stats["expired"]} expired'
+        )
+
+
+def get_caches(config, names, state=None, persisted=()):
+    '''
+        returns:
+            -> dict : Cache per name, only the caches listed in persisted are stored in state
+    '''
+    return {name: Cache.from_config(config, name, state=state, persist=name in persisted) for name in names}
+
+
+def cached(name, key=None):
+    '''
+    Cache the results of a method in self.caches[name].
+    key builds the cache key (a string) from the method arguments, the first argument is used by default.
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = self.caches[name]
+            cache_key = key(*args, **kwargs) if key else str(args[0])
+            return cache.get_or_compute(cache_key, method, self, *args, **kwargs)
+        return wrapper
+    return decorator
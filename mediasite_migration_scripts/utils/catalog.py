@@ -0,0 +1,312 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.mediasite as mediasite
+
+logger = logging.getLogger(__name__)
+
+# collect output (mediasite_all_data.json) and analyzer data (mediasite_data.json)
+FORMAT_COLLECT = 'collect'
+FORMAT_ANALYZER = 'analyzer'
+PRESENTATIONS_KEYS = {FORMAT_COLLECT: 'Presentations', FORMAT_ANALYZER: 'presentations'}
+CHANNELS_KEYS = {FORMAT_COLLECT: 'Channels', FORMAT_ANALYZER: 'channels'}
+# source fields stored in columns, other fields are searched in the stored json
+SEARCH_COLUMNS = {
+    'folders': {'id': 'id', 'Id': 'id', 'name': 'name', 'Name': 'name', 'path': 'path', 'ParentFolderId': 'parent_id'},
+    'presentations': {
+        'id': 'id', 'Id': 'id', 'title': 'title', 'Title': 'title', 'name': 'title',
+        'Status': 'status', 'Owner': 'owner', 'CreationDate': 'creation_date', 'creation_date': 'creation_date',
+    },
+    'channels': {'id': 'id', 'Id': 'id', 'name': 'name', 'Name': 'name'},
+}
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    '''CREATE TABLE IF NOT EXISTS folders (
+        position INTEGER PRIMARY KEY,
+        id TEXT NOT NULL,
+        parent_id TEXT,
+        name TEXT,
+        path TEXT,
+        data TEXT
+    )''',
+    'CREATE TABLE IF NOT EXISTS channels (folder_id TEXT NOT NULL, id TEXT, name TEXT, data TEXT)',
+    '''CREATE TABLE IF NOT EXISTS presentations (
+        position INTEGER PRIMARY KEY,
+        id TEXT NOT NULL,
+        folder_id TEXT NOT NULL,
+        title TEXT,
+        status TEXT,
+        private INTEGER,
+        owner TEXT,
+        creation_date TEXT,
+        data TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS video_files (
+        presentation_id TEXT NOT NULL,
+        stream_type TEXT,
+        format TEXT,
+        file TEXT,
+        size_bytes INTEGER,
+        duration_ms INTEGER
+    )''',
+    'CREATE TABLE IF NOT EXISTS slides (presentation_id TEXT NOT NULL, stream_type TEXT, count INTEGER, with_details INTEGER)',
+    'CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, email TEXT, display_name TEXT, data TEXT)',
+    'CREATE INDEX IF NOT EXISTS folders_id ON folders (id)',
+    'CREATE INDEX IF NOT EXISTS folders_path ON folders (path)',
+    'CREATE INDEX IF NOT EXISTS channels_folder_id ON channels (folder_id)',
+    'CREATE INDEX IF NOT EXISTS presentations_id ON presentations (id)',
+    'CREATE INDEX IF NOT EXISTS presentations_folder_id ON presentations (folder_id)',
+    'CREATE INDEX IF NOT EXISTS presentations_title ON presentations (title)',
+    'CREATE INDEX IF NOT EXISTS video_files_presentation_id ON video_files (presentation_id)',
+    'CREATE INDEX IF NOT EXISTS slides_presentation_id ON slides (presentation_id)',
+    'CREATE INDEX IF NOT EXISTS users_email ON users (email)',
+]
+TABLES = ['meta', 'folders', 'channels', 'presentations', 'video_files', 'slides', 'users']
+
+
+def get_data_format(data):
+    if isinstance(data, dict) and 'Folders' in data:
+        return FORMAT_COLLECT
+    if isinstance(data, list):
+        return FORMAT_ANALYZER
+    raise ValueError('Unknown Mediasite data format, expected collect output ({"Folders": [...]}) or analyzer data (list of folders)')
+
+
+class Catalog():
+    '''
+    Indexed SQLite copy of a Mediasite data file (collect output or analyzer data), imported once,
+    so that tools can look up presentations or search fields without loading the whole file.
+    Each folder and presentation is stored as in the data file (json), with its main fields in indexed columns.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            self.db.execute(statement)
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Open an existing catalog.
+        '''
+        if not Path(path).is_file():
+            raise FileNotFoundError(f'Catalog {path} not found, import the Mediasite data file with bin/build_catalog.py')
+        return cls(path)
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    @property
+    def data_format(self):
+        return self.get_meta('format')
+
+    def check_format(self, data_format):
+        if self.data_format != data_format:
+            raise ValueError(f'Catalog {self.path} was imported from {self.get_meta("source")} ({self.data_format} data), {data_format} data is needed')
+
+    def import_data(self, data, source=None):
+        '''
+        Replace the content of the catalog by the data (collect output or analyzer data).
+
+            returns:
+                -> dict : amount of rows per table
+        '''
+        before = time.time()
+        data_format = get_data_format(data)
+        folders = data['Folders'] if data_format == FORMAT_COLLECT else data
+        paths = mediasite.get_folders_paths(folders) if data_format == FORMAT_COLLECT else dict()
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                for table in TABLES:
+                    self.db.execute(f'DELETE FROM {table}')
+                for folder in folders:
+                    self._insert_folder(folder, data_format, paths)
+                if data_format == FORMAT_COLLECT:
+                    users = mediasite.get_users_by_username(data.get('UserProfiles'))
+                    self.db.executemany(
+                        'INSERT OR REPLACE INTO users (username, email, display_name, data) VALUES (?, ?, ?, ?)',
+                        [(username, user.get('Email'), user.get('DisplayName'), json.dumps(user)) for username, user in users.items()]
+                    )
+                meta = {'format': data_format, 'source': str(source) if source else None, 'imported': time.time()}
+                self.db.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [(key, json.dumps(value)) for key, value in meta.items()])
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        counts = self.counts()
+        logger.info(f'Imported {", ".join(f"{count} {table}" for table, count in counts.items())} in {time.time() - before:.1f}s')
+        return counts
+
+    def _insert_folder(self, folder, data_format, paths):
+        # called in the import transaction
+        presentations_key = PRESENTATIONS_KEYS[data_format]
+        folder_data = {key: value for key, value in folder.items() if key != presentations_key}
+        channels = folder.get(CHANNELS_KEYS[data_format]) or list()
+        if data_format == FORMAT_COLLECT:
+            folder_id = folder['Id']
+            row = (folder_id, folder.get('ParentFolderId'), folder.get('Name'), paths.get(folder_id))
+            channels_rows = [(folder_id, c.get('Id'), c.get('Name'), json.dumps(c)) for c in channels]
+        else:
+            folder_id = folder['id']
+            row = (folder_id, None, folder.get('name'), folder.get('path'))
+            channels_rows = [(folder_id, c.get('id'), c.get('name'), json.dumps(c)) for c in channels]
+        self.db.execute('INSERT INTO folders (id, parent_id, name, path, data) VALUES (?, ?, ?, ?, ?)', (*row, json.dumps(folder_data)))
+        self.db.executemany('INSERT INTO channels (folder_id, id, name, data) VALUES (?, ?, ?, ?)', channels_rows)
+
+        presentations_rows = list()
+        video_files_rows = list()
+        slides_rows = list()
+        for presentation in folder.get(presentations_key) or list():
+            if data_format == FORMAT_COLLECT:
+                presentation_id = presentation['Id']
+                presentations_rows.append((
+                    presentation_id, folder_id, presentation.get('Title'), presentation.get('Status'),
+                    presentation.get('Private'), presentation.get('Owner'), presentation.get('CreationDate'), json.dumps(presentation)
+                ))
+                for video_file in presentation.get('OnDemandContent') or list():
+                    video_files_rows.append((
+                        presentation_id, video_file.get('StreamType'), video_file.get('ContentMimeType'),
+                        video_file.get('FileNameWithExtension'), int(video_file.get('FileLength') or 0), int(video_file.get('Length') or 0)
+                    ))
+                slides = presentation.get('SlideDetailsContent') or presentation.get('SlideContent')
+                if slides:
+                    slides_rows.append((presentation_id, slides.get('StreamType'), mediasite.get_slides_count(slides), bool(slides.get('SlideDetails'))))
+            else:
+                presentation_id = presentation['id']
+                presentations_rows.append((
+                    presentation_id, folder_id, presentation.get('title') or presentation.get('name'), presentation.get('Status'),
+                    presentation.get('Private'), presentation.get('Owner'), presentation.get('creation_date'), json.dumps(presentation)
+                ))
+                for video in presentation.get('videos') or list():
+                    for video_file in video.get('files') or list():
+                        video_files_rows.append((
+                            presentation_id, video.get('stream_type'), video_file.get('format'),
+                            video_file.get('url'), video_file.get('size_bytes'), video_file.get('duration_ms')
+                        ))
+                slides = presentation.get('slides')
+                if slides:
+                    details = slides.get('details') or list()
+                    slides_rows.append((presentation_id, slides.get('stream_type'), slides.get('length') or len(details), bool(details)))
+        self.db.executemany(
+            'INSERT INTO presentations (id, folder_id, title, status, private, owner, creation_date, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            presentations_rows
+        )
+        self.db.executemany(
+            'INSERT INTO video_files (presentation_id, stream_type, format, file, size_bytes, duration_ms) VALUES (?, ?, ?, ?, ?, ?)',
+            video_files_rows
+        )
+        self.db.executemany('INSERT INTO slides (presentation_id, stream_type, count, with_details) VALUES (?, ?, ?, ?)', slides_rows)
+
+    def counts(self):
+        '''
+            returns:
+                -> dict : amount of rows per table (meta excluded)
+        '''
+        with self.lock:
+            return {table: self.db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in TABLES if table != 'meta'}
+
+    def get_presentations(self, presentation_ids):
+        '''
+            returns:
+                -> list : (folder, presentation) tuples of the presentations found, as in the data file (folders without their presentations)
+        '''
+        presentation_ids = list(dict.fromkeys(presentation_ids))
+        rows = list()
+        with self.lock:
+            # sqlite limits the amount of query parameters
+            for index in range(0, len(presentation_ids), 500):
+                chunk = presentation_ids[index:index + 500]
+                rows.extend(self.db.execute(
+                    f'''SELECT f.data, p.data FROM presentations p JOIN folders f ON f.id = p.folder_id
+                    WHERE p.id IN ({", ".join("?" * len(chunk))}) ORDER BY p.position''',
+                    chunk
+                ).fetchall())
+        return [(json.loads(folder), json.loads(presentation)) for folder, presentation in rows]
+
+    def get_presentation(self, presentation_id):
+        '''
+            returns:
+                -> dict : presentation as in the data file, None if not found
+        '''
+        with self.lock:
+            row = self.db.execute('SELECT data FROM presentations WHERE id = ?', (presentation_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_presentations(self):
+        '''
+            returns:
+                -> list : (folder path, presentation id) of all presentations, in the order of the data file
+        '''
+        with self.lock:
+            return self.db.execute(
+                'SELECT f.path, p.id FROM presentations p JOIN folders f ON f.id = p.folder_id ORDER BY f.position, p.position'
+            ).fetchall()
+
+    def iter_folders(self, folder_filter=None):
+        '''
+        Folders with their presentations, as in the data file.
+
+        params:
+            folder_filter : function called with the path of each folder, presentations are only loaded for the folders kept
+        '''
+        presentations_key = PRESENTATIONS_KEYS[self.data_format]
+        with self.lock:
+            folders = self.db.execute('SELECT id, path, data FROM folders ORDER BY position').fetchall()
+        for folder_id, path, data in folders:
+            if folder_filter is not None and not folder_filter(path):
+                continue
+            folder = json.loads(data)
+            with self.lock:
+                rows = self.db.execute('SELECT data FROM presentations WHERE folder_id = ? ORDER BY position', (folder_id,)).fetchall()
+            folder[presentations_key] = [json.loads(row[0]) for row in rows]
+            yield folder
+
+    def get_users(self):
+        '''
+            returns:
+                -> dict : user profile per username (collect output only)
+        '''
+        with self.lock:
+            rows = self.db.execute('SELECT username, data FROM users').fetchall()
+        return {username: json.loads(data) for username, data in rows}
+
+    def search(self, term, fields):
+        '''
+        Items of which one of the fields contains the term (case sensitive).
+
+            returns:
+                -> dict : folders, presentations and channels found (as in the data file), per table
+        '''
+        results = {table: list() for table in SEARCH_COLUMNS}
+        if not fields:
+            return results
+        with self.lock:
+            for table, columns in SEARCH_COLUMNS.items():
+                conditions = list()
+                params = list()
+                for field in fields:
+                    column = columns.get(field)
+                    if column:
+                        conditions.append(f'instr({column}, ?) > 0')
+                        params.append(term)
+                    else:
+                        conditions.append('instr(json_extract(data, ?), ?) > 0')
+                        params.extend([f'$."{field}"', term])
+                order = 'position' if table != 'channels' else 'rowid'
+                rows = self.db.execute(f'SELECT data FROM {table} WHERE {" OR ".join(conditions)} ORDER BY {order}', params).fetchall()
+                results[table] = [json.loads(row[0]) for row in rows]
+        return results
+
+    def close(self):
+        with self.lock:
+            self.db.close()
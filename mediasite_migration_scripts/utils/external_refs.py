@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ExternalRefIndex():
+    '''
+    Index of the external references (Mediasite ids) of the channels and medias under a MediaServer channel,
+    built by paging through the channels tree once (channels of the same depth are listed concurrently),
+    so that existence checks do not need a search/ request per presentation or folder.
+
+    params:
+        api : MediaServer client api method, called from workers threads (see http.ThreadClients)
+        root_oid : oid of the channel to index (with all its subchannels)
+    '''
+    def __init__(self, api, root_oid, page_size=100, workers=8):
+        self.api = api
+        self.root_oid = root_oid
+        self.page_size = page_size
+        self.workers = workers
+        self.refs = {'channel': dict(), 'media': dict()}
+        self.lock = threading.Lock()
+        # per object type, an incomplete index cannot tell that an item does not exist
+        self.complete = {'channel': False, 'media': False}
+        self.items_count = {'channel': 0, 'media': 0}
+        self.stats = {'channels': 0, 'requests': 0, 'errors': 0}
+
+    @classmethod
+    def from_config(cls, config, api, root_oid):
+        '''
+            returns:
+                -> ExternalRefIndex : None if disabled in config (external_refs_prefetch set to false)
+        '''
+        if not config.get('external_refs_prefetch', True):
+            return None
+        return cls(
+            api,
+            root_oid,
+            page_size=config.get('external_refs_page_size', 100),
+            workers=config.get('external_refs_workers', 8),
+        )
+
+    def load(self):
+        before = time.time()
+        errors = 0
+        level = [self.root_oid]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while level:
+                next_level = list()
+                for subchannels in executor.map(self._list_channel, level):
+                    if subchannels is None:
+                        errors += 1
+                    else:
+                        next_level.extend(subchannels)
+                level = next_level
+        # channels/content/ is expected to return the external_ref of channels and videos (search/ does not),
+        # if no listed item of a type has one, the field is probably not returned for this type and the index cannot be trusted for it
+        missing_field = [object_type for object_type, count in self.items_count.items() if count and not self.refs[object_type]]
+        self.complete = {object_type: not errors and object_type not in missing_field for object_type in self.complete}
+        logger.info(
+            f'Indexed {len(self.refs["channel"])} channels and {len(self.refs["media"])} medias external references '
+            f'({self.stats["channels"]} channels listed with {self.stats["requests"]} requests) in {int(time.time() - before)}s'
+        )
+        if errors:
+            logger.warning(f'Failed to list {errors} channels, MediaServer will be searched for items not found in the index')
+        for object_type in missing_field:
+            logger.warning(
+                f'None of the {self.items_count[object_type]} listed {object_type}s has an external reference, '
+                f'MediaServer will be searched for {object_type}s not found in the index'
+            )
+
+    def _list_channel(self, channel_oid):
+        '''
+            returns:
+                -> list : oids of the subchannels, None if the channel could not be listed
+        '''
+        subchannels = list()
+        offset = 0
+        while True:
+            params = {'parent_oid': channel_oid, 'content': 'cv', 'offset': offset, 'limit': self.page_size}
+            try:
+                result = self.api('channels/content/', method='get', params=params)
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            with self.lock:
+                self.stats['requests'] += 1
+                if not result or not result.get('success'):
+                    self.stats['errors'] += 1
+                    logger.error(f'Failed to list content of channel {channel_oid}: {(result or dict()).get("error")}')
+                    return None
+                channels = result.get('channels') or list()
+                videos = result.get('videos') or list()
+                self.items_count['channel'] += len(channels)
+                self.items_count['media'] += len(videos)
+                for channel in channels:
+                    subchannels.append(channel['oid'])
+                    if channel.get('external_ref'):
+                        self.refs['channel'][channel['external_ref']] = channel['oid']
+                for video in videos:
+                    if video.get('external_ref'):
+                        self.refs['media'][video['external_ref']] = video['oid']
+            if len(channels) < self.page_size and len(videos) < self.page_size:
+                break
+            offset += self.page_size
+        with self.lock:
+            self.stats['channels'] += 1
+        return subchannels
+
+    def is_complete(self, object_type):
+        '''
+            returns:
+                -> bool : True if an item of object_type missing from the index does not exist
+        '''
+        return self.complete[object_type]
+
+    def get(self, object_type, external_ref):
+        '''
+            returns:
+                -> str : oid of the channel or media (object_type) with this external_ref, None if not indexed
+        '''
+        return self.refs[object_type].get(external_ref)
+
+    def add(self, object_type, external_ref, oid):
+        with self.lock:
+            self.refs[object_type][external_ref] = oid
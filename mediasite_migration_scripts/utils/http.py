@@ -1,21 +1,319 @@
 #!/usr/bin/env python3
 import requests
 import logging
+import threading
+import time
+from pathlib import Path
+
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from mediasite_migration_scripts.utils.ratelimit import RateLimitedAdapter, RETRY_METHODS, RETRY_STATUS_CODES
+from mediasite_migration_scripts.utils.state import StateStore
 
 logger = logging.getLogger(__name__)
 
 
-def get_session(user, password, headers=dict()):
-    session = requests.session()
-    session.auth = requests.auth.HTTPBasicAuth(user, password)
-    session.headers = headers
+def get_session(user, password, headers=dict(), config=None, rate_limiter=None):
+    auth = requests.auth.HTTPBasicAuth(user, password)
+    return create_session(config or dict(), auth=auth, headers=headers, rate_limiter=rate_limiter)
+
+
+def create_session(config=dict(), auth=None, headers=None, rate_limiter=None, retries=None):
+    '''
+    All sessions are created here, so that they share the same settings from config:
+    http_pool_connections (hosts kept in pool), http_pool_maxsize (connections per host), http_keep_alive,
+    http_retries (for GET / HEAD requests), http_connect_timeout and http_read_timeout (seconds).
+
+        returns:
+            -> requests.Session : requests are sent through rate_limiter if given
+    '''
+    session = requests.Session()
+    session.auth = auth
+    if headers is not None:
+        session.headers = CaseInsensitiveDict(headers)
+    return configure_session(session, config, rate_limiter=rate_limiter, retries=retries)
+
+
+def configure_session(session, config=dict(), rate_limiter=None, retries=None):
+    '''
+    Mount adapters configured from config on an existing session (see create_session).
+    '''
+    if retries is None:
+        retries = config.get('http_retries', 3)
+    kwargs = {
+        'pool_connections': config.get('http_pool_connections', 10),
+        'pool_maxsize': config.get('http_pool_maxsize', 32),
+        'timeout': (config.get('http_connect_timeout', 10), config.get('http_read_timeout', 300)),
+    }
+    if rate_limiter is not None:
+        adapter = RateLimitedPoolAdapter(rate_limiter, retries=retries, **kwargs)
+    else:
+        retry_strategy = Retry(total=retries, status_forcelist=RETRY_STATUS_CODES, allowed_methods=RETRY_METHODS, raise_on_status=False)
+        adapter = PoolAdapter(max_retries=retry_strategy, **kwargs)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not config.get('http_keep_alive', True):
+        session.headers['Connection'] = 'close'
     return session
 
 
+class PoolAdapter(HTTPAdapter):
+    '''
+    HTTPAdapter with a default timeout (requests has none), counting requests and opened connections.
+    '''
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        self.stats = {'requests': 0, 'connections': 0}
+        self.stats_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def count_connect(connection_class):
+            class CountingConnection(connection_class):
+                def connect(self):
+                    adapter.count('connections')
+                    super().connect()
+            return CountingConnection
+
+        # keep-alive connections closed by the server are reopened with the same connection object, so connect() is counted
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('HTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': count_connect(HTTPConnectionPool.ConnectionCls)}),
+            'https': type('HTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': count_connect(HTTPSConnectionPool.ConnectionCls)}),
+        }
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def send(self, request, timeout=None, **kwargs):
+        self.count('requests')
+        return super().send(request, timeout=timeout or self.timeout, **kwargs)
+
+
+class RateLimitedPoolAdapter(RateLimitedAdapter, PoolAdapter):
+    pass
+
+
+def get_pool_stats(session):
+    '''
+        returns:
+            -> dict : requests sent and connections opened by the session (created by create_session)
+    '''
+    stats = {'requests': 0, 'connections': 0}
+    for adapter in set(session.adapters.values()):
+        for key, value in getattr(adapter, 'stats', {}).items():
+            stats[key] += value
+    return stats
+
+
+def log_pool_stats(session, name):
+    stats = get_pool_stats(session)
+    if stats['requests']:
+        reused = 100 - int(100 * stats['connections'] / stats['requests'])
+        logger.info(f'{name}: {stats["requests"]} requests over {stats["connections"]} connections ({reused}% reused)')
+
+
+class ThreadClients():
+    '''
+    One API client per thread, for the tools sending MediaServer requests from several threads
+    (the MediaServer client and its session are not thread-safe). Clients are created by factory on first use in a thread.
+    '''
+    def __init__(self, factory):
+        self.factory = factory
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.clients = list()
+
+    def get(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.factory()
+            with self.lock:
+                self.clients.append(client)
+        return client
+
+    def api(self, *args, **kwargs):
+        return self.get().api(*args, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for client in self.clients:
+                session = getattr(client, 'session', None)
+                if session is not None:
+                    session.close()
+            self.clients = list()
+        self.local = threading.local()
+
+
+class UrlStatusCache():
+    '''
+    Persistent status of checked urls (status code, Content-Length, ETag, Last-Modified and check time),
+    so that urls are not requested again by collect, migrate or analyze until their TTL expires.
+    Expired entries with an ETag or a Last-Modified date can be revalidated with a conditional request.
+    Entries are kept in a namespace per kind of check: the HEAD requests of url_exists (collect and migrate, authenticated sessions)
+    do not give the same status as the anonymous GET requests of analyze (IIS answers 401 to HEAD requests).
+    '''
+    NAMESPACE = 'url_status'
+    # anonymous GET requests (analyze)
+    GET_NAMESPACE = 'url_status_get'
+
+    def __init__(self, path, ttl_hours=168, negative_ttl_hours=24, revalidate=False, namespace=NAMESPACE):
+        self.state = StateStore(path)
+        self.path = self.state.path
+        self.namespace = namespace
+        self.ttl = ttl_hours * 3600
+        self.negative_ttl = negative_ttl_hours * 3600
+        self.revalidate = revalidate
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0}
+
+    @classmethod
+    def from_config(cls, config, namespace=NAMESPACE):
+        '''
+        Cache file is shared by collect, migrate and analyze, in the download folder unless url_status_cache_file is set.
+
+            returns:
+                -> UrlStatusCache : None if disabled in config (url_status_cache set to false)
+        '''
+        if not config.get('url_status_cache', True):
+            return None
+        path = config.get('url_status_cache_file') or Path(config.get('download_folder', '/downloads')) / 'url_status_cache.sqlite'
+        return cls(
+            path,
+            ttl_hours=config.get('url_status_ttl_hours', 168),
+            negative_ttl_hours=config.get('url_status_negative_ttl_hours', 24),
+            revalidate=config.get('url_status_revalidate', False),
+            namespace=namespace,
+        )
+
+    def get(self, url):
+        return self.state.get(self.namespace, url)
+
+    def is_fresh(self, entry):
+        ttl = self.ttl if is_ok(entry) else self.negative_ttl
+        return time.time() - entry['checked'] < ttl
+
+    def get_fresh(self, url):
+        '''
+            returns:
+                -> dict : cached entry if checked less than TTL ago, else None
+        '''
+        entry = self.get(url)
+        if entry and self.is_fresh(entry):
+            self.stats['hits'] += 1
+            return entry
+        self.stats['misses'] += 1
+
+    def get_conditional_headers(self, entry):
+        headers = dict()
+        if self.revalidate and entry and is_ok(entry):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def set(self, url, response, length=None):
+        '''
+        Store the status of a response, or refresh the check time of the cached entry if not modified (304).
+        length is the size of the downloaded content, for responses without Content-Length.
+
+            returns:
+                -> dict : the stored entry
+        '''
+        entry = self.get(url) if response.status_code == 304 else None
+        if entry:
+            self.stats['revalidated'] += 1
+        else:
+            entry = {
+                'status': response.status_code,
+                'length': length if length is not None else int(response.headers.get('Content-Length', 0)),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+        entry['checked'] = time.time()
+        self.state.set(self.namespace, url, entry)
+        return entry
+
+    def clear(self):
+        self.state.clear(self.namespace)
+
+    def log_stats(self):
+        logger.info(f'Urls status cache {self.path}: {self.stats["hits"]} hits, {self.stats["misses"]} misses, {self.stats["revalidated"]} revalidated')
+
+
+def is_ok(entry):
+    return 200 <= entry['status'] < 400 and entry['length'] > 0
+
+
+def set_url_status_cache(session, cache):
+    '''
+    Urls checks made with this session (see url_exists) will use the cache.
+    '''
+    session.url_status_cache = cache
+    return session
+
+
+def get_url_status_cache(session):
+    return getattr(session, 'url_status_cache', None)
+
+
 def url_exists(url, session):
+    cache = get_url_status_cache(session)
+    headers = {'Accept-Encoding': None}
+    if cache:
+        entry = cache.get_fresh(url)
+        if entry:
+            return is_ok(entry)
+        headers.update(cache.get_conditional_headers(cache.get(url)))
+
     try:
-        r = session.head(url, headers={'Accept-Encoding': None})
+        r = session.head(url, headers=headers)
     except Exception as e:
         logger.error(f'Failed to reach url [{url}] : {e}')
         return False
+
+    if cache:
+        return is_ok(cache.set(url, r))
     return r.ok and int(r.headers.get('Content-Length', 0)) > 0
+
+
+def download_url(url, file_path, session):
+    '''
+    Download url into file_path, which validates the url at the same time (no HEAD request needed).
+    Files already downloaded are not downloaded again, urls known as missing in the urls status cache are not requested.
+
+        returns:
+            -> bool : file downloaded and not empty
+    '''
+    file_path = Path(file_path)
+    if file_path.is_file() and file_path.stat().st_size > 0:
+        return True
+
+    cache = get_url_status_cache(session)
+    if cache:
+        entry = cache.get_fresh(url)
+        if entry and not is_ok(entry):
+            return False
+
+    try:
+        r = session.get(url)
+    except Exception as e:
+        logger.error(f'Failed to download [{url}] : {e}')
+        return False
+
+    if cache:
+        cache.set(url, r, length=len(r.content))
+    if not r.ok or not r.content:
+        return False
+    # written under another name first, so that an interrupted download is not taken for a downloaded file
+    tmp_path = file_path.with_name(file_path.name + '.part')
+    with open(tmp_path, 'wb') as f:
+        f.write(r.content)
+    tmp_path.replace(file_path)
+    return True
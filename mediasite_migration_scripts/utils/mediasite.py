@@ -1,19 +1,42 @@
 #!/usr/bin/env python3
 import logging
+import re
+import zlib
 import utils.http as http
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from xml.etree import ElementTree
 import xml.dom.minidom as xml
 
 
 logger = logging.getLogger(__name__)
 
+ISO_DATE_PATTERN = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d{1,6})Z?)?')
+XSI_TYPE = '{http://www.w3.org/2001/XMLSchema-instance}type'
+# per-presentation resources fetched by collect, and users profiles (presentation fields) fetched, per collect profile
+PRESENTATION_RESOURCES = ['TimedEvents', 'Presenters', 'PresentationAnalytics', 'Availability']
+COLLECT_PROFILES = {
+    'full': {'resources': PRESENTATION_RESOURCES, 'users': ['Creator', 'Owner', 'PrimaryPresenter']},
+    'migrate-minimal': {'resources': ['TimedEvents', 'Presenters'], 'users': ['Owner']},
+    'analyze': {'resources': [], 'users': []},
+}
+# presentations contents which can be expanded inline in the presentations listing ($expand)
+EXPANDABLE_CONTENTS = ['OnDemandContent', 'SlideContent', 'SlideDetailsContent', 'TimedEvents', 'Presenters']
+# formats used by the migration, in order of preference
+VIDEO_FORMATS_PRIORITY = ['video/mp4', 'video/x-ms-wmv', 'video/x-mp4-fragmented']
+
 
 class MediasiteClient:
-    def __init__(self, config):
+    def __init__(self, config, rate_limiter=None):
         self.session = http.get_session(config['mediasite_api_user'],
                                         config['mediasite_api_password'],
-                                        headers={'sfapikey': config['mediasite_api_key']})
+                                        headers={'sfapikey': config['mediasite_api_key']},
+                                        config=config,
+                                        rate_limiter=rate_limiter)
         self.url_prefix = config['mediasite_api_url'].rstrip('/')
+        self.page_size = config.get('mediasite_listing_page_size', 100)
+        self.listing_workers = config.get('mediasite_listing_workers', 4)
 
     def get_presentation(self, presentation_id):
         r = self.do_request(f"/Presentations('{presentation_id}')?$select=full")
@@ -26,6 +49,47 @@ class MediasiteClient:
         url = f"{self.url_prefix}/{suffix.lstrip('/')}"
         return self.session.get(url).json()
 
+    def get_page(self, resource, skip, top, params=None, count=False):
+        query = {**(params or dict()), '$skip': skip, '$top': top}
+        if count:
+            query['$inlinecount'] = 'allpages'
+        r = self.do_request(f"/{resource}?{'&'.join(f'{k}={v}' for k, v in query.items())}")
+        if r.get('odata.error'):
+            raise RuntimeError(f"Failed to list {resource} ($skip={skip}): {r['odata.error'].get('message')}")
+        return r
+
+    def iter_pages(self, resource, params=None):
+        '''
+        Pages of a listing, in order. The first page gives the total count of items,
+        the next pages are then fetched concurrently by windows of $skip / $top (listing_workers at a time).
+
+            returns:
+                -> generator : list of items per page
+        '''
+        first_page = self.get_page(resource, 0, self.page_size, params, count=True)
+        items = first_page.get('value') or list()
+        yield items
+        if 'odata.count' not in first_page:
+            # no total, following the next pages links
+            next_link = first_page.get('odata.nextLink')
+            while next_link:
+                page = self.session.get(next_link).json()
+                yield page.get('value') or list()
+                next_link = page.get('odata.nextLink')
+            return
+
+        total = int(first_page['odata.count'])
+        # the server may return less items per page than asked
+        top = len(items) if items and len(items) < self.page_size else self.page_size
+        skips = range(len(items), total, top)
+        if self.listing_workers > 1 and len(skips) > 1:
+            with ThreadPoolExecutor(max_workers=self.listing_workers) as executor:
+                for page in executor.map(lambda skip: self.get_page(resource, skip, top, params), skips):
+                    yield page.get('value') or list()
+        else:
+            for skip in skips:
+                yield self.get_page(resource, skip, top, params).get('value') or list()
+
     def close(self):
         self.session.close()
 
@@ -60,45 +124,60 @@ def get_video_url(video_file, playback_ticket=str(), site=str()):
 def check_videos_urls(videos, session):
     """
         Check if at least one valid url exists for a video.
-        In case of composites videos, all videos streams will be checked.
+        In case of composites videos, all videos streams will be checked (concurrently).
+        Files of a stream are checked by format priority (mp4 first), and the check of a stream stops at its first file found.
 
         return:
             video_urls_ok -> bool : a url exists for each video
-            videos_urls_missing -> int : count of urls not reachables
+            videos_urls_missing -> int : count of urls checked and not reachables (files not checked are not counted)
             videos_stream_types_count -> int : count of videos streams types (> 1 if composites)
     """
 
-    videos_found = list()
-    videos_stream_types = set()
-    videos_total_count = len(videos)
-
+    streams = dict()
     for video_file in videos:
         # one video stream can have multiple files
-        videos_stream_types.add(video_file['StreamType'])
+        streams.setdefault(video_file['StreamType'], list()).append(video_file)
+
+    if len(streams) > 1:
+        with ThreadPoolExecutor(max_workers=len(streams)) as executor:
+            results = list(executor.map(lambda files: _check_stream_urls(files, session), streams.values()))
+    else:
+        results = [_check_stream_urls(files, session) for files in streams.values()]
+
+    # all videos streams must have at least one video file with a valid url (in composites videos case, there's at least 2 videos streams)
+    videos_urls_ok = all(found for found, missing, unchecked in results)
+    videos_urls_missing_count = sum(missing for found, missing, unchecked in results)
+    unchecked_count = sum(unchecked for found, missing, unchecked in results)
+    if unchecked_count:
+        logger.debug(f'{unchecked_count} videos files not checked (another file of the same stream was found)')
+    videos_stream_types_count = len(streams)
+    return videos_urls_ok, videos_urls_missing_count, videos_stream_types_count
+
+
+def _check_stream_urls(video_files, session):
+    """
+        return:
+            found -> bool : a file of the stream is reachable
+            missing -> int : count of files checked and not reachables
+            unchecked -> int : count of files not checked after the file found
+    """
+    def priority(video_file):
+        mime_type = video_file.get('ContentMimeType')
+        return VIDEO_FORMATS_PRIORITY.index(mime_type) if mime_type in VIDEO_FORMATS_PRIORITY else len(VIDEO_FORMATS_PRIORITY)
 
+    missing = 0
+    video_files = sorted(video_files, key=priority)
+    for index, video_file in enumerate(video_files):
         video_file_url = video_file.get('Url')
         if video_file_url is None:
             video_file_url = get_video_url(video_file)
 
         if video_file_url:
-            video_file_found = http.url_exists(video_file_url, session)
-            if video_file_found:
-                videos_found.append(video_file)
-            else:
-                logger.warning(f'Video file not found: {video_file_url}')
-
-    # all videos streams must have at least one video file with a valid url (in composites videos case, there's at least 2 videos streams)
-    videos_stream_types_found = set()
-    for stream_type in videos_stream_types:
-        for v in videos_found:
-            if stream_type == v['StreamType']:
-                videos_stream_types_found.add(stream_type)
-                break
-
-    videos_urls_ok = (len(videos_stream_types) == len(videos_stream_types_found))
-    videos_urls_missing_count = videos_total_count - len(videos_found)
-    videos_stream_types_count = len(videos_stream_types)
-    return videos_urls_ok, videos_urls_missing_count, videos_stream_types_count
+            if http.url_exists(video_file_url, session):
+                return True, missing, len(video_files) - index - 1
+            logger.warning(f'Video file not found: {video_file_url}')
+            missing += 1
+    return False, missing, 0
 
 
 def get_slides_count(slides):
@@ -175,7 +254,22 @@ def get_best_video_file(video, allow_wmv=False):
     return video_file
 
 
+@lru_cache(maxsize=4096)
 def parse_mediasite_date(date_str):
+    # dates are compared for every presentation and channel, most of them are plain ISO dates
+    match = ISO_DATE_PATTERN.fullmatch(date_str)
+    if match:
+        date, ms = match.groups()
+        try:
+            date = datetime.fromisoformat(date)
+        except ValueError:
+            return _parse_mediasite_date(date_str)
+        # same as below, '27.58Z' is 27s and 58 microseconds
+        return date.replace(microsecond=int(ms)) if ms else date
+    return _parse_mediasite_date(date_str)
+
+
+def _parse_mediasite_date(date_str):
     date_format = '%Y-%m-%dT%H:%M:%S'
     if '.' in date_str:
         # some media have msec included
@@ -223,30 +317,39 @@ def parse_encoding_settings_xml(encoding_settings):
         returns:
             video codec, audio codec, width and height
     """
-    encoding_infos = dict()
     try:
         serialized_settings = encoding_settings['SerializedSettings']
-        settings_data = xml.parseString(serialized_settings).documentElement
+    except Exception as e:
+        logger.debug(f'XML could not be parsed for video encoding settings: {e}')
+        return dict()
+    # a copy, the parsed settings are shared by all the videos encoded with the same profile
+    return dict(_parse_serialized_settings(serialized_settings))
+
+
+@lru_cache(maxsize=1024)
+def _parse_serialized_settings(serialized_settings):
+    encoding_infos = dict()
+    try:
+        settings_data = ElementTree.fromstring(serialized_settings)
         # Tag 'Settings' is a XML string to be parsed again...
-        settings_node = settings_data.getElementsByTagName('Settings')[0]
-        settings = xml.parseString(settings_node.firstChild.nodeValue)
+        settings = ElementTree.fromstring(settings_data.find('.//Settings').text)
 
-        width = int(settings.getElementsByTagName('PresentationAspectX')[0].firstChild.nodeValue)
-        height = int(settings.getElementsByTagName('PresentationAspectY')[0].firstChild.nodeValue)
+        width = int(settings.find('.//{*}PresentationAspectX').text)
+        height = int(settings.find('.//{*}PresentationAspectY').text)
         # sometimes resolution values given by the API are reversed, it's better to use MediaInfo in that case
         if width < height:
             logger.debug('Resolution values given by the API may be reversed...')
             return {}
 
-        codecs_settings = settings.getElementsByTagName('StreamProfiles')[0]
+        codecs_settings = settings.find('.//{*}StreamProfiles')
         audio_codec = str()
         video_codec = str()
-        for element in codecs_settings.childNodes:
-            if element.getAttribute('i:type') == 'AudioEncoderProfile':
-                audio_codec = element.getElementsByTagName('FourCC')[0].firstChild.nodeValue
+        for element in codecs_settings:
+            if element.get(XSI_TYPE) == 'AudioEncoderProfile':
+                audio_codec = element.find('.//{*}FourCC').text
                 audio_codec = 'AAC' if audio_codec == 'AACL' else audio_codec
-            elif element.getAttribute('i:type') == 'VideoEncoderProfile':
-                video_codec = element.getElementsByTagName('FourCC')[0].firstChild.nodeValue
+            elif element.get(XSI_TYPE) == 'VideoEncoderProfile':
+                video_codec = element.find('.//{*}FourCC').text
 
         encoding_infos = {
             'video_codec': video_codec,
@@ -278,3 +381,149 @@ def parse_timed_events_xml(timed_events):
                 logger.debug(f'Failed to get timed event for presentation {pid}: {e}')
 
     return parsed_timed_events
+
+
+def parse_shard(shard):
+    '''
+    Parse a shard as given on the command line: "2/4" is the second of 4 shards.
+
+        returns:
+            -> tuple : (shard index starting at 1, shards count)
+    '''
+    try:
+        index, count = (int(n) for n in shard.split('/'))
+    except ValueError:
+        raise ValueError(f'Invalid shard {shard}, expected i/N (for example 1/4)')
+    if not 1 <= index <= count:
+        raise ValueError(f'Invalid shard {shard}, i must be between 1 and N')
+    return index, count
+
+
+def get_folder_shard(folder_id, shards_count):
+    '''
+        returns:
+            -> int : index (starting at 1) of the shard collecting the folder, the same on every host (unlike hash())
+    '''
+    return zlib.crc32(folder_id.encode()) % shards_count + 1
+
+
+def get_folders_paths(folders):
+    '''
+        returns:
+            -> dict : folder path (/parent/name) per folder id
+    '''
+    folders_by_id = {folder['Id']: folder for folder in folders}
+    paths = dict()
+
+    def get_path(folder_id):
+        if folder_id not in paths:
+            folder = folders_by_id.get(folder_id)
+            if folder is None:
+                # root folder, not listed
+                return ''
+            # set before recursing, in case of a loop in parents
+            paths[folder_id] = '/' + folder['Name']
+            paths[folder_id] = get_path(folder.get('ParentFolderId')) + '/' + folder['Name']
+        return paths[folder_id]
+
+    for folder_id in folders_by_id:
+        get_path(folder_id)
+    return paths
+
+
+def select_folders(folders, shard=None, subtrees=None):
+    '''
+    Select the folders to collect, so that several collects can each crawl a disjoint part of the folder tree.
+
+    params :
+        shard : (index, count) tuple, only keep the folders of this shard
+        subtrees : folders paths or ids, only keep these folders and their subfolders
+    returns:
+        -> list : selected folders, in the same order
+    '''
+    if subtrees:
+        paths = get_folders_paths(folders)
+        roots = [paths.get(subtree, subtree).rstrip('/') for subtree in subtrees]
+        folders = [f for f in folders if any(paths[f['Id']] == root or paths[f['Id']].startswith(root + '/') for root in roots)]
+    if shard:
+        index, count = shard
+        folders = [f for f in folders if get_folder_shard(f['Id'], count) == index]
+    return folders
+
+
+def get_collect_profile(name):
+    '''
+        returns:
+            -> dict : resources and users fetched for each presentation with this collect profile
+    '''
+    if name not in COLLECT_PROFILES:
+        raise ValueError(f'Unknown collect profile {name}, expected one of {", ".join(COLLECT_PROFILES)}')
+    return COLLECT_PROFILES[name]
+
+
+def is_collected(presentation, resource_name):
+    '''
+    Resources skipped by the collect profile are listed in the NotCollected field of the presentation.
+    '''
+    return resource_name not in presentation.get('NotCollected', list())
+
+
+def get_users_by_username(users):
+    '''
+    UserProfiles of the collected data are keyed by username,
+    files collected by older versions have a list of profiles (with duplicates).
+
+        returns:
+            -> dict : user profile per username
+    '''
+    if not users:
+        return dict()
+    if isinstance(users, dict):
+        return users
+    return {user.get('UserName'): user for user in users}
+
+
+def merge_collected_data(shards_data):
+    '''
+    Combine the data collected by several shards into a single Mediasite data file.
+    Folders collected by several shards (overlapping subtrees) are kept once, with all their presentations,
+    users found by several shards are kept once.
+
+        returns:
+            -> dict : {'Folders': [...], 'UserProfiles': {username: profile}}
+    '''
+    folders = dict()
+    users = dict()
+    for data in shards_data:
+        for folder in data.get('Folders', []):
+            merged = folders.get(folder['Id'])
+            if merged is None:
+                folders[folder['Id']] = dict(folder, Presentations=list(folder.get('Presentations') or []))
+            else:
+                presentations_ids = {p['Id'] for p in merged['Presentations']}
+                for presentation in folder.get('Presentations') or []:
+                    if presentation['Id'] not in presentations_ids:
+                        merged['Presentations'].append(presentation)
+        for username, user in get_users_by_username(data.get('UserProfiles')).items():
+            users.setdefault(username, user)
+    return {'Folders': list(folders.values()), 'UserProfiles': users}
+
+
+def get_url_id(url):
+    # Mediasite ids are the last segment of the presentations (Play) urls
+    return url.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+
+
+def get_redirected_ids(redirections):
+    '''
+    Index of the redirections by Mediasite id, to look up migrated presentations without scanning all the redirections.
+
+        returns:
+            -> dict : MediaServer oid (from the permalink) per Mediasite id
+    '''
+    ids = dict()
+    for from_url, to_url in redirections.items():
+        parts = to_url.split('/')
+        if len(parts) > 4:
+            ids[get_url_id(from_url)] = parts[4]
+    return ids
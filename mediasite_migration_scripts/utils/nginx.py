@@ -0,0 +1,115 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+POINTER_SIZE = 8
+# nginx default map_hash_max_size
+DEFAULT_MAX_SIZE = 2048
+UINT_MASK = (1 << 64) - 1
+
+
+def get_map_entries(redirections, from_root, additional_redirections=None):
+    '''
+    Entries of the nginx map of the redirections: the path of each Mediasite url is an exact entry (with and without trailing slash),
+    additional urls of a presentation (other url patterns) are case-insensitive regex entries, tested only when no exact entry matches.
+
+    params:
+        redirections : {mediasite_url: mediaserver_url}
+        from_root : Mediasite root url (scheme and host), removed from the urls
+        additional_redirections : {presentation_id: [mediasite_url, ...]}
+        returns:
+            -> dict : {path: mediaserver_url}
+            -> list : [(regex, mediaserver_url)]
+    '''
+    exact = dict()
+    regexes = dict()
+    lowercased = set()
+    for from_url, to_url in redirections.items():
+        path = get_path(from_url, from_root)
+        # nginx lowercases exact entries, two entries differing by case would conflict
+        for key in [path, path.rstrip('/') + '/']:
+            if key.lower() not in lowercased:
+                lowercased.add(key.lower())
+                exact[key] = to_url
+
+        pid = from_url.rstrip('/').split('/')[-1]
+        for url in (additional_redirections or dict()).get(pid, list()):
+            additional_path = get_path(url, from_root)
+            if additional_path.lower() not in lowercased:
+                regexes.setdefault('~*' + re.escape(additional_path), to_url)
+    return exact, list(regexes.items())
+
+
+def get_path(url, from_root):
+    if not url.startswith(from_root):
+        raise ValueError(f'Configuration mismatch, {from_root} not found in {url}')
+    return url[len(from_root):] or '/'
+
+
+def write_map(path, exact, regexes):
+    with open(path, 'w') as f:
+        for key, value in exact.items():
+            f.write(f'"{quote(key)}" "{quote(value)}";\n')
+        for key, value in regexes:
+            f.write(f'"{quote(key)}" "{quote(value)}";\n')
+
+
+def quote(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def hash_key_lc(key):
+    '''
+    nginx ngx_hash_key_lc (keys of map exact entries are lowercased).
+    '''
+    h = 0
+    for c in key.lower().encode():
+        h = (h * 31 + c) & UINT_MASK
+    return h
+
+
+def elt_size(key):
+    # NGX_HASH_ELT_SIZE: value pointer, key length (2 bytes) and key, aligned on the pointer size
+    return POINTER_SIZE + ((len(key.encode()) + 2 + POINTER_SIZE - 1) & ~(POINTER_SIZE - 1))
+
+
+def get_map_hash_sizes(keys, max_buckets_ratio=2, max_bucket_size=4096):
+    '''
+    Smallest map_hash_bucket_size (a power of 2) for which nginx can build the hash of the map keys with at most
+    max_buckets_ratio buckets per key (or the default map_hash_max_size), and the map_hash_max_size it needs
+    with this bucket size (same algorithm as ngx_hash_init, never less than the default).
+
+        returns:
+            -> tuple : (map_hash_bucket_size, map_hash_max_size), None if no size was found
+    '''
+    if not keys:
+        return 64, DEFAULT_MAX_SIZE
+    hashes = [hash_key_lc(key) for key in keys]
+    sizes = [elt_size(key) for key in keys]
+    nelts = len(keys)
+
+    bucket_size = 64
+    # each bucket ends with a null pointer
+    while bucket_size < max(sizes) + POINTER_SIZE:
+        bucket_size *= 2
+    while bucket_size <= max_bucket_size:
+        usable = bucket_size - POINTER_SIZE
+        size = max(nelts // (usable // (2 * POINTER_SIZE)), 1)
+        while size <= max(nelts * max_buckets_ratio, DEFAULT_MAX_SIZE):
+            if fits(hashes, sizes, size, usable):
+                return bucket_size, max(size, DEFAULT_MAX_SIZE)
+            # nginx tries every size, a found size is enough as a maximum
+            size += max(size // 100, 1)
+        bucket_size *= 2
+    return None
+
+
+def fits(hashes, sizes, size, usable):
+    buckets = [0] * size
+    for h, s in zip(hashes, sizes):
+        key = h % size
+        buckets[key] += s
+        if buckets[key] > usable:
+            return False
+    return True
@@ -0,0 +1,221 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RateLimiter():
+    '''
+    Token bucket whose rate is adjusted like TCP congestion control (AIMD):
+    the rate is increased while the server answers fast and successfully (quickly until the first slowdown, slowly afterwards),
+    and divided when it answers 429 / 5xx, fails or gets slower than target_latency_ms.
+    Can be shared between threads and sessions talking to the same server.
+    '''
+    def __init__(self, name='default', initial_rps=10, min_rps=0.2, max_rps=100, burst=None,
+                 target_latency_ms=2000, increase_step=1, decrease_factor=0.5, max_backoff_s=300):
+        self.name = name
+        self.rate = float(initial_rps)
+        self.min_rate = float(min_rps)
+        self.max_rate = float(max_rps)
+        self.burst = burst or max(1, int(initial_rps))
+        self.target_latency = target_latency_ms / 1000
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.max_backoff = max_backoff_s
+
+        self.lock = threading.Lock()
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()
+        self.last_decrease = 0
+        self.slow_start_threshold = self.max_rate
+        self.paused_until = 0
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'slow': 0, 'waited_s': 0, 'min_rps': self.rate}
+
+    @classmethod
+    def from_config(cls, config, prefix):
+        '''
+        Keys are prefixed by the server name, for example mediasite_max_rps or mediaserver_target_latency_ms.
+
+            returns:
+                -> RateLimiter : None if disabled in config ({prefix}_rate_limit set to false)
+        '''
+        if not config.get(f'{prefix}_rate_limit', True):
+            return None
+        kwargs = dict()
+        for key in ['initial_rps', 'min_rps', 'max_rps', 'burst', 'target_latency_ms', 'max_backoff_s']:
+            if config.get(f'{prefix}_{key}') is not None:
+                kwargs[key] = config[f'{prefix}_{key}']
+        return cls(prefix, **kwargs)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        '''
+        Block until a request can be sent.
+
+            returns:
+                -> float : time waited, in seconds
+        '''
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.stats['waited_s'] += waited
+                    return waited
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def record(self, status_code=None, latency=0, retry_after=None):
+        '''
+        Adjust the rate with the outcome of a request, status_code is None if the request failed.
+        '''
+        with self.lock:
+            self.stats['requests'] += 1
+            if status_code is None or status_code in RETRY_STATUS_CODES:
+                self.stats['throttled' if status_code == 429 else 'errors'] += 1
+                self._decrease(retry_after)
+            elif latency > self.target_latency:
+                self.stats['slow'] += 1
+                self._decrease()
+            elif self.rate < self.slow_start_threshold:
+                # the rate doubles every second of healthy traffic
+                self.rate = min(self.slow_start_threshold, self.rate + self.increase_step)
+            else:
+                # about increase_step more requests per second for each second of healthy traffic
+                self.rate = min(self.max_rate, self.rate + self.increase_step / max(self.rate, 1))
+
+    def _decrease(self, retry_after=None):
+        now = time.monotonic()
+        # concurrent requests failing together are the same congestion event
+        if now - self.last_decrease > 1:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.slow_start_threshold = self.rate
+            self.tokens = min(self.tokens, 0)
+            self.last_decrease = now
+            self.stats['min_rps'] = min(self.stats['min_rps'], self.rate)
+            logger.debug(f'{self.name}: slowing down to {self.rate:.2f} requests/s')
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + min(retry_after, self.max_backoff))
+
+    def get_backoff_delay(self, attempt):
+        '''
+            returns:
+                -> float : seconds to wait before retrying a failed request (exponential, with jitter)
+        '''
+        return min(self.max_backoff, 2 ** attempt) * random.uniform(0.5, 1)
+
+    def backoff(self, attempt=0):
+        delay = self.get_backoff_delay(attempt)
+        logger.debug(f'{self.name}: waiting {delay:.1f}s before retrying')
+        time.sleep(delay)
+
+    def ignore(self):
+        '''
+        Count a request whose outcome says nothing about the load of the server (client side error), the rate is not changed.
+        '''
+        with self.lock:
+            self.stats['requests'] += 1
+
+    def call(self, func, *args, **kwargs):
+        '''
+        Call func (a request made by a client we do not control) when the rate allows it,
+        exceptions caused by the server or the network count as failed requests, other exceptions do not change the rate.
+        '''
+        self.acquire()
+        before = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_server_error(e):
+                response = getattr(e, 'response', None)
+                retry_after = get_retry_after(response) if response is not None else None
+                self.record(get_error_status_code(e), time.monotonic() - before, retry_after)
+            else:
+                self.ignore()
+            raise
+        self.record(200, time.monotonic() - before)
+        return result
+
+    def log_stats(self):
+        stats = self.stats
+        logger.info(
+            f'{self.name} rate limiter: {stats["requests"]} requests, {stats["throttled"]} throttled, {stats["errors"]} errors, '
+            f'{stats["slow"]} slow, waited {int(stats["waited_s"])}s, final rate {self.rate:.1f} requests/s (lowest {stats["min_rps"]:.1f})'
+        )
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    '''
+    Transport adapter sending requests through a RateLimiter.
+    Idempotent requests answered with 429 / 5xx or failing to connect are retried with an exponential backoff.
+    '''
+    def __init__(self, limiter, retries=3, **kwargs):
+        self.limiter = limiter
+        self.retries = retries
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            before = time.monotonic()
+            can_retry = request.method in RETRY_METHODS and attempt < self.retries
+            try:
+                response = super().send(request, **kwargs)
+            except Exception as e:
+                self.limiter.record(None)
+                if not can_retry:
+                    raise
+                logger.debug(f'{request.method} {request.url} failed ({e}), retrying')
+            else:
+                retry_after = get_retry_after(response)
+                self.limiter.record(response.status_code, time.monotonic() - before, retry_after)
+                if response.status_code not in RETRY_STATUS_CODES or not can_retry:
+                    return response
+                logger.debug(f'{request.method} {request.url} answered {response.status_code}, retrying')
+                response.close()
+                if retry_after:
+                    # the limiter is paused until then
+                    attempt += 1
+                    continue
+            self.limiter.backoff(attempt)
+            attempt += 1
+
+
+def get_error_status_code(exception):
+    '''
+        returns:
+            -> int : status code of the response which caused the exception (requests HTTPError, or clients errors with a response), None if unknown
+    '''
+    response = getattr(exception, 'response', None)
+    status_code = getattr(response, 'status_code', None) if response is not None else getattr(exception, 'status_code', None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_server_error(exception):
+    status_code = get_error_status_code(exception)
+    if status_code is not None:
+        return status_code in RETRY_STATUS_CODES
+    # no response: the server could not be reached or did not answer in time
+    return isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def get_retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
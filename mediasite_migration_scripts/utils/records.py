@@ -0,0 +1,211 @@
+import json
+import logging
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+
+class StoredPayload():
+    '''
+    Reference to a payload written in a PayloadStore.
+    '''
+    __slots__ = ('store', 'payload_id')
+
+    def __init__(self, store, payload_id):
+        self.store = store
+        self.payload_id = payload_id
+
+    def load(self):
+        return self.store.read(self)
+
+
+class PayloadStore():
+    '''
+    Large parts of the media records (raw presentation for external data, slides details, chapters),
+    kept in the state store (utils.state.StateStore) until the media is uploaded.
+    '''
+    def __init__(self, state):
+        self.state = state
+
+    def write(self, payload):
+        '''
+            returns:
+                -> StoredPayload : reference to read the payload back
+        '''
+        return StoredPayload(self, self.state.add_payload(payload))
+
+    def read(self, ref):
+        return self.state.get_payload(ref.payload_id)
+
+    def clear(self):
+        self.state.clear_payloads()
+
+
+class SlottedRecord(MutableMapping):
+    '''
+    Dict-like record storing its known keys (FIELDS) in slots, any other key goes in an extra dict.
+    A slot which has never been set is considered missing.
+    '''
+    __slots__ = ('_extra',)
+    FIELDS = ()
+
+    def __init__(self, **fields):
+        self._extra = None
+        for key, value in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return object.__getattribute__(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            object.__setattr__(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = dict()
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                object.__delattr__(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)})'
+
+
+class MediaRef(SlottedRecord):
+    __slots__ = ('channel_path', 'folder_path', 'media_oid', 'slug')
+    FIELDS = __slots__
+
+
+class MediaData(SlottedRecord):
+    '''
+    MediaServer media fields (medias/add parameters) of a presentation.
+
+    external_data is kept as a dict (or in the payload store for whole presentations) and serialized when read,
+    slides and chapters are read from the payload store when given as StoredPayload.
+    '''
+    LAZY_FIELDS = ('external_data', 'slides', 'chapters')
+    __slots__ = (
+        'title', 'channel_title', 'channel_unlisted', 'creation', 'validated', 'description', 'keywords', 'slug',
+        'transcode', 'origin', 'detect_slides', 'layout', 'video_type', 'file_url', 'composites_videos_urls',
+        'speaker_id', 'speaker_name', 'speaker_email', 'thumb', 'channel', 'external_ref', 'priority', 'layout_preset',
+        'api_key', 'presentation_id',
+    ) + tuple(f'_{field}' for field in LAZY_FIELDS)
+    FIELDS = __slots__[:-len(LAZY_FIELDS) - 1]
+
+    def __init__(self, presentation_id=None, **fields):
+        # not a MediaServer field, so not part of the mapping
+        object.__setattr__(self, 'presentation_id', presentation_id)
+        super().__init__(**fields)
+
+    def __getitem__(self, key):
+        if key in self.LAZY_FIELDS:
+            try:
+                value = object.__getattribute__(self, f'_{key}')
+            except AttributeError:
+                raise KeyError(key)
+            if isinstance(value, StoredPayload):
+                value = value.load()
+            if key == 'external_data' and not isinstance(value, str):
+                value = json.dumps(value, indent=2, sort_keys=True)
+            return value
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        if key in self.LAZY_FIELDS:
+            object.__setattr__(self, f'_{key}', value)
+        else:
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        if key in self.LAZY_FIELDS:
+            try:
+                object.__delattr__(self, f'_{key}')
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            super().__delitem__(key)
+
+    def __iter__(self):
+        yield from super().__iter__()
+        for key in self.LAZY_FIELDS:
+            if hasattr(self, f'_{key}'):
+                yield key
+
+    def to_state(self):
+        '''
+            returns:
+                -> dict : JSON serializable fields, stored payloads are kept as references
+        '''
+        state = {key: self[key] for key in SlottedRecord.__iter__(self)}
+        for key in self.LAZY_FIELDS:
+            value = getattr(self, f'_{key}', None)
+            if isinstance(value, StoredPayload):
+                state[key] = {'$payload': value.payload_id}
+            elif hasattr(self, f'_{key}'):
+                state[key] = value
+        state['$presentation_id'] = self.presentation_id
+        return state
+
+    @classmethod
+    def from_state(cls, state, store):
+        state = dict(state)
+        data = cls(presentation_id=state.pop('$presentation_id', None))
+        for key, value in state.items():
+            if key in cls.LAZY_FIELDS and isinstance(value, dict) and '$payload' in value:
+                value = StoredPayload(store, value['$payload'])
+            data[key] = value
+        return data
+
+
+class MediaRecord():
+    '''
+    Media to migrate: MediaServer fields (data) and migration references (ref).
+    Items can be read like the former {'data': ..., 'ref': ...} dicts.
+    '''
+    __slots__ = ('data', 'ref')
+    KEYS = __slots__
+
+    def __init__(self, data, ref):
+        self.data = data
+        self.ref = ref
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def to_state(self):
+        return {'data': self.data.to_state(), 'ref': dict(self.ref)}
+
+    @classmethod
+    def from_state(cls, state, store):
+        return cls(MediaData.from_state(state['data'], store), MediaRef(**state['ref']))
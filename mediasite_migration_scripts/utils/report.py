@@ -0,0 +1,225 @@
+import csv
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.cache import Cache, cached
+
+logger = logging.getLogger(__name__)
+
+FIELDNAMES = ['mediasite_path', 'mediaserver_path', 'mediasite_url', 'mediaserver_url']
+
+
+class ReportVerifier():
+    '''
+    Verification of the migrated presentations for the report: each presentation is checked on MediaServer
+    (and on Mediasite when fixing the published status), by at most mediasite_workers / mediaserver_workers concurrent requests.
+    Rows are written in the csv as soon as they are verified, in the order of the presentations, and recorded in the state store
+    with the options of the run, so that an interrupted report resumes where it stopped. Results recorded with other options,
+    or with a published status mismatch which has not been fixed, are verified again. Channel paths are requested once per channel and shared by the medias.
+
+    params:
+        ms_api : MediaServer client api method
+        redirections : {mediasite_url: mediaserver_url}
+        play_url_pattern : Mediasite play url, followed by the presentation id in the redirections
+        get_presentation : Mediasite client get_presentation method, needed to fix the published status
+        state : StateStore where the verified presentations are recorded
+    '''
+    NAMESPACE = 'report'
+
+    def __init__(self, ms_api, redirections, play_url_pattern, get_presentation=None, state=None,
+                 mediasite_workers=4, mediaserver_workers=8, fix_private=False, apply_changes=False):
+        self.ms_api = ms_api
+        self.redirections = redirections
+        self.play_url_pattern = play_url_pattern
+        self.get_presentation = get_presentation
+        self.state = state
+        self.fix_private = fix_private
+        self.apply_changes = apply_changes
+        self.workers = mediaserver_workers + (mediasite_workers if fix_private else 0)
+        self.semaphores = {
+            'mediasite': threading.BoundedSemaphore(mediasite_workers),
+            'mediaserver': threading.BoundedSemaphore(mediaserver_workers),
+        }
+        self.caches = {'channel_paths': Cache('channel_paths', maxsize=100000)}
+        self.stats = {'verified': 0, 'resumed': 0, 'skipped': 0, 'missing': 0, 'mismatches': 0, 'fixed': 0, 'errors': 0}
+
+    @classmethod
+    def from_config(cls, config, ms_api, redirections, play_url_pattern, **kwargs):
+        return cls(
+            ms_api,
+            redirections,
+            play_url_pattern,
+            mediasite_workers=config.get('report_mediasite_workers', 4),
+            mediaserver_workers=config.get('report_mediaserver_workers', 8),
+            **kwargs,
+        )
+
+    def _call(self, api_name, func, *args, **kwargs):
+        with self.semaphores[api_name]:
+            return func(*args, **kwargs)
+
+    def _ms_call(self, suffix, **kwargs):
+        return self._call('mediaserver', self.ms_api, suffix, **kwargs)
+
+    @cached('channel_paths')
+    def get_channel_path(self, oid):
+        '''
+            returns:
+                -> str : titles of the channel and of its parents, from the root, each followed by a slash
+        '''
+        channel = self._ms_call('channels/get/', params={'oid': oid})
+        if not channel or not channel.get('success'):
+            raise RuntimeError(f'Failed to get channel {oid}: {(channel or dict()).get("error")}')
+        info = channel['info']
+        parent_path = self.get_channel_path(info['parent_oid']) if info.get('parent_oid') else ''
+        return parent_path + info['title'] + '/'
+
+    def get_mediaserver_path(self, media):
+        info = media['info']
+        if 'path' in info:
+            return ''.join(p['title'] + '/' for p in info['path']) + info['oid']
+        return self.get_channel_path(info['parent_oid']) + info['oid']
+
+    def verify(self, folder_path, presentation_id):
+        '''
+            returns:
+                -> dict : csv row, missing (migrated media not found) and mismatch (published status) flags
+        '''
+        mediasite_url = self.play_url_pattern + presentation_id
+        mediaserver_url = self.redirections.get(mediasite_url)
+        result = {
+            'row': {
+                'mediasite_path': folder_path + '/' + presentation_id,
+                'mediaserver_path': 'SKIPPED',
+                'mediasite_url': mediasite_url,
+                'mediaserver_url': mediaserver_url or 'SKIPPED',
+            },
+            'missing': False,
+            'mismatch': False,
+            'options': self.get_options(),
+        }
+        if not mediaserver_url:
+            return result
+
+        should_be_published = False
+        if self.fix_private:
+            presentation = self._call('mediasite', self.get_presentation, presentation_id)
+            # presentation does not exist anymore: should not be published
+            if presentation:
+                should_be_published = presentation['Status'] == 'Viewable' and not presentation['Private']
+
+        oid = mediaserver_url.split('/')[4]
+        params = {'oid': oid}
+        media = self._ms_call('medias/get/', params=params)
+        if media and media.get('success') and 'parent_oid' not in media['info']:
+            media = self._ms_call('medias/get/', params={**params, 'path': 'yes'})
+        if not media or not media.get('success'):
+            result['missing'] = True
+            result['row']['mediaserver_path'] = None
+            return result
+        result['row']['mediaserver_path'] = self.get_mediaserver_path(media)
+
+        is_published = media['info']['validated']
+        if self.fix_private and is_published != should_be_published:
+            result['mismatch'] = True
+            logger.info(f'Video {oid} published status mismatch: {is_published} vs expected {should_be_published}')
+            if self.apply_changes:
+                result['fixed'] = self.set_media_published(oid, should_be_published)
+            else:
+                logger.info(f'Dry run: not setting {oid} published to {should_be_published}')
+        return result
+
+    def set_media_published(self, oid, published_bool):
+        logger.info(f'Setting {oid} to validated: {published_bool}')
+        r = self._ms_call('medias/edit/', method='post', data={'oid': oid, 'validated': 'yes' if published_bool else 'no'})
+        if not r or not r['success']:
+            logger.error(r)
+            return False
+        return True
+
+    def get_options(self):
+        return {'fix_private': self.fix_private, 'apply_changes': self.apply_changes}
+
+    def is_resumable(self, result):
+        '''
+            returns:
+                -> bool : result recorded by a previous run with the same options, without a published status left to fix
+        '''
+        if not result or result.get('options') != self.get_options():
+            return False
+        return not result['mismatch'] or bool(result.get('fixed'))
+
+    def run(self, presentations, csv_path, reset=False):
+        '''
+        params:
+            presentations : [(folder_path, presentation_id)] in the order of the report
+            reset : verify again the presentations recorded by a previous run
+            returns:
+                -> dict : {presentation_id: result} of all the presentations (see verify)
+        '''
+        before = time.time()
+        if reset and self.state is not None:
+            self.state.clear(self.NAMESPACE)
+        done = dict(self.state.items(self.NAMESPACE)) if self.state is not None else dict()
+        results = dict()
+        self.stats['resumed'] = sum(1 for folder_path, presentation_id in presentations if self.is_resumable(done.get(presentation_id)))
+        to_verify = len(presentations) - self.stats['resumed']
+        if self.stats['resumed']:
+            logger.info(f'Resuming report: {self.stats["resumed"]} presentations already verified, {to_verify} to verify')
+
+        total = len(presentations)
+        with open(csv_path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+            writer.writeheader()
+            csvfile.flush()
+
+            # results are written in the order of the presentations, resumed ones included,
+            # the window bounds the amount of verified rows waiting for a slower one
+            window = deque()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for folder_path, presentation_id in presentations:
+                    result = done.get(presentation_id)
+                    if self.is_resumable(result):
+                        window.append((presentation_id, None, result))
+                    else:
+                        window.append((presentation_id, executor.submit(self.verify, folder_path, presentation_id), None))
+                    if len(window) >= 4 * self.workers:
+                        self._write_result(writer, csvfile, results, *window.popleft(), total)
+                while window:
+                    self._write_result(writer, csvfile, results, *window.popleft(), total)
+        print()
+
+        self.stats['skipped'] = sum(1 for result in results.values() if result['row']['mediaserver_url'] == 'SKIPPED')
+        self.stats['missing'] = sum(1 for result in results.values() if result['missing'])
+        self.stats['mismatches'] = sum(1 for result in results.values() if result['mismatch'])
+        self.stats['fixed'] = sum(1 for result in results.values() if result.get('fixed'))
+        cache_stats = self.caches['channel_paths'].stats
+        logger.info(
+            f'Verified {self.stats["verified"]} presentations in {int(time.time() - before)}s '
+            f'({len(self.caches["channel_paths"])} channel paths requested, {cache_stats["hits"] + cache_stats["coalesced"]} reused), '
+            f'{self.stats["errors"]} errors'
+        )
+        return results
+
+    def _write_result(self, writer, csvfile, results, presentation_id, future, resumed, total):
+        if future is None:
+            result = resumed
+        else:
+            try:
+                result = future.result()
+            except Exception as e:
+                # not recorded: verified again by the next run
+                self.stats['errors'] += 1
+                logger.error(f'Failed to verify presentation {presentation_id}: {e}')
+                return
+            self.stats['verified'] += 1
+            if self.state is not None:
+                self.state.set(self.NAMESPACE, presentation_id, result)
+        results[presentation_id] = result
+        writer.writerow(result['row'])
+        csvfile.flush()
+        print(utils.get_progress_string(len(results) - 1, total), end='\r')
@@ -0,0 +1,103 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore():
+    '''
+    SQLite file holding what must survive a restart (mapping cache, large payloads, ...).
+    Values are stored as JSON, grouped by namespace. Can be shared between threads.
+    '''
+    JOURNAL_MODE = 'WAL'
+    SYNCHRONOUS = 'NORMAL'
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        # autocommit, each write is its own transaction
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute(f'PRAGMA journal_mode={self.JOURNAL_MODE}')
+        self.db.execute(f'PRAGMA synchronous={self.SYNCHRONOUS}')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS state (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            updated REAL,
+            PRIMARY KEY (namespace, key)
+        )''')
+        self.db.execute('CREATE TABLE IF NOT EXISTS payloads (id INTEGER PRIMARY KEY, payload TEXT)')
+
+    def get(self, namespace, key, default=None):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM state WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace, key, value):
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO state (namespace, key, value, updated) VALUES (?, ?, ?, ?)',
+                (namespace, key, json.dumps(value), time.time())
+            )
+
+    def set_many(self, namespace, items):
+        now = time.time()
+        rows = [(namespace, key, json.dumps(value), now) for key, value in items]
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                self.db.executemany('INSERT OR REPLACE INTO state (namespace, key, value, updated) VALUES (?, ?, ?, ?)', rows)
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def delete(self, namespace, key):
+        with self.lock:
+            self.db.execute('DELETE FROM state WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def items(self, namespace):
+        '''
+            returns:
+                -> list : (key, value) tuples of the namespace
+        '''
+        with self.lock:
+            rows = self.db.execute('SELECT key, value FROM state WHERE namespace = ?', (namespace,)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def count(self, namespace):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM state WHERE namespace = ?', (namespace,)).fetchone()[0]
+
+    def clear(self, namespace):
+        with self.lock:
+            self.db.execute('DELETE FROM state WHERE namespace = ?', (namespace,))
+
+    def add_payload(self, payload):
+        '''
+            returns:
+                -> int : id of the stored payload
+        '''
+        with self.lock:
+            cursor = self.db.execute('INSERT INTO payloads (payload) VALUES (?)', (json.dumps(payload, separators=(',', ':')),))
+            return cursor.lastrowid
+
+    def get_payload(self, payload_id):
+        with self.lock:
+            row = self.db.execute('SELECT payload FROM payloads WHERE id = ?', (payload_id,)).fetchone()
+        if row is None:
+            raise KeyError(f'No payload with id {payload_id} in {self.path}')
+        return json.loads(row[0])
+
+    def clear_payloads(self):
+        with self.lock:
+            self.db.execute('DELETE FROM payloads')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
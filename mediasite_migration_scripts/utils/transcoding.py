@@ -0,0 +1,239 @@
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class TranscodeLauncher():
+    '''
+    Launcher of the transcoding tasks of the migrated medias (published medias created by mediatransfer).
+    Pages of latest/ are prefetched by a background thread, the resources of the medias of a page are checked concurrently,
+    and tasks are launched as long as less than target_depth launched tasks are still running on MediaServer
+    (a task is running until the resources of its media are transcoded, pending_timeout_hours at most),
+    instead of pacing requests on their latency.
+    The cursor of the last processed page, the launched medias and the medias found transcoded are recorded in the state store,
+    so that an interrupted run resumes where it stopped. Once all pages have been processed, the next run starts again
+    from the newest medias (migrated medias keep their Mediasite creation date, so new ones are not only on the first pages),
+    without checking the medias already launched or found transcoded again.
+
+    params:
+        api : MediaServer client api method
+        state : StateStore where the cursor, launched and transcoded medias are recorded
+        rate_limiter : RateLimiter of the requests to latest/ and of the resources checks
+        wait : function called with the stop event before each request to latest/, each batch of checks and each launch
+               (e.g. to wait for the night), it must return when the stop event is set
+    '''
+    NAMESPACE = 'transcoding'
+    LAUNCHED_NAMESPACE = 'transcoding_launched'
+    TRANSCODED_NAMESPACE = 'transcoding_transcoded'
+
+    def __init__(self, api, state=None, wait=None, rate_limiter=None, page_size=100, prefetch_pages=2, check_workers=8,
+                 target_depth=20, poll_seconds=30, pending_timeout_hours=6):
+        self.api = api
+        self.state = state
+        self.wait = wait
+        self.rate_limiter = rate_limiter
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self.check_workers = check_workers
+        self.target_depth = target_depth
+        self.poll_seconds = poll_seconds
+        self.pending_timeout = pending_timeout_hours * 3600
+        # set when the run ends, so that the prefetcher does not keep waiting
+        self.stop = threading.Event()
+        # oid: launch time of the tasks running on MediaServer
+        self.pending = dict()
+        self.last_poll = 0
+        self.stats = {'checked': 0, 'transcoded': 0, 'launched': 0, 'failed': 0, 'non_transcodable': 0, 'timed_out': 0}
+
+    @classmethod
+    def from_config(cls, config, api, **kwargs):
+        return cls(
+            api,
+            page_size=config.get('transcode_page_size', 100),
+            prefetch_pages=config.get('transcode_prefetch_pages', 2),
+            check_workers=config.get('transcode_check_workers', 8),
+            target_depth=config.get('transcode_queue_depth', 20),
+            poll_seconds=config.get('transcode_poll_seconds', 30),
+            pending_timeout_hours=config.get('transcode_pending_timeout_hours', 6),
+            **kwargs,
+        )
+
+    def _get_cursor(self):
+        if self.state is None:
+            return dict()
+        return self.state.get(self.NAMESPACE, 'cursor', dict())
+
+    def _set_cursor(self, cursor):
+        if self.state is not None:
+            self.state.set(self.NAMESPACE, 'cursor', cursor)
+
+    def reset(self):
+        if self.state is not None:
+            self.state.clear(self.NAMESPACE)
+            self.state.clear(self.LAUNCHED_NAMESPACE)
+            self.state.clear(self.TRANSCODED_NAMESPACE)
+
+    def call_api(self, *args, **kwargs):
+        '''
+        Call the MediaServer api when the rate limiter allows it, launches are paced by the depth of the tasks queue instead.
+        '''
+        if self.rate_limiter is None:
+            return self.api(*args, **kwargs)
+        return self.rate_limiter.call(self.api, *args, **kwargs)
+
+    def _wait(self):
+        if self.wait:
+            self.wait(self.stop)
+
+    def _put(self, pages, item):
+        # the queue is not read anymore once the run is stopped
+        while not self.stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _prefetch_pages(self, start, pages):
+        try:
+            more = True
+            while more:
+                self._wait()
+                if self.stop.is_set():
+                    return
+                logger.debug(f'Making request on latest (start={start})')
+                response = self.call_api('latest/', params=dict(start=start, content='v', count=self.page_size, order_by='creation'))
+                more = response['more']
+                # next page cursor
+                start = response['max_date']
+                self._put(pages, (response['items'], start, more))
+        except Exception as e:
+            self._put(pages, e)
+        self._put(pages, None)
+
+    def is_transcoded(self, oid):
+        resources = self.call_api('medias/resources-list/', method='get', params={'oid': oid})
+        return '.m3u8' in str(resources)
+
+    def run(self):
+        cursor = self._get_cursor()
+        launched = dict(self.state.items(self.LAUNCHED_NAMESPACE)) if self.state is not None else dict()
+        transcoded_oids = set(oid for oid, _ in self.state.items(self.TRANSCODED_NAMESPACE)) if self.state is not None else set()
+        if cursor.get('complete'):
+            # medias migrated since the previous run may be on any page
+            logger.info(f'All medias have been processed by a previous run, starting again from the newest ones ({len(launched)} tasks already launched)')
+            cursor = dict()
+        elif cursor:
+            logger.info(f'Resuming from {cursor["start"]} ({len(launched)} tasks already launched)')
+        # tasks launched by a previous run may still be running
+        now = time.time()
+        self.pending = {oid: launch_time for oid, launch_time in launched.items() if now - launch_time < self.pending_timeout}
+
+        pages = queue.Queue(maxsize=self.prefetch_pages)
+        self.stop.clear()
+        prefetcher = threading.Thread(target=self._prefetch_pages, args=(cursor.get('start', ''), pages), daemon=True)
+        prefetcher.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.check_workers) as executor:
+                for page in iter(pages.get, None):
+                    if isinstance(page, Exception):
+                        raise page
+                    items, next_start, more = page
+                    # only apply on content migrated using this project that is published
+                    items = [
+                        item for item in items
+                        if item['origin'] == 'mediatransfer' and item['validated'] and item['oid'] not in launched and item['oid'] not in transcoded_oids
+                    ]
+                    if items:
+                        self._wait()
+                    for item, transcoded in zip(items, executor.map(self.is_transcoded, [item['oid'] for item in items])):
+                        self.stats['checked'] += 1
+                        if transcoded:
+                            logger.debug(f'Skipping {item["oid"]}: already transcoded')
+                            self.stats['transcoded'] += 1
+                            transcoded_oids.add(item['oid'])
+                            if self.state is not None:
+                                self.state.set(self.TRANSCODED_NAMESPACE, item['oid'], True)
+                            continue
+                        self.wait_for_slot(executor)
+                        if self.launch(item['oid']):
+                            launched[item['oid']] = self.pending[item['oid']]
+                    self._set_cursor({'start': next_start, 'complete': not more})
+        finally:
+            self.stop.set()
+            # the prefetcher may be in the middle of a request
+            prefetcher.join(timeout=10)
+            if prefetcher.is_alive():
+                logger.warning('Pages prefetcher still running, not waiting for it')
+        self.log_stats()
+
+    def wait_for_slot(self, executor):
+        '''
+        Feedback loop keeping at most target_depth tasks running: the pending tasks are polled
+        (every poll_seconds at most) until enough of them are done.
+        '''
+        while len(self.pending) >= self.target_depth:
+            delay = self.last_poll + self.poll_seconds - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.poll_pending(executor)
+
+    def poll_pending(self, executor):
+        self._wait()
+        self.last_poll = time.time()
+        oids = list(self.pending)
+
+        def is_done(oid):
+            try:
+                return self.is_transcoded(oid)
+            except Exception as e:
+                logger.warning(f'Failed to check transcoding of {oid}: {e}')
+                return False
+
+        for oid, done in zip(oids, executor.map(is_done, oids)):
+            if done:
+                self.pending.pop(oid)
+            elif self.last_poll - self.pending[oid] > self.pending_timeout:
+                logger.warning(f'Transcoding task of {oid} still running after {self.pending_timeout // 3600}h, not waiting for it anymore')
+                self.stats['timed_out'] += 1
+                self.pending.pop(oid)
+        logger.debug(f'{len(self.pending)} transcoding tasks running')
+
+    def launch(self, oid):
+        '''
+            returns:
+                -> bool : True if the task was launched
+        '''
+        self._wait()
+        try:
+            logger.info(f'Launch transcoding on media {self.stats["checked"]}: {oid}')
+            # behavior: action to do on existing resources
+            params = json.dumps(dict(priority='low', behavior='delete'))
+            self.api('medias/task/', method='post', data=dict(oid=oid, task='transcoding', params=params), timeout=300)
+        except Exception as e:
+            if 'has no usable ressources' in str(e):
+                self.stats['non_transcodable'] += 1
+            else:
+                logger.warning(f'Failed to start transcoding task of video {oid}: {e}')
+                self.stats['failed'] += 1
+            return False
+        self.stats['launched'] += 1
+        self.pending[oid] = time.time()
+        if self.state is not None:
+            self.state.set(self.LAUNCHED_NAMESPACE, oid, self.pending[oid])
+        return True
+
+    def log_stats(self):
+        logger.info(
+            f'{self.stats["checked"]} medias checked, {self.stats["transcoded"]} already transcoded, '
+            f'{self.stats["launched"]} transcoding tasks started, {self.stats["failed"]} failed to be started, '
+            f'{self.stats["non_transcodable"]} medias have no resources and cannot be transcoded, '
+            f'{self.stats["timed_out"]} tasks still running after {self.pending_timeout // 3600}h'
+        )
+        if self.rate_limiter:
+            self.rate_limiter.log_stats()
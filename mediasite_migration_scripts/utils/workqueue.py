@@ -0,0 +1,436 @@
+import contextlib
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from mediasite_migration_scripts.utils.state import StateStore
+
+logger = logging.getLogger(__name__)
+
+
+def get_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def open_work_queue(config, path=None, url=None):
+    '''
+        returns:
+            -> RemoteWorkQueue : if url or work_queue_url of config is set (queue served by the coordinator), WorkQueue file otherwise
+    '''
+    if url or config.get('work_queue_url'):
+        return RemoteWorkQueue.from_config(config, url)
+    return WorkQueue.from_config(config, path)
+
+
+class QueueLocks():
+    @contextlib.contextmanager
+    def locked(self, name, owner, lease_seconds=300, poll_seconds=0.2):
+        '''
+        Hold a lock shared by all the workers, waiting for it if another worker holds it.
+        '''
+        while not self.acquire_lock(name, owner, lease_seconds):
+            time.sleep(poll_seconds)
+        try:
+            yield
+        finally:
+            self.release_lock(name, owner)
+
+
+class WorkQueue(QueueLocks, StateStore):
+    '''
+    Lease-based queue of presentations to migrate, shared by several worker processes of the same host.
+    A worker claims tasks for lease_seconds and acknowledges them once processed;
+    tasks of a worker which died are claimed again by others when their lease expires.
+    Values shared between workers (channels oids, redirections) are kept in the state namespaces.
+    SQLite locking is not reliable on network filesystems, so the queue refuses processes of another host than the one which created it:
+    workers of other hosts use the queue served by the coordinator instead (see WorkQueueServer and RemoteWorkQueue).
+    '''
+    # no shared memory index (WAL), each transaction is synced to the file
+    JOURNAL_MODE = 'DELETE'
+    SYNCHRONOUS = 'FULL'
+
+    def __init__(self, path, lease_seconds=900, max_attempts=3, host=None):
+        super().__init__(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.host = host or socket.gethostname()
+        self.db.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            updated REAL
+        )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_until)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT, lease_until REAL)')
+        self.check_host()
+
+    @classmethod
+    def from_config(cls, config, path=None):
+        return cls(
+            path or config.get('work_queue_file') or os.path.join(config.get('download_folder', 'downloads'), 'work_queue.sqlite'),
+            lease_seconds=config.get('work_queue_lease_seconds', 900),
+            max_attempts=config.get('work_queue_max_attempts', 3),
+        )
+
+    def check_host(self):
+        with self.transaction() as db:
+            row = db.execute("SELECT value FROM state WHERE namespace = 'queue_meta' AND key = 'host'").fetchone()
+            if row is None:
+                db.execute(
+                    "INSERT INTO state (namespace, key, value, updated) VALUES ('queue_meta', 'host', ?, ?)",
+                    (json.dumps(self.host), time.time())
+                )
+            elif json.loads(row[0]) != self.host:
+                raise ValueError(
+                    f'Work queue {self.path} was created on host {json.loads(row[0])}, it can only be shared by the processes of one host '
+                    '(delete it to start over on this host)'
+                )
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            # takes the write lock right away, so that two workers cannot claim the same tasks
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.db
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def add_tasks(self, task_ids):
+        '''
+        Tasks already in the queue are left as they are, so that the coordinator can be run again.
+
+            returns:
+                -> int : amount of new tasks
+        '''
+        now = time.time()
+        with self.transaction() as db:
+            before = db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            db.executemany('INSERT OR IGNORE INTO tasks (id, updated) VALUES (?, ?)', [(task_id, now) for task_id in task_ids])
+            return db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] - before
+
+    def claim(self, worker, count=1):
+        '''
+            returns:
+                -> list : ids of the claimed tasks (pending ones, or leased ones whose lease expired)
+        '''
+        now = time.time()
+        with self.transaction() as db:
+            # tasks whose worker died too many times are probably what kills workers
+            db.execute(
+                "UPDATE tasks SET status = 'failed', result = 'lease expired', updated = ? WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            rows = db.execute(
+                '''SELECT id FROM tasks WHERE (status = 'pending' OR (status = 'leased' AND lease_until < ?)) AND attempts < ?
+                ORDER BY rowid LIMIT ?''',
+                (now, self.max_attempts, count)
+            ).fetchall()
+            task_ids = [row[0] for row in rows]
+            db.executemany(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                [(worker, now + self.lease_seconds, now, task_id) for task_id in task_ids]
+            )
+        return task_ids
+
+    def renew(self, worker):
+        '''
+        Extend the leases of all the tasks held by worker (for long tasks, like composite videos).
+        '''
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "UPDATE tasks SET lease_until = ?, updated = ? WHERE worker = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, worker)
+            )
+
+    def release(self, worker, task_ids):
+        '''
+        Give back claimed tasks which were not processed (for example when stopping after --max-videos).
+        '''
+        with self.lock:
+            self.db.executemany(
+                "UPDATE tasks SET status = 'pending', worker = NULL, lease_until = NULL, attempts = attempts - 1 WHERE id = ? AND worker = ? AND status = 'leased'",
+                [(task_id, worker) for task_id in task_ids]
+            )
+
+    def ack(self, worker, task_id, result=None):
+        self._finish(worker, task_id, 'done', result)
+
+    def fail(self, worker, task_id, error=None):
+        '''
+        The task will be claimed again, unless it already failed max_attempts times.
+        '''
+        with self.lock:
+            row = self.db.execute('SELECT attempts FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        status = 'failed' if row and row[0] >= self.max_attempts else 'pending'
+        self._finish(worker, task_id, status, error)
+
+    def _finish(self, worker, task_id, status, result):
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE tasks SET status = ?, result = ?, lease_until = NULL, updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (status, result, time.time(), task_id, worker)
+            )
+        if not cursor.rowcount:
+            logger.warning(f'Task {task_id} is not leased by {worker} anymore, its lease probably expired')
+
+    def get_counts(self):
+        '''
+            returns:
+                -> dict : amount of tasks per status (pending, leased, done, failed)
+        '''
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        with self.lock:
+            rows = self.db.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall()
+        counts.update(dict(rows))
+        return counts
+
+    def count_remaining(self, exclude_worker=None):
+        '''
+            returns:
+                -> int : amount of tasks pending or being processed (by other workers than exclude_worker)
+        '''
+        with self.lock:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status = 'pending' OR (status = 'leased' AND worker IS NOT ?)",
+                (exclude_worker,)
+            ).fetchone()[0]
+
+    def get_failed(self):
+        with self.lock:
+            return self.db.execute("SELECT id, result FROM tasks WHERE status = 'failed'").fetchall()
+
+    def reset(self):
+        with self.lock:
+            self.db.execute('DELETE FROM tasks')
+            self.db.execute('DELETE FROM locks')
+            self.db.execute('DELETE FROM state')
+        self.check_host()
+
+    def acquire_lock(self, name, owner, lease_seconds=300):
+        '''
+            returns:
+                -> bool : lock acquired (or already held by owner)
+        '''
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute('SELECT owner, lease_until FROM locks WHERE name = ?', (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            db.execute('INSERT OR REPLACE INTO locks (name, owner, lease_until) VALUES (?, ?, ?)', (name, owner, now + lease_seconds))
+            return True
+
+    def release_lock(self, name, owner):
+        with self.lock:
+            self.db.execute('DELETE FROM locks WHERE name = ? AND owner = ?', (name, owner))
+
+
+class WorkQueueServer():
+    '''
+    HTTP lease API of the work queue of the coordinator, for workers of several hosts (see RemoteWorkQueue).
+    The queue stays in a SQLite file on the local disk of the coordinator, and leases are timed by its clock.
+    Each queue method is called with a POST request on /<method>, with {"args": [...], "kwargs": {...}} as JSON body,
+    and answers {"result": ...}. Requests must send the token in the X-Work-Queue-Token header when one is set.
+    '''
+    METHODS = (
+        'add_tasks', 'claim', 'renew', 'release', 'ack', 'fail', 'get_counts', 'count_remaining', 'get_failed', 'reset',
+        'acquire_lock', 'release_lock', 'get', 'set', 'set_many', 'delete', 'items', 'count', 'clear',
+    )
+
+    def __init__(self, queue, host='0.0.0.0', port=8765, token=None):
+        self.queue = queue
+        self.host = host
+        self.port = port
+        self.token = token
+        self.httpd = None
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, config, queue):
+        return cls(
+            queue,
+            host=config.get('work_queue_host') or '0.0.0.0',
+            port=config.get('work_queue_port', 8765),
+            token=config.get('work_queue_token'),
+        )
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        class Handler(WorkQueueRequestHandler):
+            pass
+        Handler.server_api = self
+
+        if not self.token:
+            logger.warning('No work_queue_token set, any host reaching the coordinator can use the work queue')
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f'work-queue-{self.port}', daemon=True)
+        self.thread.start()
+        logger.info(f'Serving work queue {self.queue.path} on {self.url}')
+        return self.url
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def handle(self, method, body, token):
+        '''
+            returns:
+                -> tuple : (status code, JSON answer)
+        '''
+        if self.token and not hmac.compare_digest(token or '', self.token):
+            return 403, {'error': 'Invalid work queue token'}
+        if method not in self.METHODS:
+            return 404, {'error': f'Unknown work queue method {method}'}
+        try:
+            result = getattr(self.queue, method)(*body.get('args', []), **body.get('kwargs', {}))
+        except Exception as e:
+            logger.error(f'Work queue {method} failed: {e}')
+            return 500, {'error': str(e)}
+        return 200, {'result': result}
+
+
+class WorkQueueRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_api = None
+
+    def log_message(self, format, *args):
+        logger.debug(f'Work queue: {format % args}')
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or '{}')
+        except ValueError:
+            status, answer = 400, {'error': 'Invalid JSON body'}
+        else:
+            status, answer = self.server_api.handle(self.path.strip('/'), body, self.headers.get('X-Work-Queue-Token'))
+        data = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class RemoteWorkQueue(QueueLocks):
+    '''
+    Work queue served by the coordinator (see WorkQueueServer), for workers of other hosts than the coordinator.
+    Same interface as WorkQueue, each call is a request to the coordinator (with one session per thread).
+    '''
+    def __init__(self, url, token=None, timeout=60):
+        self.url = url.rstrip('/')
+        # shown in logs, like the path of a WorkQueue file
+        self.path = self.url
+        self.token = token
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = list()
+
+    @classmethod
+    def from_config(cls, config, url=None):
+        return cls(url or config['work_queue_url'], token=config.get('work_queue_token'), timeout=config.get('work_queue_timeout', 60))
+
+    def _get_session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            if self.token:
+                session.headers['X-Work-Queue-Token'] = self.token
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def _call(self, method, *args, **kwargs):
+        # not retried: a claim sent twice would lease tasks that nobody processes until their lease expires
+        response = self._get_session().post(f'{self.url}/{method}', json={'args': args, 'kwargs': kwargs}, timeout=self.timeout)
+        try:
+            answer = response.json()
+        except ValueError:
+            answer = dict()
+        if response.status_code != 200:
+            raise RuntimeError(f'Work queue {self.url} failed to {method} (status {response.status_code}): {answer.get("error")}')
+        return answer['result']
+
+    def add_tasks(self, task_ids):
+        return self._call('add_tasks', list(task_ids))
+
+    def claim(self, worker, count=1):
+        return self._call('claim', worker, count)
+
+    def renew(self, worker):
+        return self._call('renew', worker)
+
+    def release(self, worker, task_ids):
+        return self._call('release', worker, list(task_ids))
+
+    def ack(self, worker, task_id, result=None):
+        return self._call('ack', worker, task_id, result)
+
+    def fail(self, worker, task_id, error=None):
+        return self._call('fail', worker, task_id, error)
+
+    def get_counts(self):
+        return self._call('get_counts')
+
+    def count_remaining(self, exclude_worker=None):
+        return self._call('count_remaining', exclude_worker)
+
+    def get_failed(self):
+        return [tuple(row) for row in self._call('get_failed')]
+
+    def reset(self):
+        return self._call('reset')
+
+    def acquire_lock(self, name, owner, lease_seconds=300):
+        return self._call('acquire_lock', name, owner, lease_seconds)
+
+    def release_lock(self, name, owner):
+        return self._call('release_lock', name, owner)
+
+    def get(self, namespace, key, default=None):
+        return self._call('get', namespace, key, default)
+
+    def set(self, namespace, key, value):
+        return self._call('set', namespace, key, value)
+
+    def set_many(self, namespace, items):
+        return self._call('set_many', namespace, list(items))
+
+    def delete(self, namespace, key):
+        return self._call('delete', namespace, key)
+
+    def items(self, namespace):
+        return [tuple(item) for item in self._call('items', namespace)]
+
+    def count(self, namespace):
+        return self._call('count', namespace)
+
+    def clear(self, namespace):
+        return self._call('clear', namespace)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions = list()
+        self.local = threading.local()
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 import logging
 import os
-import requests
 
 import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils import http
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +28,7 @@ class VideoCompositor:
         logger.debug(f'Requesting video download : {video_url}')
 
         if self.dl_session is None:
-            self.dl_session = requests.Session()
+            self.dl_session = http.create_session(self.config)
 
         with self.dl_session.get(video_url, stream=True) as request:
             if video_path.is_file():
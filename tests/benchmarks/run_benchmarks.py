@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+'''
+Benchmarks of the collect, mapping, redirections, analysis and merge hot paths, run on generated datasets.
+Results are stored as JSON, so that two runs can be compared:
+
+    python3 -m tests.benchmarks.run_benchmarks --presentations 10000
+    python3 -m tests.benchmarks.run_benchmarks --presentations 10000 --compare benchmark_results/before.json
+'''
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import mediasite_migration_scripts.utils.common as utils
+from tests import datasets
+from tests.emulators import MediasiteEmulator, MediaServerEmulator
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = dict()
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+class Context:
+    '''
+    Datasets shared by all benchmarks, built once per run.
+    '''
+    def __init__(self, options):
+        self.options = options
+        self.tmp_dir = Path(tempfile.mkdtemp(prefix='mediasite-benchmarks-'))
+        logger.info(f'Generating dataset with {options.presentations} presentations')
+        self.data = datasets.build_dataset(options.presentations)
+        self.presentations = [p for f in self.data['Folders'] for p in f.get('Presentations') or []]
+        self._analyzer_data = None
+
+    @property
+    def analyzer_data(self):
+        if self._analyzer_data is None:
+            self._analyzer_data = datasets.to_analyzer_data(self.data)
+        return self._analyzer_data
+
+    def get_small_data(self, max_presentations):
+        '''
+            returns:
+                -> dict : a subset of the dataset, for benchmarks going through the network stack
+        '''
+        folders = list()
+        count = 0
+        for folder in self.data['Folders']:
+            if count >= max_presentations:
+                break
+            folders.append(folder)
+            count += len(folder.get('Presentations') or [])
+        return {**self.data, 'Folders': folders}
+
+    def close(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def import_or_skip(module_name, attribute):
+    try:
+        module = __import__(module_name, fromlist=[attribute])
+    except ImportError as e:
+        raise SkipBenchmark(f'{module_name} cannot be imported: {e}')
+    return getattr(module, attribute)
+
+
+@benchmark('extractor_assembly')
+def bench_extractor_assembly(context):
+    '''
+    DataExtractor folders and presentations assembly, with the API listings already fetched
+    and the per-presentation requests left out.
+    '''
+    DataExtractor = import_or_skip('mediasite_migration_scripts.data_extractor', 'DataExtractor')
+
+    class OfflineExtractor(DataExtractor):
+        def __init__(self, data):
+            self.mediasite_client = SimpleNamespace(folder=SimpleNamespace(root_folder_id=None))
+            self.max_folders = None
+            self.shard = self.subtrees = None
+            self.resources_to_get = ['Folders', 'Channels', 'Presentations']
+            self.failed_presentations = list()
+            self.folders = [{k: v for k, v in f.items() if k not in ['Presentations', 'Channels']} for f in data['Folders']]
+            self.channels = [c for f in data['Folders'] for c in f.get('Channels') or []]
+            self.presentations = [p for f in data['Folders'] for p in f.get('Presentations') or []]
+            self.presentations_pages = None
+
+        def get_resources(self):
+            pass
+
+        def get_presentation_resources(self, presentation):
+            return presentation
+
+    def run():
+        extractor = OfflineExtractor(context.data)
+        return extractor.extract_mediasite_data()
+
+    return run, len(context.presentations)
+
+
+@benchmark('collect_emulated')
+def bench_collect_emulated(context):
+    '''
+    Complete collect (bin/collect.py) against the Mediasite emulator.
+    '''
+    DataExtractor = import_or_skip('mediasite_migration_scripts.data_extractor', 'DataExtractor')
+    data = context.get_small_data(context.options.network_presentations)
+    count = sum(len(f.get('Presentations') or []) for f in data['Folders'])
+    emulator = MediasiteEmulator(data, latency_ms=context.options.latency_ms)
+    emulator.start()
+    config = {**emulator.get_config(), 'download_folder': str(context.tmp_dir / 'collect_downloads')}
+    options = SimpleNamespace(max_folders=None, failed_csvfile=str(context.tmp_dir / 'failed.csv'))
+
+    def run():
+        return DataExtractor(config, options)
+
+    return run, count, emulator.stop
+
+
+def get_mediatransfer_setup(context):
+    MediaTransfer = import_or_skip('mediasite_migration_scripts.mediatransfer', 'MediaTransfer')
+    data = context.get_small_data(context.options.network_presentations)
+    count = sum(len(f.get('Presentations') or []) for f in data['Folders'])
+    mediasite = MediasiteEmulator(data, latency_ms=context.options.latency_ms)
+    mediaserver = MediaServerEmulator(latency_ms=context.options.latency_ms)
+    mediasite.start()
+    mediaserver.start()
+    collected_data = mediasite.get_collected_data()
+    config = {
+        **mediasite.get_config(),
+        **mediaserver.get_config(),
+        'download_folder': str(context.tmp_dir / 'migrate_downloads'),
+        'redirections_file': str(context.tmp_dir / 'redirections.json'),
+        'state_file': str(context.tmp_dir / 'migration_state.sqlite'),
+        'videos_formats_allowed': {'video/mp4': True, 'video/x-ms-wmv': False},
+    }
+
+    def stop():
+        mediasite.stop()
+        mediaserver.stop()
+
+    return MediaTransfer, config, collected_data, count, stop
+
+
+@benchmark('mediatransfer_mapping')
+def bench_mediatransfer_mapping(context):
+    '''
+    MediaTransfer mapping of all presentations to MediaServer keys, including resources checks,
+    against the Mediasite and MediaServer emulators.
+    '''
+    MediaTransfer, config, collected_data, count, stop = get_mediatransfer_setup(context)
+    config['clear_mapping_cache'] = True
+
+    def run():
+        return MediaTransfer(config, collected_data).to_mediaserver_keys()
+
+    return run, count, stop
+
+
+@benchmark('mediatransfer_mapping_cached')
+def bench_mediatransfer_mapping_cached(context):
+    '''
+    MediaTransfer mapping of all presentations, read from the mapping cache of a previous run.
+    '''
+    MediaTransfer, config, collected_data, count, stop = get_mediatransfer_setup(context)
+    try:
+        MediaTransfer({**config, 'clear_mapping_cache': True}, collected_data).to_mediaserver_keys()
+    except Exception:
+        stop()
+        raise
+
+    def run():
+        return MediaTransfer(config, collected_data).to_mediaserver_keys()
+
+    return run, count, stop
+
+
+def get_encoding_settings(context):
+    return [
+        video_file.get('ContentEncodingSettings') or {}
+        for p in context.presentations for video_file in p.get('OnDemandContent') or []
+    ]
+
+
+@benchmark('encoding_settings_parsing')
+def bench_encoding_settings_parsing(context):
+    '''
+    Encoding settings XML parsing of every video file of the dataset (as done by order_by_stream_type),
+    starting with an empty profiles cache.
+    '''
+    import mediasite_migration_scripts.utils.mediasite as mediasite_utils
+    encoding_settings = get_encoding_settings(context)
+
+    def run():
+        mediasite_utils._parse_serialized_settings.cache_clear()
+        for settings in encoding_settings:
+            mediasite_utils.parse_encoding_settings_xml(settings)
+
+    return run, len(encoding_settings)
+
+
+@benchmark('encoding_settings_parsing_uncached')
+def bench_encoding_settings_parsing_uncached(context):
+    '''
+    Encoding settings XML parsing of every video file of the dataset, without the profiles cache.
+    '''
+    import mediasite_migration_scripts.utils.mediasite as mediasite_utils
+    serialized_settings = [s['SerializedSettings'] for s in get_encoding_settings(context) if s.get('SerializedSettings')]
+
+    def run():
+        for settings in serialized_settings:
+            mediasite_utils._parse_serialized_settings.__wrapped__(settings)
+
+    return run, len(serialized_settings)
+
+
+@benchmark('dates_parsing')
+def bench_dates_parsing(context):
+    '''
+    Mediasite dates parsing of the presentations (most distant date) and channels creation dates.
+    '''
+    import mediasite_migration_scripts.utils.mediasite as mediasite_utils
+    channels = [c for f in context.data['Folders'] for c in f.get('Channels') or []]
+
+    def run():
+        mediasite_utils.parse_mediasite_date.cache_clear()
+        for presentation in context.presentations:
+            mediasite_utils.get_most_distant_date(presentation)
+        for channel in channels:
+            mediasite_utils.parse_mediasite_date(channel['CreationDate'])
+
+    return run, len(context.presentations) + len(channels)
+
+
+@benchmark('redirections_lookup')
+def bench_redirections_lookup(context):
+    '''
+    Lookup of already migrated presentations in the redirections, for every presentation of the dataset.
+    '''
+    import mediasite_migration_scripts.utils.mediasite as mediasite_utils
+    MediaTransfer = import_or_skip('mediasite_migration_scripts.mediatransfer', 'MediaTransfer')
+    mediatransfer = MediaTransfer.__new__(MediaTransfer)
+    mediatransfer.redirections = {
+        f'https://mediasite.example.com/Site1/Play/{p["Id"]}': f'https://mediaserver.example.com/permalink/v1{index:019d}/iframe/'
+        for index, p in enumerate(context.presentations)
+    }
+    mediatransfer.redirected_ids = mediasite_utils.get_redirected_ids(mediatransfer.redirections)
+    lookups = context.presentations[::max(1, len(context.presentations) // context.options.lookups)]
+
+    def run():
+        for p in lookups:
+            mediatransfer.search_mediasite_id_in_redirections(p['Id'])
+
+    return run, len(lookups)
+
+
+@benchmark('analyzer_stats')
+def bench_analyzer_stats(context):
+    '''
+    DataAnalyzer initialization, videos formats, layouts and folders statistics.
+    '''
+    from mediasite_migration_scripts.data_analyzer import DataAnalyzer
+    analyzer_data = context.analyzer_data
+
+    def run():
+        analyzer = DataAnalyzer(analyzer_data, {'whitelist': []})
+        analyzer.analyze_videos_infos()
+        analyzer.analyse_folders()
+
+    return run, len(context.presentations)
+
+
+@benchmark('merge_samples')
+def bench_merge_samples(context):
+    '''
+    bin/merge.py composition of the sample videos of tests/samples.
+    '''
+    import_or_skip('gi', 'require_version')
+    samples = {'Video1.mp4': Path('tests/samples/MEDIA_WITHSOUND.mp4'), 'Slides.mp4': Path('tests/samples/MEDIA_NOSOUND.mp4')}
+    for sample in samples.values():
+        # git-lfs pointers are a few bytes long
+        if not sample.is_file() or sample.stat().st_size < 1024:
+            raise SkipBenchmark(f'{sample} is missing, run git-lfs pull')
+
+    media_folder = context.tmp_dir / 'merge'
+
+    def run():
+        shutil.rmtree(media_folder, ignore_errors=True)
+        media_folder.mkdir(parents=True)
+        for name, sample in samples.items():
+            shutil.copy(sample, media_folder / name)
+        cmd = [sys.executable, 'bin/merge.py', '--width', '1280', '--height', '720', str(media_folder)]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f'merge.py failed: {result.stderr[-500:]}')
+
+    return run, 1
+
+
+def run_benchmark(name, context, repeat):
+    func = BENCHMARKS[name]
+    result = {'description': ' '.join(func.__doc__.split()) if func.__doc__ else ''}
+    teardown = None
+    try:
+        setup = func(context)
+        run, items = setup[:2]
+        if len(setup) > 2:
+            teardown = setup[2]
+
+        runs = list()
+        for _ in range(repeat):
+            before = time.perf_counter()
+            # progress strings and prints are not part of what we measure
+            with contextlib.redirect_stdout(io.StringIO()):
+                run()
+            runs.append(time.perf_counter() - before)
+
+        best = min(runs)
+        result.update({
+            'status': 'ok',
+            'items': items,
+            'seconds': round(best, 6),
+            'median_seconds': round(statistics.median(runs), 6),
+            'runs': [round(r, 6) for r in runs],
+            'us_per_item': round(best * 1e6 / items, 3) if items else None,
+        })
+        logger.info(f'{name}: {best:.3f}s for {items} items')
+    except SkipBenchmark as e:
+        result.update({'status': 'skipped', 'reason': str(e)})
+        logger.warning(f'{name} skipped: {e}')
+    except Exception as e:
+        result.update({'status': 'failed', 'reason': str(e)})
+        logger.error(f'{name} failed: {e}')
+    finally:
+        if teardown:
+            teardown()
+    return result
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(results, previous, tolerance):
+    '''
+        returns:
+            -> list : names of the benchmarks slower than the previous run by more than tolerance (ratio)
+    '''
+    regressions = list()
+    print(f"{'Benchmark':<25}{'Previous (s)':>15}{'Current (s)':>15}{'Ratio':>10}")
+    for name, result in results['results'].items():
+        previous_result = previous.get('results', {}).get(name, {})
+        if result.get('status') != 'ok' or previous_result.get('status') != 'ok':
+            print(f"{name:<25}{previous_result.get('status', '-'):>15}{result.get('status', '-'):>15}")
+            continue
+        # compare time per item, datasets sizes may differ
+        current_time = result['us_per_item'] or result['seconds']
+        previous_time = previous_result['us_per_item'] or previous_result['seconds']
+        ratio = current_time / previous_time if previous_time else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        print(f"{name:<25}{previous_result['seconds']:>15.3f}{result['seconds']:>15.3f}{ratio:>10.2f}{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    def manage_opts():
+        parser = argparse.ArgumentParser(description='This script benchmarks the migration hot paths on generated data.')
+        parser.add_argument('-v', '--verbose',
+                            action='store_true',
+                            default=False,
+                            help='print all status messages to stdout.')
+        parser.add_argument('-q', '--quiet',
+                            action='store_true',
+                            default=False,
+                            help='print only error status messages to stdout.')
+        parser.add_argument('--presentations',
+                            type=int,
+                            default=1000,
+                            help='Size of the generated dataset.')
+        parser.add_argument('--network-presentations',
+                            type=int,
+                            default=200,
+                            help='Maximum amount of presentations for benchmarks going through the emulators.')
+        parser.add_argument('--latency-ms',
+                            type=int,
+                            default=0,
+                            help='Latency of the emulators.')
+        parser.add_argument('--lookups',
+                            type=int,
+                            default=1000,
+                            help='Amount of redirections lookups.')
+        parser.add_argument('--repeat',
+                            type=int,
+                            default=3,
+                            help='Run each benchmark this amount of times, the best run is kept.')
+        parser.add_argument('--only',
+                            help=f'Benchmarks to run (csv), among: {",".join(BENCHMARKS)}')
+        parser.add_argument('--output',
+                            help='Path of the results file (default: benchmark_results/<date>-<commit>.json).')
+        parser.add_argument('--compare',
+                            help='Previous results file to compare with.')
+        parser.add_argument('--tolerance',
+                            type=float,
+                            default=0.1,
+                            help='Slowdown ratio above which a benchmark is reported as a regression.')
+        parser.add_argument('--fail-on-regression',
+                            action='store_true',
+                            default=False,
+                            help='Exit with an error code if a regression is found.')
+        return parser.parse_args()
+
+    options = manage_opts()
+    utils.set_logger(options)
+
+    names = options.only.split(',') if options.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        logger.error(f'Unknown benchmarks: {unknown}')
+        sys.exit(1)
+
+    context = Context(options)
+    commit = get_git_commit()
+    results = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'options': {k: v for k, v in vars(options).items() if k not in ['output', 'compare']},
+        'results': dict(),
+    }
+    try:
+        for name in names:
+            results['results'][name] = run_benchmark(name, context, options.repeat)
+    finally:
+        context.close()
+
+    output = options.output
+    if not output:
+        date_str = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join('benchmark_results', f'{date_str}-{commit or "nogit"}.json')
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f'Results written in {output}')
+
+    if options.compare:
+        regressions = compare(results, utils.read_json(options.compare) or {}, options.tolerance)
+        if regressions and options.fail_on_regression:
+            logger.error(f'Regressions found: {regressions}')
+            sys.exit(1)
@@ -1,9 +1,12 @@
+import hmac
 import logging
+import secrets
 from copy import copy
 
 from mediasite_migration_scripts.mediatransfer import MediaTransfer
 import mediasite_migration_scripts.utils.common as utils
 import mediasite_migration_scripts.utils.mediaserver as mediaserver_utils
+import mediasite_migration_scripts.utils.mediasite as mediasite_utils
 import tests.common as test_utils
 from pathlib import Path
 
@@ -12,6 +15,7 @@ config = utils.read_json('config-test.json')
 ms_utils = mediaserver_utils.MediaServerUtils(config)
 ms_client = ms_utils.ms_client
 TEST_CHANNEL_NAME = 'mediasite_e2e_target'
+ANONYMIZE_KEY = secrets.token_bytes(32)
 PARENT_TEST_CHANNEL_OID = 'c12619b455e75glxvuja'
 
 
@@ -66,7 +70,7 @@ def prepare_test_data_and_clients(config):
             logger.error(f'Failed to init MediaTransfer: {e}')
             raise AssertionError
 
-        for media in mediatransfer.mediaserver_data:
+        for media in mediatransfer.to_mediaserver_keys():
             media_data = media['data']
             if media_data['title'] == 'Media with slides':
                 mediatransfer.slides_folder = Path('tests/samples/slides')
@@ -117,7 +121,13 @@ def anonymize_data(data):
     anon_data = copy(data)
     if isinstance(anon_data, dict):
         for key, val in anon_data.items():
-            if isinstance(val, dict) or isinstance(val, list):
+            if key == 'UserProfiles' and isinstance(val, dict):
+                # profiles are keyed by username, keys are anonymized like the UserName of the profiles
+                anon_data[key] = {
+                    user.get('UserName') or anonymize_username(username): user
+                    for username, user in anonymize_data(val).items()
+                }
+            elif isinstance(val, dict) or isinstance(val, list):
                 anon_data[key] = anonymize_data(val)
             elif isinstance(val, str):
                 if 'http' and '://' in val:
@@ -125,7 +135,10 @@ def anonymize_data(data):
                         anon_data[key] = config.get('mediaserver_url') + '$$NAME$$'
                     else:
                         anon_data[key] = 'https://anon.com/fake'
-                elif ('@' in val and '.' in val) or (key in user_fields_to_anonymize):
+                elif key in user_fields_to_anonymize:
+                    # the same username gives the same anonymized username, so that owners still match profiles
+                    anon_data[key] = anonymize_username(val)
+                elif '@' in val and '.' in val:
                     anon_data[key] = 'anon@mail.com'
                 elif key in fields_to_anonymize:
                     anon_data[key] = f'anon {key}'
@@ -137,6 +150,11 @@ def anonymize_data(data):
     return anon_data
 
 
+def anonymize_username(username):
+    # keyed with a random key for each run, so that anonymized usernames cannot be reversed with a list of usernames
+    return 'anon-' + hmac.new(ANONYMIZE_KEY, username.encode(), 'sha256').hexdigest()[:16]
+
+
 def to_small_data(data):
     filtered_data = dict()
 
@@ -148,9 +166,10 @@ def to_small_data(data):
     for i in range(2):
         filtered_data['Folders'][0]['Presentations'][i]['TimedEvents'] = generate_timed_events()
 
-    users = data.get('UserProfiles')
+    users = mediasite_utils.get_users_by_username(data.get('UserProfiles'))
     if users:
-        filtered_data['UserProfiles'] = users[:1]
+        username = next(iter(users))
+        filtered_data['UserProfiles'] = {username: users[username]}
 
     return filtered_data
 
@@ -0,0 +1,429 @@
+'''
+Datasets of configurable size for benchmarks and emulators.
+
+DatasetGenerator produces synthetic Mediasite data (mediasite_all_data.json format, as written by bin/collect.py)
+with no customer data in it, and can stream it to a file for millions of presentations.
+'''
+import datetime
+import json
+import logging
+import random
+import uuid
+from xml.sax.saxutils import escape
+
+import mediasite_migration_scripts.utils.mediasite as mediasite_utils
+
+logger = logging.getLogger(__name__)
+
+TEST_DATA_PATH = 'tests/mediasite_test_data.json'
+
+# relative weights of the presentations types
+PRESENTATIONS_TYPES = {
+    'video': 30,
+    'video_slides': 20,
+    'slides_details': 20,
+    'composite': 10,
+    'audio_only': 5,
+    'wmv': 15,
+}
+
+# Mediasite ids are 32 hex chars followed by a resource type suffix
+ID_SUFFIXES = {
+    'folder': '14',
+    'presentation': '1d',
+    'channel': '21',
+    'content_server': '29',
+    'encoding_settings': '28',
+    'slides': '30',
+}
+
+MEDIASITE_URL = 'https://mediasite.example.com'
+USERS_FOLDER_NAME = 'Mediasite Users'
+
+WORDS = [
+    'introduction', 'advanced', 'physics', 'chemistry', 'biology', 'history', 'economics', 'law', 'medicine', 'statistics',
+    'lecture', 'seminar', 'workshop', 'course', 'session', 'conference', 'tutorial', 'exam', 'review', 'project',
+    'quantum', 'organic', 'molecular', 'european', 'modern', 'applied', 'clinical', 'digital', 'financial', 'international',
+]
+
+MP4_SETTINGS_TEMPLATE = (
+    '<EncodingSettings xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<UserMaximumDeviceClass>-1</UserMaximumDeviceClass><StreamDescriptions /><Filters /><Settings>{settings}</Settings></EncodingSettings>'
+)
+MEDIA_PROFILE_TEMPLATE = (
+    '<MediaProfile xmlns="http://www.SonicFoundry.com/Mediasite/Services/RecorderManagement/05/01//Data" xmlns:i="http://www.w3.org/2001/XMLSchema-instance">'
+    '<PresentationAspectX>{width}</PresentationAspectX><PresentationAspectY>{height}</PresentationAspectY>'
+    '<StreamProfiles xmlns:a="http://schemas.microsoft.com/2003/10/Serialization/Arrays">{profiles}</StreamProfiles></MediaProfile>'
+)
+AUDIO_PROFILE = '<a:anyType i:type="AudioEncoderProfile"><BitRate>64000</BitRate><FourCC>AACL</FourCC><SampleRate>44100</SampleRate><Channels>2</Channels></a:anyType>'
+VIDEO_PROFILE_TEMPLATE = '<a:anyType i:type="VideoEncoderProfile"><BitRate>{bitrate}</BitRate><FourCC>H264</FourCC><Height>{height}</Height><Width>{width}</Width></a:anyType>'
+WMV_SETTINGS = (
+    '<EncodingSettings xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<UserMaximumDeviceClass>-1</UserMaximumDeviceClass><StreamDescriptions /><Filters />'
+    '<Settings5x>&lt;WmsEncodingSettings&gt;&lt;VideoEncodings&gt;&lt;VideoEncodingDetails&gt;&lt;Name&gt;Windows Media Video 9&lt;/Name&gt;'
+    '&lt;Height&gt;240&lt;/Height&gt;&lt;Width&gt;320&lt;/Width&gt;&lt;/VideoEncodingDetails&gt;&lt;/VideoEncodings&gt;&lt;/WmsEncodingSettings&gt;</Settings5x>'
+    '</EncodingSettings>'
+)
+
+
+def get_serialized_settings(width=0, height=0, bitrate=0):
+    '''
+    returns:
+        -> str : SerializedSettings XML, as parsed by utils.mediasite.parse_encoding_settings_xml (audio only if no width)
+    '''
+    profiles = AUDIO_PROFILE
+    if width:
+        profiles += VIDEO_PROFILE_TEMPLATE.format(bitrate=bitrate, width=width, height=height)
+    media_profile = MEDIA_PROFILE_TEMPLATE.format(width=width, height=height, profiles=profiles)
+    return MP4_SETTINGS_TEMPLATE.format(settings=escape(media_profile))
+
+
+class DatasetGenerator():
+    '''
+    Deterministic (for a given seed) generator of Mediasite data.
+
+    Folders are spread over the given depth under the root folder, users folders are created under "Mediasite Users"
+    (with a profile for most of them), and presentations are distributed over all folders.
+    '''
+    def __init__(self, presentations=1000, folders=None, depth=3, users=None, seed=0, types_weights=None,
+                 channels_ratio=0.3, user_folders_ratio=0.2, private_ratio=0.05, unknown_users_ratio=0.1, max_slides=50):
+        self.presentations_count = presentations
+        self.folders_count = folders if folders is not None else max(1, presentations // 20)
+        self.depth = max(1, depth)
+        self.users_count = users if users is not None else max(1, self.folders_count // 5)
+        self.seed = seed
+        self.types_weights = types_weights or PRESENTATIONS_TYPES
+        unknown_types = set(self.types_weights) - set(PRESENTATIONS_TYPES)
+        if unknown_types:
+            raise ValueError(f'Unknown presentations types: {unknown_types}, available: {list(PRESENTATIONS_TYPES)}')
+        self.channels_ratio = channels_ratio
+        self.user_folders_ratio = user_folders_ratio
+        self.private_ratio = private_ratio
+        self.unknown_users_ratio = unknown_users_ratio
+        self.max_slides = max_slides
+
+        self.rng = random.Random(seed)
+        self.root_folder_id = self.new_id('folder')
+        self.video_server = {'Id': self.new_id('content_server'), 'DistributionUrl': f'{MEDIASITE_URL}/MediasiteDeliver/$$NAME$$'}
+        self.slides_server_id = self.new_id('content_server')
+        self.encoding_settings = {
+            '720p': {'Id': self.new_id('encoding_settings'), 'SerializedSettings': get_serialized_settings(1280, 720, 1500000)},
+            '360p': {'Id': self.new_id('encoding_settings'), 'SerializedSettings': get_serialized_settings(640, 360, 700000)},
+            'audio': {'Id': self.new_id('encoding_settings'), 'SerializedSettings': get_serialized_settings()},
+            'wmv': {'Id': self.new_id('encoding_settings'), 'SerializedSettings': WMV_SETTINGS},
+        }
+        self.usernames = [f'user-{index:06d}' for index in range(self.users_count)]
+
+    def new_id(self, resource_type):
+        return f'{self.rng.getrandbits(128):032x}{ID_SUFFIXES[resource_type]}'
+
+    def new_uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def new_owner(self):
+        return self.rng.choice(self.usernames) if self.usernames else 'admin'
+
+    def new_title(self, words=3):
+        return ' '.join(self.rng.choices(WORDS, k=words)).capitalize()
+
+    def new_date(self, start_year=2010, end_year=2021):
+        start = datetime.datetime(start_year, 1, 1)
+        seconds = self.rng.randrange(int((datetime.datetime(end_year, 12, 31) - start).total_seconds()))
+        date = start + datetime.timedelta(seconds=seconds)
+        # Mediasite dates have 0 to 3 digits for fractions of seconds
+        return date.strftime('%Y-%m-%dT%H:%M:%S') + f'.{self.rng.randrange(1, 1000)}Z'
+
+    def get_user_profiles(self):
+        '''
+        returns:
+            -> dict : user profiles per username, as written by collect (some users folders have no profile)
+        '''
+        profiles = dict()
+        for index, username in enumerate(self.usernames):
+            # spreads exactly unknown_users_ratio of users without profile
+            if int(index * self.unknown_users_ratio) != int((index + 1) * self.unknown_users_ratio):
+                continue
+            profiles[username] = {
+                'UserName': username,
+                'DisplayName': f'User {index}',
+                'Email': f'{username}@mail.example.com',
+            }
+        return profiles
+
+    def get_folders_tree(self):
+        '''
+        returns:
+            -> list : folders skeletons (without presentations), parents before children
+        '''
+        folders = list()
+        levels = [[self.root_folder_id]]
+        per_level = max(1, self.folders_count // self.depth)
+        for index in range(self.folders_count):
+            level = min(index // per_level + 1, self.depth)
+            if level >= len(levels):
+                levels.append(list())
+            folder = self.new_folder(self.rng.choice(levels[level - 1]), self.new_title(2), owner=self.new_owner())
+            levels[level].append(folder['Id'])
+            folders.append(folder)
+
+        users_folder = self.new_folder(self.root_folder_id, USERS_FOLDER_NAME, with_channel=False)
+        folders.append(users_folder)
+        for username in self.usernames:
+            user_folder = self.new_folder(users_folder['Id'], username, owner=username, with_channel=False)
+            folders.append(user_folder)
+            # "/Mediasite Users/USERNAME/SUBFOLDER"
+            if self.rng.random() < self.user_folders_ratio:
+                folders.append(self.new_folder(user_folder['Id'], self.new_title(1), owner=username, with_channel=False))
+        return folders
+
+    def new_folder(self, parent_id, name, owner=None, with_channel=True):
+        folder_id = self.new_id('folder')
+        channels = list()
+        if with_channel and self.rng.random() < self.channels_ratio:
+            channels.append({
+                'Id': self.new_id('channel'),
+                'Name': f'{name} - Channel',
+                'Description': '',
+                'ChannelUrl': f'{MEDIASITE_URL}/Mediasite/Catalog/catalogs/{folder_id}',
+                'Owner': owner,
+                'CreationDate': self.new_date(),
+                'LinkedFolderId': folder_id,
+            })
+        return {
+            'Id': folder_id,
+            'ParentFolderId': parent_id,
+            'Name': name,
+            'Owner': owner or 'admin',
+            'Description': '',
+            'Channels': channels,
+            'Presentations': list(),
+        }
+
+    def new_video_file(self, stream_type, duration_ms, mime_type='video/mp4', settings='720p'):
+        extension = {'video/mp4': 'mp4', 'video/x-ms-wmv': 'wmv', 'video/x-mp4-fragmented': 'ism'}[mime_type]
+        return {
+            'FileNameWithExtension': f'{self.new_uuid()}.{extension}',
+            'ContentMimeType': mime_type,
+            'FileLength': str(duration_ms * self.rng.randrange(50, 300)),
+            'Length': str(duration_ms),
+            'IsTranscodeSource': mime_type != 'video/x-mp4-fragmented',
+            'StreamType': stream_type,
+            'ContentServer': dict(self.video_server),
+            'ContentEncodingSettings': dict(self.encoding_settings[settings]),
+        }
+
+    def new_slides(self, presentation_id, stream_type, duration_ms, count, with_details=False):
+        slides = {
+            'Id': self.new_id('slides'),
+            'ParentResourceId': presentation_id,
+            'ContentType': 'Slides',
+            'ContentMimeType': 'image/jpeg',
+            'FileNameWithExtension': f'slide_{{0:D4}}_{self.rng.getrandbits(128):032x}.jpg',
+            'Length': str(count),
+            'StreamType': stream_type,
+            'ContentServerId': self.slides_server_id,
+            'ContentServer': {'ContentServerId': self.slides_server_id, 'Url': f'{MEDIASITE_URL}/Site1/FileServer'},
+        }
+        if with_details:
+            times = sorted(self.rng.randrange(duration_ms) for _ in range(count))
+            slides['SlideDetails'] = [
+                {'Number': number + 1, 'TimeMilliseconds': time, 'Title': self.new_title(), 'Content': self.new_title(8)}
+                for number, time in enumerate(times)
+            ]
+        return slides
+
+    def new_presentation(self, folder, presentation_type):
+        presentation_id = self.new_id('presentation')
+        duration_ms = self.rng.randrange(60, 3 * 3600) * 1000
+        owner = folder['Owner']
+        streams = ['Video1']
+        videos = list()
+        slides_key = 'SlideContent'
+        slides = None
+
+        if presentation_type == 'wmv':
+            videos.append(self.new_video_file('Video1', duration_ms, 'video/x-ms-wmv', 'wmv'))
+        elif presentation_type == 'audio_only':
+            videos.append(self.new_video_file('Video1', duration_ms, settings='audio'))
+        else:
+            settings = self.rng.choice(['720p', '360p'])
+            videos.append(self.new_video_file('Video1', duration_ms, settings=settings))
+            # smooth streaming (.ism) files are kept alongside the mp4 on some servers
+            if self.rng.random() < 0.2:
+                videos.append(self.new_video_file('Video1', duration_ms, 'video/x-mp4-fragmented', settings))
+
+        if presentation_type == 'composite':
+            streams.append('Video3')
+            videos.append(self.new_video_file('Video3', duration_ms, settings='360p'))
+            slides_key = 'SlideDetailsContent'
+            slides = self.new_slides(presentation_id, 'Slide', duration_ms, 0, with_details=True)
+        elif presentation_type == 'slides_details':
+            streams.append('Slide')
+            slides_key = 'SlideDetailsContent'
+            slides = self.new_slides(presentation_id, 'Slide', duration_ms, self.rng.randrange(1, self.max_slides), with_details=True)
+        elif presentation_type == 'video_slides':
+            slides = self.new_slides(presentation_id, 'Video1', duration_ms, self.rng.randrange(1, self.max_slides))
+        else:
+            slides = self.new_slides(presentation_id, 'Video1', duration_ms, 0)
+
+        chapters_count = self.rng.choice([0, 0, 3, 5])
+        presentation = {
+            'Id': presentation_id,
+            'Title': self.new_title(),
+            'ParentFolderId': folder['Id'],
+            'CreationDate': self.new_date(),
+            'RecordDate': self.new_date(),
+            'Owner': owner,
+            'Creator': owner,
+            'PrimaryPresenter': f'Presenter {self.rng.randrange(1000)}',
+            'Status': 'Viewable',
+            'Private': self.rng.random() < self.private_ratio,
+            'TagList': self.rng.choices(WORDS, k=self.rng.randrange(4)),
+            'Streams': [{'StreamType': stream_type, 'StreamName': None} for stream_type in streams],
+            '#Play': {'target': f'{MEDIASITE_URL}/Site1/Play/{presentation_id}'},
+            'TimedEvents': [
+                {
+                    'Position': index * duration_ms // chapters_count,
+                    'Payload': f'<ChapterEntry ><Number>{index}</Number><Time>0</Time><Title>Chapter {index}</Title></ChapterEntry>',
+                }
+                for index in range(chapters_count)
+            ],
+            'Presenters': [{'DisplayName': f'Presenter {self.rng.randrange(1000)}'}] if self.rng.random() < 0.5 else [],
+            'PresentationAnalytics': {'TotalViews': self.rng.randrange(1000), 'LastWatched': self.new_date(2020)},
+            'OnDemandContent': videos,
+            slides_key: slides,
+        }
+        if self.rng.random() < 0.5:
+            presentation['Description'] = self.new_title(10)
+        return presentation
+
+    def get_presentations_counts(self, folders_count):
+        counts = [0] * folders_count
+        for _ in range(self.presentations_count):
+            counts[self.rng.randrange(folders_count)] += 1
+        return counts
+
+    def iter_folders(self):
+        '''
+        Yield folders one by one with their presentations, so that the whole data is never held in memory.
+        '''
+        folders = self.get_folders_tree()
+        # the users root folder only holds users folders
+        containers = [f for f in folders if f['Name'] != USERS_FOLDER_NAME]
+        counts = self.get_presentations_counts(len(containers))
+        types = list(self.types_weights)
+        weights = [self.types_weights[t] for t in types]
+        containers_counts = dict(zip((f['Id'] for f in containers), counts))
+
+        for folder in folders:
+            count = containers_counts.get(folder['Id'], 0)
+            presentations_types = self.rng.choices(types, weights=weights, k=count)
+            # the skeletons are kept until the end, not the presentations
+            yield {**folder, 'Presentations': [self.new_presentation(folder, presentation_type) for presentation_type in presentations_types]}
+
+    def generate(self):
+        '''
+            returns:
+                -> dict : Mediasite data held in memory
+        '''
+        return {'Folders': list(self.iter_folders()), 'UserProfiles': self.get_user_profiles()}
+
+    def write(self, path):
+        '''
+        Stream the generated data to a JSON file.
+
+            returns:
+                -> dict : amount of folders and presentations written
+        '''
+        folders_count, presentations_count = 0, 0
+        with open(path, 'w') as f:
+            f.write('{"Folders": [')
+            for folder in self.iter_folders():
+                if folders_count:
+                    f.write(',\n')
+                # json.dumps uses the C encoder, json.dump does not
+                f.write(json.dumps(folder))
+                folders_count += 1
+                presentations_count += len(folder['Presentations'])
+                if folders_count % 1000 == 0:
+                    logger.debug(f'{folders_count} folders / {presentations_count} presentations written')
+            f.write('],\n"UserProfiles": ')
+            f.write(json.dumps(self.get_user_profiles()))
+            f.write('}\n')
+        logger.info(f'Wrote {folders_count} folders and {presentations_count} presentations in {path}')
+        return {'folders': folders_count, 'presentations': presentations_count}
+
+
+def build_dataset(presentations=1000, seed=0, **kwargs):
+    '''
+    returns:
+        -> dict : generated Mediasite data (collect output format)
+    '''
+    return DatasetGenerator(presentations, seed=seed, **kwargs).generate()
+
+
+def get_folders_paths(folders):
+    folders_by_id = {f['Id']: f for f in folders}
+    paths = dict()
+
+    def get_path(folder_id):
+        if folder_id not in paths:
+            folder = folders_by_id.get(folder_id)
+            if folder is None:
+                return ''
+            paths[folder_id] = get_path(folder.get('ParentFolderId')) + '/' + folder['Name']
+        return paths[folder_id]
+
+    for folder_id in folders_by_id:
+        get_path(folder_id)
+    return paths
+
+
+def to_analyzer_data(data):
+    '''
+    Convert collect output into the folders list read by DataAnalyzer (mediasite_data.json format).
+    Encoding infos are only taken from the encoding settings (no MediaInfo analysis).
+    '''
+    analyzer_folders = list()
+    paths = get_folders_paths(data['Folders'])
+    for folder in data['Folders']:
+        analyzer_folder = {
+            'id': folder['Id'],
+            'name': folder['Name'],
+            'path': paths[folder['Id']],
+            'channels': [{'id': c.get('Id'), 'name': c.get('Name')} for c in folder.get('Channels') or []],
+            'presentations': list(),
+        }
+        for presentation in folder.get('Presentations') or []:
+            videos = list()
+            for video_file in presentation.get('OnDemandContent') or []:
+                stream_type = video_file['StreamType']
+                video = next((v for v in videos if v['stream_type'] == stream_type), None)
+                if video is None:
+                    video = {'stream_type': stream_type, 'Length': video_file.get('Length', '0'), 'files': list()}
+                    videos.append(video)
+                video['files'].append({
+                    'url': mediasite_utils.get_video_url(video_file) or video_file['FileNameWithExtension'],
+                    'format': video_file.get('ContentMimeType'),
+                    'size_bytes': int(video_file.get('FileLength', 0)),
+                    'duration_ms': int(video_file.get('Length', 0)),
+                    'encoding_infos': mediasite_utils.parse_encoding_settings_xml(video_file.get('ContentEncodingSettings') or {}),
+                })
+
+            slides = presentation.get('SlideDetailsContent') or presentation.get('SlideContent') or {}
+            analyzer_folder['presentations'].append({
+                'id': presentation['Id'],
+                'Id': presentation['Id'],
+                'title': presentation.get('Title'),
+                'name': presentation.get('Title'),
+                'creation_date': presentation.get('CreationDate'),
+                'Streams': presentation.get('Streams') or [],
+                'videos': videos,
+                'slides': {
+                    'stream_type': slides.get('StreamType'),
+                    'details': slides.get('SlideDetails') or [],
+                    'length': int(slides.get('Length', 0)),
+                } if slides else {},
+            })
+        analyzer_folders.append(analyzer_folder)
+    return analyzer_folders
@@ -0,0 +1,833 @@
+#!/usr/bin/env python3
+'''
+Local stand-ins for the Mediasite and MediaServer APIs.
+
+They serve collected data (mediasite_all_data.json format) through the same HTTP
+endpoints as the real platforms, so that collect and migrate can be run and
+benchmarked without network access nor credentials.
+'''
+import copy
+import email.parser
+import email.policy
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+logger = logging.getLogger(__name__)
+
+# smallest valid JPEG-like payload served for slides
+SLIDE_BYTES = b'\xff\xd8\xff\xe0' + b'\x00' * 256 + b'\xff\xd9'
+
+# presentation keys that are only returned by sub-resource endpoints
+PRESENTATION_CONTENT_KEYS = [
+    'OnDemandContent',
+    'SlideContent',
+    'SlideDetailsContent',
+    'TimedEvents',
+    'Presenters',
+    'PresentationAnalytics',
+    'Availability',
+]
+
+
+class EmulatorServer:
+    '''
+    Threaded HTTP server answering requests through self.handle().
+    Latency and errors can be injected on every request.
+
+    params:
+        latency_ms : fixed latency added to each response
+        jitter_ms : random latency added on top of latency_ms
+        error_rate : ratio (0 to 1) of requests answered with an error
+        error_codes : status codes picked for injected errors
+        seed : seed of the random generator used for jitter and errors
+    '''
+    name = 'emulator'
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, error_rate=0, error_codes=(503,), seed=0):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.counters = Counter()
+        self.counters_lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        emulator = self
+
+        class Handler(EmulatorRequestHandler):
+            pass
+        Handler.emulator = emulator
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f'{self.name}-{self.port}', daemon=True)
+        self.thread.start()
+        logger.info(f'{self.name} listening on {self.url}')
+        return self.url
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+            logger.info(f'{self.name} stopped')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, key):
+        with self.counters_lock:
+            self.counters[key] += 1
+
+    def get_stats(self):
+        with self.counters_lock:
+            return dict(self.counters)
+
+    def inject(self):
+        '''
+            returns:
+                status code of the injected error, or None
+        '''
+        with self.random_lock:
+            delay_ms = self.latency_ms
+            if self.jitter_ms:
+                delay_ms += self.random.uniform(0, self.jitter_ms)
+            error_code = None
+            if self.error_rate and self.random.random() < self.error_rate:
+                error_code = self.random.choice(self.error_codes)
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+        return error_code
+
+    def handle(self, method, path, params, fields, headers=None):
+        '''
+            returns:
+                status code, headers dict, body bytes (or JSON serializable object)
+        '''
+        raise NotImplementedError
+
+
+class EmulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, Nagle would delay keep-alive responses by 40ms
+    disable_nagle_algorithm = True
+    emulator = None
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.emulator.name}: {format % args}')
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        split_url = urlsplit(self.path)
+        path = unquote(split_url.path)
+        params = {key: values[-1] for key, values in parse_qs(split_url.query).items()}
+        fields = self._read_fields()
+
+        self.emulator.count('requests')
+        error_code = self.emulator.inject()
+        if error_code:
+            self.emulator.count('injected_errors')
+            status, headers, body = error_code, {'Retry-After': '1'}, {'success': False, 'error': f'Injected error ({error_code})'}
+        else:
+            try:
+                status, headers, body = self.emulator.handle(method, path, params, fields, self.headers)
+            except Exception as e:
+                logger.exception(f'{self.emulator.name} failed to answer {method} {self.path}')
+                status, headers, body = 500, {}, {'success': False, 'error': str(e)}
+
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+            headers.setdefault('Content-Type', 'application/json')
+
+        self.send_response(status)
+        for key, val in headers.items():
+            self.send_header(key, val)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if method != 'HEAD':
+            self.wfile.write(body)
+
+    def _read_fields(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return dict()
+        raw = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type', '')
+        fields = dict()
+        if content_type.startswith('multipart/form-data'):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f'Content-Type: {content_type}\r\n\r\n'.encode() + raw
+            )
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if part.get_filename():
+                    fields[name] = {'filename': part.get_filename(), 'size': len(part.get_payload(decode=True) or b'')}
+                else:
+                    fields[name] = part.get_content().strip()
+        elif content_type.startswith('application/json'):
+            fields = json.loads(raw)
+        else:
+            fields = {key: values[-1] for key, values in parse_qs(raw.decode()).items()}
+        return fields
+
+
+class MediasiteEmulator(EmulatorServer):
+    '''
+    Serves Mediasite API v1 OData endpoints (Folders, Channels, Presentations and their content,
+    content servers, encoding settings, user profiles) and the video and slide files.
+
+    params:
+        data : Mediasite data in the collect output format ({'Folders': [...], 'UserProfiles': ...})
+        page_size : default and maximum $top of listings
+        file_size : size in bytes of the served video files
+        missing_files_rate : ratio (0 to 1) of video and slide files answered with a 404
+        expandable : presentations contents which can be expanded in the presentations listing ($expand)
+    '''
+    name = 'mediasite-emulator'
+    api_prefix = '/Site1/api/v1'
+
+    def __init__(self, data=None, page_size=100, file_size=1024, missing_files_rate=0,
+                 expandable=('OnDemandContent', 'SlideContent', 'SlideDetailsContent', 'TimedEvents', 'Presenters'), **kwargs):
+        super().__init__(**kwargs)
+        self.page_size = page_size
+        self.expandable = list(expandable)
+        self.file_bytes = b'\x00' * file_size
+        self.missing_files_rate = missing_files_rate
+        self.load(data or {'Folders': []})
+
+    @property
+    def api_url(self):
+        return self.url + self.api_prefix
+
+    def get_config(self):
+        return {
+            'mediasite_api_url': self.api_url,
+            'mediasite_api_key': 'emulator',
+            'mediasite_api_user': 'emulator',
+            'mediasite_api_password': 'emulator',
+        }
+
+    def load(self, data):
+        self.data = data
+        self.folders = list()
+        self.folders_by_id = dict()
+        self.channels = list()
+        self.presentations = list()
+        self.presentations_by_id = dict()
+        self.content_servers = dict()
+        self.encoding_settings = dict()
+        self.users = dict()
+
+        for folder in data.get('Folders', []):
+            folder_item = {k: v for k, v in folder.items() if k not in ['Presentations', 'Channels']}
+            self.folders.append(folder_item)
+            self.folders_by_id[folder['Id']] = folder_item
+            for channel in folder.get('Channels') or []:
+                self.channels.append(channel)
+            for presentation in folder.get('Presentations') or []:
+                self.presentations.append(presentation)
+                self.presentations_by_id[presentation['Id']] = presentation
+                self._index_content(presentation)
+
+        users = data.get('UserProfiles') or []
+        if isinstance(users, dict):
+            users = users.values()
+        for user in users:
+            self.users[user.get('UserName', '').lower()] = user
+
+    def _index_content(self, presentation):
+        for video_file in presentation.get('OnDemandContent') or []:
+            server = video_file.get('ContentServer') or {}
+            server_id = video_file.get('ContentServerId') or server.get('Id') or server.get('ContentServerId')
+            if server_id:
+                video_file.setdefault('ContentServerId', server_id)
+                self.content_servers.setdefault(server_id, {'Id': server_id, 'Name': 'Emulated server'})
+            settings = video_file.get('ContentEncodingSettings') or {}
+            settings_id = video_file.get('ContentEncodingSettingsId') or settings.get('Id')
+            if settings_id:
+                video_file.setdefault('ContentEncodingSettingsId', settings_id)
+                self.encoding_settings.setdefault(settings_id, settings)
+
+        for slides_key in ['SlideContent', 'SlideDetailsContent']:
+            slides = presentation.get(slides_key)
+            if slides:
+                server = slides.get('ContentServer') or {}
+                server_id = slides.get('ContentServerId') or server.get('ContentServerId')
+                if server_id:
+                    slides.setdefault('ContentServerId', server_id)
+                    self.content_servers.setdefault(server_id, {'Id': server_id, 'Name': 'Emulated server'})
+                settings_id = slides.get('ContentEncodingSettingsId')
+                if settings_id:
+                    self.encoding_settings.setdefault(settings_id, {'Id': settings_id, 'Name': 'Slides'})
+                slides.setdefault('ParentResourceId', presentation['Id'])
+
+    def get_content_server(self, server_id):
+        server = self.content_servers[server_id]
+        return {
+            **server,
+            'DistributionUrl': self.url + '/MediasiteDeliver/$$NAME$$',
+            'Url': self.url + '/FileServer',
+            'ContentServerId': server_id,
+        }
+
+    def get_collected_data(self):
+        '''
+            returns:
+                -> dict : the served data as collected by DataExtractor, with content servers pointing to the emulator
+        '''
+        folders = list()
+        for folder in self.data.get('Folders', []):
+            presentations = list()
+            for presentation in folder.get('Presentations') or []:
+                presentation = dict(presentation)
+                videos = list()
+                for video_file in presentation.get('OnDemandContent') or []:
+                    videos.append({**video_file, 'ContentServer': self.get_content_server(video_file['ContentServerId'])})
+                presentation['OnDemandContent'] = videos
+                for slides_key in ['SlideContent', 'SlideDetailsContent']:
+                    slides = presentation.get(slides_key)
+                    if slides and slides.get('ContentServerId'):
+                        presentation[slides_key] = {**slides, 'ContentServer': self.get_content_server(slides['ContentServerId'])}
+                presentations.append(presentation)
+            folders.append({**folder, 'Presentations': presentations})
+        return {**self.data, 'Folders': folders}
+
+    def is_missing_file(self, name):
+        if not self.missing_files_rate:
+            return False
+        # deterministic, so that a given file is always missing or always present
+        digest = hashlib.md5(name.encode()).digest()
+        return digest[0] / 256 < self.missing_files_rate
+
+    def handle(self, method, path, params, fields, headers=None):
+        if path.startswith('/MediasiteDeliver/'):
+            self.count('video_files')
+            return self._serve_file(path, self.file_bytes, 'video/mp4', headers)
+        if path.startswith('/FileServer/'):
+            self.count('slide_files')
+            return self._serve_file(path, SLIDE_BYTES, 'image/jpeg', headers)
+
+        match = re.match(r"^.*/api/v1/(?P<resource>\w+)(\('(?P<id>[^']*)'\))?(/(?P<sub>\w+))?/?$", path, re.IGNORECASE)
+        if not match:
+            return self._odata_error(404, f'Unknown url {path}')
+
+        resource, resource_id, sub = match.group('resource'), match.group('id'), match.group('sub')
+        self.count(f'{resource}/{sub}' if sub else resource)
+
+        if resource == 'Folders':
+            if resource_id:
+                return self._item(self.folders_by_id.get(resource_id))
+            return self._listing(self.folders, path, params)
+        elif resource == 'Channels':
+            return self._listing(self.channels, path, params)
+        elif resource == 'Presentations':
+            if not resource_id:
+                expand = [name for name in params.get('$expand', '').split(',') if name]
+                for name in expand:
+                    if name not in self.expandable:
+                        return self._odata_error(400, f'Could not find a property named {name}')
+                return self._listing([self._presentation_item(p, expand) for p in self.presentations], path, params)
+            presentation = self.presentations_by_id.get(resource_id)
+            if presentation is None:
+                return self._odata_error(404, f'Presentation {resource_id} not found')
+            if not sub:
+                return self._item(self._presentation_item(presentation))
+            return self._presentation_content(presentation, sub, path, params)
+        elif resource == 'PresentationAnalytics':
+            presentation = self.presentations_by_id.get(resource_id)
+            if presentation is None:
+                return self._odata_error(404, f'Presentation {resource_id} not found')
+            return self._item(presentation.get('PresentationAnalytics') or {'TotalViews': 0, 'LastWatched': None})
+        elif resource == 'ContentServers':
+            if resource_id not in self.content_servers:
+                return self._odata_error(404, f'Content server {resource_id} not found')
+            return self._item(self.get_content_server(resource_id))
+        elif resource == 'ContentEncodingSettings':
+            settings = self.encoding_settings.get(resource_id)
+            if settings is None:
+                return self._odata_error(404, f'Encoding settings {resource_id} not found')
+            return self._item(settings)
+        elif resource == 'UserProfiles':
+            username = self._get_filter_value(params.get('$filter', ''), 'UserName')
+            user = self.users.get((username or '').lower())
+            return 200, {}, {'value': [user] if user else []}
+
+        return self._odata_error(404, f'Unknown resource {resource}')
+
+    def _serve_file(self, path, content, content_type, headers=None):
+        if self.is_missing_file(path):
+            return 404, {}, b''
+        etag = '"' + hashlib.md5(path.encode()).hexdigest() + '"'
+        if headers is not None and headers.get('If-None-Match') == etag:
+            self.count('not_modified')
+            return 304, {'ETag': etag}, b''
+        return 200, {'Content-Type': content_type, 'ETag': etag}, content
+
+    def _presentation_item(self, presentation, expand=()):
+        item = {k: v for k, v in presentation.items() if k not in PRESENTATION_CONTENT_KEYS}
+        for name in expand:
+            if name == 'OnDemandContent':
+                item[name] = [{k: v for k, v in f.items() if k not in ['ContentServer', 'ContentEncodingSettings']} for f in presentation.get(name) or []]
+            elif name == 'SlideContent':
+                item[name] = [self._slides_item(presentation[name])] if presentation.get(name) else []
+            elif name == 'SlideDetailsContent':
+                item[name] = self._slides_item(presentation[name]) if presentation.get(name) else None
+            else:
+                item[name] = presentation.get(name) or []
+        return item
+
+    def _presentation_content(self, presentation, content_name, path, params):
+        if content_name == 'OnDemandContent':
+            videos = list()
+            for video_file in presentation.get('OnDemandContent') or []:
+                videos.append({k: v for k, v in video_file.items() if k not in ['ContentServer', 'ContentEncodingSettings']})
+            return self._listing(videos, path, params)
+        elif content_name == 'SlideContent':
+            slides = presentation.get('SlideContent')
+            slides = [self._slides_item(slides)] if slides else []
+            return self._listing(slides, path, params)
+        elif content_name == 'SlideDetailsContent':
+            slides = presentation.get('SlideDetailsContent')
+            if not slides:
+                return self._odata_error(404, 'No slide details')
+            return self._item(self._slides_item(slides))
+        elif content_name in ['TimedEvents', 'Presenters']:
+            return self._listing(presentation.get(content_name) or [], path, params)
+        elif content_name == 'Availability':
+            return self._item(presentation.get('Availability') or {'AvailabilityState': 'Available'})
+        elif content_name == 'Analytics':
+            return self._item(presentation.get('PresentationAnalytics') or {'TotalViews': 0, 'LastWatched': None})
+        return self._odata_error(404, f'Unknown content {content_name}')
+
+    def _slides_item(self, slides):
+        return {k: v for k, v in slides.items() if k != 'ContentServer'}
+
+    def _listing(self, items, path, params):
+        try:
+            top = min(int(params.get('$top', self.page_size)), self.page_size)
+            skip = int(params.get('$skip', 0))
+        except ValueError:
+            return self._odata_error(400, 'Invalid paging parameters')
+        filter_query = params.get('$filter')
+        if filter_query:
+            match = re.match(r"^(\w+) eq '(.*)'$", filter_query)
+            if match:
+                key, value = match.groups()
+                items = [i for i in items if str(i.get(key)) == value]
+
+        page = items[skip:skip + top]
+        result = {'value': page}
+        if params.get('$inlinecount') == 'allpages':
+            result['odata.count'] = str(len(items))
+        if skip + top < len(items):
+            next_params = dict(params)
+            next_params['$skip'] = skip + top
+            next_params['$top'] = top
+            query = '&'.join(f'{k}={v}' for k, v in next_params.items())
+            result['odata.nextLink'] = f'{self.url}{path}?{query}'
+        return 200, {}, result
+
+    def _item(self, item):
+        if item is None:
+            return self._odata_error(404, 'Not found')
+        return 200, {}, item
+
+    def _odata_error(self, status, message):
+        return status, {}, {'odata.error': {'code': str(status), 'message': {'lang': 'en-US', 'value': message}}}
+
+    def _get_filter_value(self, filter_query, key):
+        match = re.match(rf"^{key} eq '(.*)'$", filter_query)
+        if match:
+            return match.group(1)
+
+
+class MediaServerEmulator(EmulatorServer):
+    '''
+    Serves the MediaServer API v2 endpoints used by MediaTransfer and the bin/ tools,
+    with an in-memory storage of channels, media, users and annotations.
+
+    params:
+        users : list of usernames that exist on the platform
+        transcoding_seconds : time before the resources of a media are replaced by the transcoding task
+    '''
+    name = 'mediaserver-emulator'
+
+    def __init__(self, users=None, transcoding_seconds=0, **kwargs):
+        super().__init__(**kwargs)
+        self.transcoding_seconds = transcoding_seconds
+        self.lock = threading.RLock()
+        self.oid_counter = 0
+        self.channels = dict()
+        self.medias = dict()
+        self.annotations = dict()
+        self.users = dict()
+        self.personal_channels = dict()
+        self.root_oid = self._add_channel('Emulated root channel', parent_oid=None)
+        self.personal_root_oid = self._add_channel('Chaînes personnelles', parent_oid=None)
+        for index, username in enumerate(users or []):
+            self.users[username.lower()] = {'id': index + 1, 'username': username.lower(), 'can_have_personal_channel': True}
+
+    def get_config(self):
+        return {
+            'mediaserver_url': self.url,
+            'mediaserver_api_key': 'emulator',
+            'mediaserver_parent_channel': self.root_oid,
+        }
+
+    def _new_oid(self, prefix):
+        self.oid_counter += 1
+        return f'{prefix}1{self.oid_counter:019d}'
+
+    def _add_channel(self, title, parent_oid, **extra):
+        oid = self._new_oid('c')
+        self.channels[oid] = {
+            'oid': oid,
+            'title': title,
+            'slug': re.sub(r'\W+', '-', title.lower()).strip('-') or oid,
+            'parent_oid': parent_oid,
+            'unlisted': False,
+            'external_ref': '',
+            'creation': time.strftime('%Y-%m-%d %H:%M:%S'),
+            **extra,
+        }
+        return oid
+
+    def _channel_info(self, channel):
+        info = dict(channel)
+        parent = self.channels.get(channel['parent_oid'])
+        info['parent_title'] = parent['title'] if parent else None
+        return info
+
+    def _media_info(self, media, with_path=False):
+        info = dict(media)
+        parent = self.channels.get(media['parent_oid'])
+        info['parent_title'] = parent['title'] if parent else None
+        if with_path:
+            path = list()
+            oid = media['parent_oid']
+            while oid:
+                channel = self.channels[oid]
+                path.insert(0, {'oid': oid, 'title': channel['title'], 'slug': channel['slug']})
+                oid = channel['parent_oid']
+            info['path'] = path
+        return info
+
+    def _resolve_channel_target(self, target):
+        if not target:
+            return self.root_oid
+        if target.startswith('mscid-'):
+            return target[len('mscid-'):]
+        if target.startswith('mscpath-'):
+            parent_oid = None
+            for title in target[len('mscpath-'):].strip('/').split('/'):
+                found = None
+                for channel in self.channels.values():
+                    if channel['parent_oid'] == parent_oid and channel['title'] == title:
+                        found = channel['oid']
+                        break
+                parent_oid = found or self._add_channel(title, parent_oid)
+            return parent_oid
+        return target
+
+    def handle(self, method, path, params, fields, headers=None):
+        match = re.match(r'^.*/api/v2/?(?P<endpoint>.*?)/?$', path)
+        if not match:
+            return 404, {}, {'success': False, 'error': f'Unknown url {path}'}
+        endpoint = match.group('endpoint')
+        self.count(endpoint or 'root')
+        args = {**params, **fields}
+        args.pop('api_key', None)
+
+        handler = getattr(self, 'api_' + re.sub(r'\W', '_', endpoint), None) if endpoint else self.api_root
+        if handler is None:
+            return 404, {}, {'success': False, 'error': f'Unknown endpoint {endpoint}'}
+        with self.lock:
+            result = handler(args)
+        status = 200
+        if isinstance(result, tuple):
+            status, result = result
+        return status, {}, result
+
+    def _not_found(self, message='Not found'):
+        return 404, {'success': False, 'error': message}
+
+    def api_root(self, args):
+        return {'success': True, 'mediaserver': 'emulator'}
+
+    def api_channels_get(self, args):
+        if args.get('oid'):
+            channel = self.channels.get(args['oid'])
+        else:
+            channel = None
+            for c in self.channels.values():
+                if c['title'] == args.get('title') and (not args.get('parent') or c['parent_oid'] == args['parent']):
+                    channel = c
+                    break
+        if channel is None:
+            return self._not_found('Channel not found')
+        return {'success': True, 'info': self._channel_info(channel)}
+
+    def api_channels_add(self, args):
+        parent_oid = args.get('parent') or self.root_oid
+        if parent_oid not in self.channels:
+            return self._not_found('Parent channel not found')
+        oid = self._add_channel(args.get('title', ''), parent_oid)
+        return {'success': True, 'oid': oid, 'slug': self.channels[oid]['slug']}
+
+    def api_channels_edit(self, args):
+        channel = self.channels.get(args.get('oid'))
+        if channel is None:
+            return self._not_found('Channel not found')
+        for key in ['title', 'external_ref', 'external_data']:
+            if key in args:
+                channel[key] = args[key]
+        return {'success': True}
+
+    def api_channels_delete(self, args):
+        oid = args.get('oid')
+        if oid not in self.channels:
+            return self._not_found('Channel not found')
+        to_delete = [oid]
+        while to_delete:
+            current = to_delete.pop()
+            self.channels.pop(current, None)
+            to_delete.extend(c['oid'] for c in self.channels.values() if c['parent_oid'] == current)
+            for media_oid in [m['oid'] for m in self.medias.values() if m['parent_oid'] == current]:
+                self.medias.pop(media_oid)
+        return {'success': True}
+
+    def api_channels_personal(self, args):
+        user = None
+        for u in self.users.values():
+            if str(u['id']) == str(args.get('id')) or u.get('email') == args.get('email'):
+                user = u
+                break
+        if user is None:
+            return self._not_found('User not found')
+        if not user.get('can_have_personal_channel'):
+            return 403, {'success': False, 'error': 'Access denied (403)', 'message': ''}
+        oid = self.personal_channels.get(user['username'])
+        if oid is None:
+            oid = self.personal_channels[user['username']] = self._add_channel(user['username'], self.personal_root_oid)
+        return {'success': True, 'oid': oid}
+
+    def api_channels_content(self, args):
+        parent_oid = args.get('parent_oid') or self.root_oid
+        content = args.get('content', 'cv')
+        start = int(args.get('offset', 0))
+        limit = int(args.get('limit', 0)) or None
+        result = {'success': True}
+        if 'c' in content:
+            channels = [self._channel_info(c) for c in self.channels.values() if c['parent_oid'] == parent_oid]
+            result['channels'] = channels[start:start + limit if limit else None]
+        if 'v' in content:
+            videos = [self._media_info(m) for m in self.medias.values() if m['parent_oid'] == parent_oid]
+            result['videos'] = videos[start:start + limit if limit else None]
+        return result
+
+    def api_perms_edit_default(self, args):
+        item = self.channels.get(args.get('oid')) or self.medias.get(args.get('oid'))
+        if item is None:
+            return self._not_found()
+        item['unlisted'] = bool(args.get('unlisted'))
+        return {'success': True}
+
+    def api_perms_edit(self, args):
+        if args.get('type') == 'user':
+            for user in self.users.values():
+                if str(user['id']) == str(args.get('id')):
+                    user['can_have_personal_channel'] = args.get('can_have_personal_channel') == 'True'
+        return {'success': True}
+
+    def api_users(self, args):
+        search = (args.get('search') or '').lower()
+        return {'success': True, 'users': [u for name, u in self.users.items() if search in name]}
+
+    def api_medias_add(self, args):
+        parent_oid = self._resolve_channel_target(args.get('channel'))
+        if parent_oid not in self.channels:
+            return self._not_found('Channel not found')
+        oid = self._new_oid('v')
+        media = {k: v for k, v in args.items() if not isinstance(v, dict)}
+        media.update({
+            'oid': oid,
+            'slug': args.get('slug') or oid,
+            'parent_oid': parent_oid,
+            'validated': args.get('validated') == 'yes',
+            'external_ref': args.get('external_ref', ''),
+            'creation': args.get('creation') or time.strftime('%Y-%m-%d %H:%M:%S'),
+            'origin': 'mediatransfer',
+            'resources': [{'file': args.get('file_url') or 'composite.mp4'}],
+        })
+        self.medias[oid] = media
+        return {'success': True, 'oid': oid, 'slug': media['slug']}
+
+    def api_medias_get(self, args):
+        media = self.medias.get(args.get('oid'))
+        if media is None and args.get('title'):
+            for m in self.medias.values():
+                if m.get('title') == args['title']:
+                    media = m
+                    break
+        if media is None:
+            return self._not_found('Media not found')
+        return {'success': True, 'info': self._media_info(media, with_path=args.get('path') == 'yes')}
+
+    def api_medias_edit(self, args):
+        media = self.medias.get(args.get('oid'))
+        if media is None:
+            return self._not_found('Media not found')
+        for key, val in args.items():
+            if key == 'validated':
+                media[key] = val == 'yes'
+            elif not isinstance(val, dict):
+                media[key] = val
+        return {'success': True}
+
+    def api_medias_delete(self, args):
+        if self.medias.pop(args.get('oid'), None) is None:
+            return self._not_found('Media not found')
+        self.annotations.pop(args.get('oid'), None)
+        return {'success': True}
+
+    def api_medias_resources_list(self, args):
+        media = self.medias.get(args.get('oid'))
+        if media is None:
+            return self._not_found('Media not found')
+        if media.get('transcoded_at') and media['transcoded_at'] <= time.time():
+            media['resources'] = [{'file': 'index.m3u8'}]
+            media.pop('transcoded_at')
+        return {'success': True, 'resources': media['resources']}
+
+    def api_medias_task(self, args):
+        media = self.medias.get(args.get('oid'))
+        if media is None:
+            return self._not_found('Media not found')
+        if not media['resources']:
+            return 400, {'success': False, 'error': 'The media has no usable ressources'}
+        media['transcoded_at'] = time.time() + self.transcoding_seconds
+        return {'success': True}
+
+    def api_search(self, args):
+        search = args.get('search', '')
+        content = args.get('content', 'cv')
+        by_ref = 'extref' in args.get('fields', '')
+        result = {'success': True}
+
+        def matches(item):
+            if by_ref:
+                return item.get('external_ref') == search
+            return search.lower() in item.get('title', '').lower()
+
+        if 'c' in content:
+            result['channels'] = [self._channel_info(c) for c in self.channels.values() if matches(c)]
+        if 'v' in content:
+            result['videos'] = [self._media_info(m) for m in self.medias.values() if matches(m)]
+        return result
+
+    def api_latest(self, args):
+        count = int(args.get('count', 20))
+        start = args.get('start') or None
+        medias = sorted(self.medias.values(), key=lambda m: (m['creation'], m['oid']), reverse=True)
+        if start:
+            medias = [m for m in medias if m['creation'] < start]
+        items = [self._media_info(m) for m in medias[:count]]
+        return {
+            'success': True,
+            'items': items,
+            'more': len(medias) > count,
+            'max_date': items[-1]['creation'] if items else start,
+        }
+
+    def api_annotations_types_list(self, args):
+        return {'success': True, 'types': [{'id': 1, 'slug': 'slide'}, {'id': 2, 'slug': 'chapter'}]}
+
+    def api_annotations_post(self, args):
+        oid = args.get('oid')
+        if oid not in self.medias:
+            return self._not_found('Media not found')
+        annotation = {
+            'id': len(self.annotations.get(oid, [])) + 1,
+            'time': int(args.get('time') or 0),
+            'title': args.get('title'),
+            'type': int(args.get('type') or 0),
+        }
+        if isinstance(args.get('attachment'), dict):
+            annotation['attachment'] = {'url': f"{self.url}/attachments/{oid}/{args['attachment']['filename']}"}
+        self.annotations.setdefault(oid, list()).append(annotation)
+        return {'success': True, 'annotation': annotation}
+
+    def _list_annotations(self, args, type_id, key):
+        oid = args.get('oid')
+        if oid not in self.medias:
+            return self._not_found('Media not found')
+        items = [a for a in self.annotations.get(oid, []) if a['type'] == type_id]
+        return {'success': True, key: sorted(items, key=lambda a: a['time'])}
+
+    def api_annotations_slides_list(self, args):
+        return self._list_annotations(args, 1, 'slides')
+
+    def api_annotations_chapters_list(self, args):
+        return self._list_annotations(args, 2, 'chapters')
+
+
+def scale_data(data, copies):
+    '''
+    Replicate Mediasite data (e.g. the anonymized test data) with new ids,
+    in order to serve large libraries.
+
+    returns:
+        -> dict : Mediasite data with copies times the folders and presentations
+    '''
+    if copies <= 1:
+        return data
+    scaled = {'Folders': list(), 'UserProfiles': data.get('UserProfiles', [])}
+    folders_ids = {folder['Id'] for folder in data['Folders']}
+    for index in range(copies):
+        suffix = f'{index:06x}'
+        # ids are suffixed so that parent links stay consistent within a copy
+        for folder in data['Folders']:
+            folder_copy = copy.deepcopy(folder)
+            folder_copy['Id'] += suffix
+            if folder_copy.get('ParentFolderId') in folders_ids:
+                folder_copy['ParentFolderId'] += suffix
+            folder_copy['Name'] = f"{folder_copy['Name']} {suffix}"
+            for presentation in folder_copy.get('Presentations') or []:
+                presentation['Id'] += suffix
+                presentation['ParentFolderId'] = folder_copy['Id']
+                for slides_key in ['SlideContent', 'SlideDetailsContent']:
+                    if presentation.get(slides_key):
+                        presentation[slides_key]['ParentResourceId'] = presentation['Id']
+            scaled['Folders'].append(folder_copy)
+    return scaled
@@ -0,0 +1,113 @@
+from unittest import TestCase
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.cache import Cache, cached, get_caches
+from mediasite_migration_scripts.utils.state import StateStore
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class Client():
+    def __init__(self, caches):
+        self.caches = caches
+        self.calls = list()
+
+    @cached('users')
+    def get_user(self, username):
+        self.calls.append(username)
+        time.sleep(0.05)
+        return {'username': username}
+
+    @cached('channels', key=lambda user_email=None, user_id=None: f'{user_email}|{user_id}')
+    def get_channel(self, user_email=None, user_id=None):
+        self.calls.append(user_id)
+        if user_id == 'denied' and len(self.calls) == 1:
+            # permission granted, asking again
+            return self.get_channel(user_id=user_id)
+        return f'c-{user_id}'
+
+
+class TestCache(TestCase):
+
+    def setUp(self):
+        super(TestCache)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state = StateStore(Path(self.tmp_dir.name) / 'state.sqlite')
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp_dir.cleanup()
+
+    def test_bounds(self):
+        cache = Cache('test', maxsize=2, ttl_seconds=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        # b is the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats['evicted'], 1)
+
+        cache.entries['a'] = (1, time.time() - 1)
+        self.assertEqual(cache.get('a', 'expired'), 'expired')
+        self.assertEqual(cache.stats['expired'], 1)
+
+    def test_coalescing(self):
+        client = Client({'users': Cache('users')})
+        threads = [threading.Thread(target=client.get_user, args=('john',)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(client.calls, ['john'])
+        self.assertEqual(client.get_user('john'), {'username': 'john'})
+        stats = client.caches['users'].stats
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'] + stats['coalesced'], 5)
+
+    def test_errors(self):
+        cache = Cache('test')
+
+        def fail():
+            raise ValueError('API error')
+
+        with self.assertRaises(ValueError):
+            cache.get_or_compute('a', fail)
+        self.assertEqual(cache.get_or_compute('a', lambda: 1), 1)
+
+    def test_keys(self):
+        client = Client({'channels': Cache('channels')})
+        self.assertEqual(client.get_channel(user_id='denied'), 'c-denied')
+        self.assertEqual(client.get_channel(None, 'denied'), 'c-denied')
+        self.assertEqual(client.calls, ['denied', 'denied'])
+        self.assertEqual(list(client.caches['channels'].entries), ['None|denied'])
+
+    def test_persistence(self):
+        config = {'cache_persist': True, 'cache_ttl_hours': 1}
+        caches = get_caches(config, ['users', 'searches'], state=self.state, persisted=['users'])
+        client = Client(caches)
+        client.get_user('john')
+        caches['searches'].set('ref', None)
+        self.assertEqual(self.state.count('cache_users'), 1)
+        self.assertEqual(self.state.count('cache_searches'), 0)
+
+        # next run
+        client = Client(get_caches(config, ['users'], state=self.state, persisted=['users']))
+        self.assertEqual(client.get_user('john'), {'username': 'john'})
+        self.assertEqual(client.calls, [])
+
+        client = Client(get_caches({}, ['users'], state=self.state, persisted=['users']))
+        client.get_user('john')
+        self.assertEqual(client.calls, ['john'])
@@ -0,0 +1,89 @@
+from unittest import TestCase
+import logging
+import tempfile
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+import mediasite_migration_scripts.utils.mediasite as mediasite_utils
+from mediasite_migration_scripts.utils.catalog import Catalog, FORMAT_ANALYZER, FORMAT_COLLECT
+from tests.datasets import to_analyzer_data
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestCatalog(TestCase):
+
+    def setUp(self):
+        super(TestCatalog)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'mediasite_data.sqlite'
+        self.data = utils.read_json('tests/mediasite_test_data.json')
+        self.catalog = Catalog(self.path)
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp_dir.cleanup()
+
+    def test_import_collect_data(self):
+        counts = self.catalog.import_data(self.data, source='tests/mediasite_test_data.json')
+        presentations = [p for f in self.data['Folders'] for p in f['Presentations']]
+        self.assertEqual(counts['folders'], len(self.data['Folders']))
+        self.assertEqual(counts['presentations'], len(presentations))
+        self.assertEqual(counts['video_files'], sum(len(p.get('OnDemandContent') or []) for p in presentations))
+        self.assertEqual(counts['users'], len(self.data['UserProfiles']))
+        self.assertEqual(self.catalog.data_format, FORMAT_COLLECT)
+
+        # same data, read back
+        self.assertEqual(list(self.catalog.iter_folders()), self.data['Folders'])
+        self.assertEqual(self.catalog.get_users(), mediasite_utils.get_users_by_username(self.data['UserProfiles']))
+        folder = self.data['Folders'][-1]
+        presentation = folder['Presentations'][-1]
+        found = self.catalog.get_presentations([presentation['Id'], 'unknown', presentation['Id']])
+        self.assertEqual(len(found), 1)
+        self.assertEqual(found[0][0]['Id'], folder['Id'])
+        self.assertNotIn('Presentations', found[0][0])
+        self.assertEqual(found[0][1], presentation)
+        self.assertIsNone(self.catalog.get_presentation('unknown'))
+
+        # reimported, not added
+        self.catalog.import_data(self.data)
+        self.assertEqual(self.catalog.counts(), counts)
+
+    def test_search(self):
+        self.catalog.import_data(to_analyzer_data(self.data))
+        self.assertEqual(self.catalog.data_format, FORMAT_ANALYZER)
+        presentation = self.data['Folders'][0]['Presentations'][0]
+        found = self.catalog.search(presentation['Id'], ['id', 'name'])
+        self.assertEqual([p['id'] for p in found['presentations']], [presentation['Id']])
+        self.assertEqual(found['folders'], [])
+
+        title_word = presentation['Title'].split()[0]
+        found = self.catalog.search(title_word, ['name'])
+        expected = [p['Id'] for f in self.data['Folders'] for p in f['Presentations'] if title_word in p['Title']]
+        self.assertEqual([p['id'] for p in found['presentations']], expected)
+        # fields without a column are searched in the json
+        found = self.catalog.search(presentation['Streams'][0]['StreamType'], ['Streams'])
+        self.assertIn(presentation['Id'], [p['id'] for p in found['presentations']])
+
+        paths = [path for path, p_id in self.catalog.list_presentations()]
+        folder = to_analyzer_data(self.data)[0]
+        self.assertEqual(paths[0], folder['path'])
+        self.assertEqual(len(paths), sum(len(f['Presentations']) for f in self.data['Folders']))
+        self.assertEqual(list(self.catalog.iter_folders(lambda path: path == folder['path'])), [folder])
+
+    def test_open(self):
+        with self.assertRaises(FileNotFoundError):
+            Catalog.open(Path(self.tmp_dir.name) / 'missing.sqlite')
+        self.catalog.import_data(self.data)
+        catalog = Catalog.open(self.path)
+        with self.assertRaises(ValueError):
+            catalog.check_format(FORMAT_ANALYZER)
+        catalog.close()
+        with self.assertRaises(ValueError):
+            self.catalog.import_data({'folders': []})
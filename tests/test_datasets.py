@@ -0,0 +1,61 @@
+from unittest import TestCase
+import json
+import logging
+import tempfile
+
+import mediasite_migration_scripts.utils.common as utils
+import mediasite_migration_scripts.utils.mediasite as mediasite_utils
+from tests.datasets import DatasetGenerator, USERS_FOLDER_NAME
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestDatasetGenerator(TestCase):
+
+    def test_generate(self):
+        data = DatasetGenerator(presentations=500, folders=30, depth=4, users=10, seed=1).generate()
+        presentations = [p for f in data['Folders'] for p in f['Presentations']]
+        self.assertEqual(len(presentations), 500)
+        self.assertEqual(len({p['Id'] for p in presentations}), 500)
+
+        folders_ids = {f['Id'] for f in data['Folders']}
+        for folder in data['Folders']:
+            for presentation in folder['Presentations']:
+                self.assertEqual(presentation['ParentFolderId'], folder['Id'])
+                self.assertIsNotNone(presentation.get('SlideContent', presentation.get('SlideDetailsContent')))
+        top_folders = [f for f in data['Folders'] if f['ParentFolderId'] not in folders_ids]
+        self.assertIn(USERS_FOLDER_NAME, [f['Name'] for f in top_folders])
+        self.assertEqual(len(data['UserProfiles']), 9)
+        # keyed by username, like collect output
+        self.assertTrue(all(username == user['UserName'] for username, user in data['UserProfiles'].items()))
+
+        self.assertTrue(any(mediasite_utils.is_composite(p) for p in presentations))
+        self.assertTrue(any(mediasite_utils.has_slides_details(p) for p in presentations))
+        mime_types = {v['ContentMimeType'] for p in presentations for v in p['OnDemandContent']}
+        self.assertIn('video/x-ms-wmv', mime_types)
+
+    def test_folders_depth(self):
+        data = DatasetGenerator(presentations=10, folders=40, depth=4, users=0, seed=1).generate()
+        folders_by_id = {f['Id']: f for f in data['Folders']}
+
+        def get_depth(folder):
+            parent = folders_by_id.get(folder['ParentFolderId'])
+            return 1 + get_depth(parent) if parent else 1
+
+        self.assertEqual(max(get_depth(f) for f in data['Folders']), 4)
+
+    def test_deterministic_write(self):
+        generator_options = {'presentations': 200, 'seed': 3, 'types_weights': {'composite': 1}}
+        data = DatasetGenerator(**generator_options).generate()
+        with tempfile.NamedTemporaryFile(suffix='.json') as f:
+            counts = DatasetGenerator(**generator_options).write(f.name)
+            self.assertEqual(json.load(f), data)
+        self.assertEqual(counts, {'folders': len(data['Folders']), 'presentations': 200})
+        self.assertNotEqual(DatasetGenerator(presentations=200, seed=4).generate(), data)
+        self.assertTrue(all(mediasite_utils.is_composite(p) for f in data['Folders'] for p in f['Presentations']))
@@ -0,0 +1,130 @@
+from unittest import TestCase
+import logging
+import requests
+
+import mediasite_migration_scripts.utils.common as utils
+import mediasite_migration_scripts.utils.http as http
+from mediasite_migration_scripts.utils.mediasite import MediasiteClient
+from tests.emulators import MediasiteEmulator, MediaServerEmulator, scale_data
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestMediasiteEmulator(TestCase):
+
+    def setUp(self):
+        super(TestMediasiteEmulator)
+        self.data = utils.read_json('tests/mediasite_test_data.json')
+        self.emulator = MediasiteEmulator(self.data, page_size=4)
+        self.emulator.start()
+        self.client = MediasiteClient(self.emulator.get_config())
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.client.close()
+        self.session.close()
+        self.emulator.stop()
+
+    def test_listing_paging(self):
+        first_page = self.client.do_request('/Presentations?$inlinecount=allpages')
+        self.assertEqual(len(first_page['value']), 4)
+        self.assertEqual(int(first_page['odata.count']), len(self.emulator.presentations))
+        self.assertNotIn('OnDemandContent', first_page['value'][0])
+
+        next_page = self.session.get(first_page['odata.nextLink']).json()
+        self.assertEqual(next_page['value'][0]['Id'], self.emulator.presentations[4]['Id'])
+
+    def test_listing_windows(self):
+        client = MediasiteClient({**self.emulator.get_config(), 'mediasite_listing_workers': 3, 'mediasite_listing_page_size': 10})
+        pages = list(client.iter_pages('Presentations', {'$select': 'full'}))
+        client.close()
+        # the emulator returns 4 items per page
+        self.assertTrue(all(len(page) <= 4 for page in pages))
+        self.assertEqual([p['Id'] for page in pages for p in page], [p['Id'] for p in self.emulator.presentations])
+        self.assertEqual(self.emulator.get_stats()['Presentations'], len(pages))
+
+    def test_listing_expand(self):
+        pages = list(self.client.iter_pages('Presentations', {'$select': 'full', '$expand': 'OnDemandContent,TimedEvents'}))
+        presentation = pages[0][0]
+        self.assertGreater(len(presentation['OnDemandContent']), 0)
+        self.assertNotIn('ContentServer', presentation['OnDemandContent'][0])
+        self.assertIn('TimedEvents', presentation)
+        self.assertNotIn('Presenters', presentation)
+
+        self.emulator.expandable = ['OnDemandContent']
+        with self.assertRaises(RuntimeError):
+            list(self.client.iter_pages('Presentations', {'$expand': 'OnDemandContent,TimedEvents'}))
+
+    def test_presentation_content(self):
+        pid = self.data['Folders'][0]['Presentations'][0]['Id']
+        self.assertEqual(self.client.get_presentation(pid)['Id'], pid)
+        self.assertIsNone(self.client.get_presentation('unknown'))
+
+        videos = self.client.do_request(f"/Presentations('{pid}')/OnDemandContent")['value']
+        self.assertGreater(len(videos), 0)
+        server = self.client.do_request(f"/ContentServers('{videos[0]['ContentServerId']}')")
+        video_url = server['DistributionUrl'].replace('$$NAME$$', videos[0]['FileNameWithExtension'])
+        self.assertTrue(http.url_exists(video_url, self.session))
+
+    def test_missing_files(self):
+        self.emulator.missing_files_rate = 1
+        self.assertFalse(http.url_exists(f'{self.emulator.url}/MediasiteDeliver/video.mp4', self.session))
+
+    def test_error_injection(self):
+        self.emulator.error_rate = 1
+        self.emulator.error_codes = [429]
+        r = self.session.get(f'{self.emulator.api_url}/Folders')
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(self.emulator.get_stats()['injected_errors'], 1)
+
+    def test_scale_data(self):
+        scaled = scale_data(self.data, 3)
+        self.assertEqual(len(scaled['Folders']), 3 * len(self.data['Folders']))
+        ids = [p['Id'] for f in scaled['Folders'] for p in f['Presentations']]
+        self.assertEqual(len(ids), len(set(ids)))
+
+
+class TestMediaServerEmulator(TestCase):
+
+    def setUp(self):
+        super(TestMediaServerEmulator)
+        self.emulator = MediaServerEmulator(users=['test-user'])
+        self.emulator.start()
+        self.session = requests.Session()
+        self.api_url = self.emulator.url + '/api/v2'
+
+    def tearDown(self):
+        self.session.close()
+        self.emulator.stop()
+
+    def test_channels_and_medias(self):
+        root_oid = self.emulator.get_config()['mediaserver_parent_channel']
+        channel = self.session.post(f'{self.api_url}/channels/add/', data={'title': 'Folder', 'parent': root_oid}).json()
+        self.assertTrue(channel['success'])
+        self.session.post(f'{self.api_url}/channels/edit/', data={'oid': channel['oid'], 'external_ref': 'f0'})
+
+        media = self.session.post(f'{self.api_url}/medias/add/', data={
+            'title': 'Media', 'channel': 'mscid-' + channel['oid'], 'external_ref': 'p0', 'validated': 'yes'
+        }).json()
+        self.assertTrue(media['success'])
+
+        info = self.session.get(f'{self.api_url}/medias/get/', params={'oid': media['oid'], 'path': 'yes'}).json()['info']
+        self.assertEqual([p['title'] for p in info['path']], ['Emulated root channel', 'Folder'])
+        self.assertTrue(info['validated'])
+
+        search = self.session.get(f'{self.api_url}/search/', params={'search': 'f0', 'fields': 'extref', 'content': 'c'}).json()
+        self.assertEqual(search['channels'][0]['oid'], channel['oid'])
+
+        r = self.session.get(f'{self.api_url}/medias/get/', params={'oid': 'unknown'})
+        self.assertEqual(r.status_code, 404)
+
+    def test_personal_channel(self):
+        user = self.session.get(f'{self.api_url}/users/', params={'search': 'test-user'}).json()['users'][0]
+        result = self.session.get(f'{self.api_url}/channels/personal/', params={'id': user['id'], 'create': 'yes'}).json()
+        self.assertTrue(result['success'])
@@ -0,0 +1,95 @@
+from unittest import TestCase
+import logging
+import requests
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.external_refs import ExternalRefIndex
+from tests.emulators import MediaServerEmulator
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestExternalRefIndex(TestCase):
+
+    def setUp(self):
+        super(TestExternalRefIndex)
+        self.emulator = MediaServerEmulator()
+        self.emulator.start()
+        self.session = requests.Session()
+        root_oid = self.emulator.root_oid
+        for i in range(3):
+            channel_oid = self.add_channel(f'channel {i}', root_oid, f'folder-{i}')
+            for j in range(2):
+                subchannel_oid = self.add_channel(f'subchannel {i}.{j}', channel_oid, f'folder-{i}.{j}')
+                for k in range(5):
+                    self.call('medias/add', 'post', {'channel': f'mscid-{subchannel_oid}', 'title': 'media', 'external_ref': f'p-{i}.{j}.{k}'})
+        # not migrated
+        self.add_channel('other', root_oid, '')
+        self.add_channel('outside', self.emulator.personal_root_oid, 'folder-personal')
+
+    def tearDown(self):
+        self.session.close()
+        self.emulator.stop()
+
+    def call(self, suffix, method='get', params=None):
+        if method == 'post':
+            return self.session.post(f'{self.emulator.url}/api/v2/{suffix}', data=params).json()
+        return self.session.get(f'{self.emulator.url}/api/v2/{suffix}', params=params).json()
+
+    def add_channel(self, title, parent_oid, external_ref):
+        oid = self.call('channels/add', 'post', {'title': title, 'parent': parent_oid})['oid']
+        self.call('channels/edit', 'post', {'oid': oid, 'external_ref': external_ref})
+        return oid
+
+    def test_from_config(self):
+        self.assertIsNone(ExternalRefIndex.from_config({'external_refs_prefetch': False}, self.call, 'c1'))
+        index = ExternalRefIndex.from_config({'external_refs_page_size': 10}, self.call, 'c1')
+        self.assertEqual(index.page_size, 10)
+
+    def test_load(self):
+        index = ExternalRefIndex(self.call, self.emulator.root_oid, page_size=2, workers=4)
+        index.load()
+        self.assertEqual(index.complete, {'channel': True, 'media': True})
+        self.assertEqual(len(index.refs['channel']), 9)
+        self.assertEqual(len(index.refs['media']), 30)
+        self.assertIsNone(index.get('channel', 'folder-personal'))
+        oid = index.get('media', 'p-2.1.4')
+        self.assertEqual(self.emulator.medias[oid]['external_ref'], 'p-2.1.4')
+        # pages of 2 items: root (4 channels), channels (2 subchannels), other, subchannels (5 medias)
+        self.assertEqual(index.stats, {'channels': 11, 'requests': 3 + 3 * 2 + 1 + 6 * 3, 'errors': 0})
+        self.assertEqual(self.emulator.get_stats().get('search', 0), 0)
+
+        index.add('media', 'p-new', 'v1')
+        self.assertEqual(index.get('media', 'p-new'), 'v1')
+
+    def test_errors(self):
+        self.emulator.error_rate = 1
+        index = ExternalRefIndex(self.call, self.emulator.root_oid)
+        index.load()
+        self.assertFalse(index.is_complete('channel'))
+        self.assertFalse(index.is_complete('media'))
+        self.assertEqual(index.stats['errors'], 1)
+
+    def test_without_external_refs(self):
+        def api(*args, **kwargs):
+            # API version not returning the external_ref field of videos in channels contents
+            result = self.call(*args, **kwargs)
+            for item in result.get('videos', []):
+                item.pop('external_ref', None)
+            return result
+
+        index = ExternalRefIndex(api, self.emulator.root_oid)
+        index.load()
+        self.assertEqual(index.complete, {'channel': True, 'media': False})
+        self.assertEqual(index.items_count, {'channel': 4 + 3 * 2, 'media': 6 * 5})
+
+        # an empty channel can be trusted
+        empty = ExternalRefIndex(api, self.add_channel('empty', self.emulator.root_oid, ''))
+        empty.load()
+        self.assertEqual(empty.complete, {'channel': True, 'media': True})
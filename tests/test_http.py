@@ -0,0 +1,196 @@
+from unittest import TestCase
+import logging
+import tempfile
+import threading
+import time
+import requests
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+import mediasite_migration_scripts.utils.http as http
+from tests.emulators import MediasiteEmulator
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestUrlStatusCache(TestCase):
+
+    def setUp(self):
+        super(TestUrlStatusCache)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'url_status_cache.sqlite'
+        self.emulator = MediasiteEmulator(utils.read_json('tests/mediasite_test_data.json'))
+        self.emulator.start()
+        self.video_url = f'{self.emulator.url}/MediasiteDeliver/video.mp4'
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.emulator.stop()
+        self.tmp_dir.cleanup()
+
+    def get_cache(self, **kwargs):
+        cache = http.UrlStatusCache(self.path, **kwargs)
+        http.set_url_status_cache(self.session, cache)
+        return cache
+
+    def expire(self, cache, url, hours):
+        entry = cache.get(url)
+        entry['checked'] -= hours * 3600
+        cache.state.set(cache.namespace, url, entry)
+
+    def test_from_config(self):
+        self.assertIsNone(http.UrlStatusCache.from_config({'url_status_cache': False}))
+        cache = http.UrlStatusCache.from_config({'download_folder': self.tmp_dir.name, 'url_status_ttl_hours': 1})
+        self.assertEqual(cache.path, self.path)
+        self.assertEqual(cache.ttl, 3600)
+        self.assertFalse(cache.revalidate)
+
+    def test_cached_between_runs(self):
+        self.get_cache()
+        self.assertTrue(http.url_exists(self.video_url, self.session))
+        self.assertTrue(http.url_exists(self.video_url, self.session))
+        self.assertEqual(self.emulator.get_stats()['video_files'], 1)
+
+        # new run, same cache file
+        cache = self.get_cache()
+        self.assertTrue(http.url_exists(self.video_url, self.session))
+        self.assertEqual(self.emulator.get_stats()['video_files'], 1)
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 0, 'revalidated': 0})
+        entry = cache.get(self.video_url)
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['length'], len(self.emulator.file_bytes))
+        self.assertTrue(entry['etag'])
+
+    def test_namespaces(self):
+        cache = self.get_cache()
+        self.assertTrue(http.url_exists(self.video_url, self.session))
+        # checks made with GET requests do not use the entries of HEAD requests
+        get_cache = http.UrlStatusCache(self.path, namespace=http.UrlStatusCache.GET_NAMESPACE)
+        self.assertIsNone(get_cache.get_fresh(self.video_url))
+        with self.session.get(self.video_url, stream=True) as r:
+            get_cache.set(self.video_url, r)
+        self.assertEqual(get_cache.get_fresh(self.video_url)['status'], 200)
+        get_cache.clear()
+        self.assertIsNotNone(cache.get_fresh(self.video_url))
+
+    def test_ttl(self):
+        cache = self.get_cache(ttl_hours=24, negative_ttl_hours=1)
+        self.emulator.missing_files_rate = 1
+        missing_url = f'{self.emulator.url}/MediasiteDeliver/missing.mp4'
+        self.assertFalse(http.url_exists(missing_url, self.session))
+        self.expire(cache, missing_url, 2)
+        self.emulator.missing_files_rate = 0
+        self.assertTrue(http.url_exists(missing_url, self.session))
+
+        self.expire(cache, missing_url, 2)
+        self.assertTrue(http.url_exists(missing_url, self.session))
+        self.assertEqual(self.emulator.get_stats()['video_files'], 2)
+
+    def test_revalidate(self):
+        cache = self.get_cache(revalidate=True)
+        self.assertTrue(http.url_exists(self.video_url, self.session))
+        checked = cache.get(self.video_url)['checked']
+        self.expire(cache, self.video_url, 24 * 8)
+        time.sleep(0.01)
+
+        self.assertTrue(http.url_exists(self.video_url, self.session))
+        self.assertEqual(self.emulator.get_stats()['not_modified'], 1)
+        self.assertEqual(cache.stats['revalidated'], 1)
+        entry = cache.get(self.video_url)
+        self.assertEqual(entry['length'], len(self.emulator.file_bytes))
+        self.assertGreater(entry['checked'], checked)
+
+    def test_errors_not_cached(self):
+        cache = self.get_cache()
+        self.assertFalse(http.url_exists('http://127.0.0.1:1/video.mp4', self.session))
+        self.assertIsNone(cache.get('http://127.0.0.1:1/video.mp4'))
+
+    def test_download_url(self):
+        cache = self.get_cache()
+        slide_url = f'{self.emulator.url}/FileServer/slide_0001.jpg'
+        file_path = Path(self.tmp_dir.name) / 'slide_0001.jpg'
+        self.assertTrue(http.download_url(slide_url, file_path, self.session))
+        self.assertGreater(file_path.stat().st_size, 0)
+        self.assertTrue(cache.get(slide_url)['length'] > 0)
+        # already downloaded
+        self.assertTrue(http.download_url(slide_url, file_path, self.session))
+        self.assertEqual(self.emulator.get_stats()['slide_files'], 1)
+
+        self.emulator.missing_files_rate = 1
+        missing_path = Path(self.tmp_dir.name) / 'missing.jpg'
+        missing_url = f'{self.emulator.url}/FileServer/missing.jpg'
+        self.assertFalse(http.download_url(missing_url, missing_path, self.session))
+        self.assertFalse(missing_path.exists())
+        self.assertEqual(cache.get(missing_url)['status'], 404)
+        # known as missing
+        self.assertFalse(http.download_url(missing_url, missing_path, self.session))
+        self.assertEqual(self.emulator.get_stats()['slide_files'], 2)
+
+
+class TestSessions(TestCase):
+
+    def setUp(self):
+        super(TestSessions)
+        self.emulator = MediasiteEmulator(utils.read_json('tests/mediasite_test_data.json'))
+        self.emulator.start()
+        self.url = f'{self.emulator.api_url}/Folders'
+
+    def tearDown(self):
+        self.emulator.stop()
+
+    def test_settings(self):
+        config = {'http_pool_maxsize': 64, 'http_keep_alive': False, 'http_read_timeout': 0.1, 'http_retries': 0}
+        session = http.get_session('user', 'password', headers={'sfapikey': 'key'}, config=config)
+        adapter = session.get_adapter(self.url)
+        self.assertEqual(adapter._pool_maxsize, 64)
+        self.assertEqual(adapter.timeout, (10, 0.1))
+        self.assertEqual(session.headers, {'sfapikey': 'key', 'Connection': 'close'})
+        self.assertEqual(session.auth.username, 'user')
+
+        self.emulator.latency_ms = 300
+        with self.assertRaisesRegex(requests.exceptions.RequestException, 'Read timed out'):
+            session.get(self.url, timeout=None)
+        session.close()
+
+    def test_pool_stats(self):
+        with http.create_session() as session:
+            for _ in range(5):
+                self.assertEqual(session.get(self.url).status_code, 200)
+            self.assertEqual(http.get_pool_stats(session), {'requests': 5, 'connections': 1})
+
+        with http.create_session({'http_keep_alive': False}) as session:
+            for _ in range(3):
+                session.get(self.url)
+            self.assertEqual(http.get_pool_stats(session), {'requests': 3, 'connections': 3})
+
+    def test_thread_clients(self):
+        url = self.emulator.api_url
+
+        class Client():
+            def __init__(self):
+                self.session = http.create_session()
+                self.threads = set()
+
+            def api(self, suffix):
+                self.threads.add(threading.get_ident())
+                return self.session.get(f'{url}/{suffix}').status_code
+
+        clients = http.ThreadClients(Client)
+        threads = [threading.Thread(target=lambda: [clients.api('Folders') for _ in range(3)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(clients.api('Folders'), 200)
+        # one client per thread, main thread included
+        self.assertEqual(len(clients.clients), 5)
+        self.assertTrue(all(len(client.threads) == 1 for client in clients.clients))
+        clients.close()
+        self.assertEqual(clients.clients, [])
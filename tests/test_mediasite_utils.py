@@ -5,6 +5,8 @@ from datetime import datetime
 
 import mediasite_migration_scripts.utils.common as utils
 import mediasite_migration_scripts.utils.mediasite as mediasite_utils
+from tests.datasets import DatasetGenerator, get_folders_paths
+from tests.emulators import MediasiteEmulator
 
 logging.getLogger('root').handlers = []
 utils.set_logger(verbose=True)
@@ -233,6 +235,32 @@ class TestMediasiteUtils(TestCase):
         self.assertEqual(missing_count, 1)
         self.assertEqual(streams_count, 1)
 
+    def test_check_videos_urls_early_exit(self):
+        emulator = MediasiteEmulator()
+        emulator.start()
+
+        def video_file(name, stream_type, mime_type='video/mp4'):
+            return {'StreamType': stream_type, 'ContentMimeType': mime_type, 'Url': f'{emulator.url}/MediasiteDeliver/{name}'}
+
+        videos = [
+            video_file('v1.wmv', 'Video1', 'video/x-ms-wmv'),
+            video_file('v1.mp4', 'Video1'),
+            video_file('v1_low.mp4', 'Video1'),
+            video_file('v3.mp4', 'Video3'),
+        ]
+        with requests.Session() as s:
+            urls_ok, missing_count, streams_count = mediasite_utils.check_videos_urls(videos, s)
+            self.assertTrue(urls_ok)
+            self.assertEqual((missing_count, streams_count), (0, 2))
+            # one file per stream
+            self.assertEqual(emulator.get_stats()['video_files'], 2)
+
+            emulator.missing_files_rate = 1
+            urls_ok, missing_count, streams_count = mediasite_utils.check_videos_urls(videos, s)
+            self.assertFalse(urls_ok)
+            self.assertEqual((missing_count, streams_count), (4, 2))
+        emulator.stop()
+
     def test_get_slides_urls(self):
         slides_urls = mediasite_utils.get_slides_urls(self.slides_example)
         self.assertEqual(len(slides_urls), int(self.slides_example['Length']))
@@ -261,6 +289,9 @@ class TestMediasiteUtils(TestCase):
 
         wrong_date_parsed = mediasite_utils.parse_mediasite_date('2016-12-07T13')
         self.assertIsNone(wrong_date_parsed)
+        self.assertEqual(mediasite_utils.parse_mediasite_date('2016-12-07T13:07:27.123456Z'), datetime(2016, 12, 7, 13, 7, 27, 123456))
+        for wrong_date in ['2016-12-07T13:07:27Z', '2016-13-07T13:07:27', '2016-12-07T13:07:27.1234567', '2016-12-07 13:07:27']:
+            self.assertIsNone(mediasite_utils.parse_mediasite_date(wrong_date))
 
     def test_get_most_distant_date(self):
         presentations_examples = [
@@ -300,6 +331,12 @@ class TestMediasiteUtils(TestCase):
             'video_codec': 'H264'
         })
 
+        # parsed profiles are cached, callers get their own copy
+        encoding_settings_parsed['width'] = 0
+        self.assertEqual(mediasite_utils.parse_encoding_settings_xml(encoding_settings_example)['width'], 640)
+        self.assertDictEqual(mediasite_utils.parse_encoding_settings_xml({}), {})
+        self.assertDictEqual(mediasite_utils.parse_encoding_settings_xml({'SerializedSettings': '<EncodingSettings>'}), {})
+
         encoding_settings_example = {
             'Id': '7079dee9833a4587bd25ff6c6fb1105528',
             'MimeType': 'video/mp4',
@@ -329,3 +366,78 @@ class TestMediasiteUtils(TestCase):
                 'Number': str(i + 1),
                 'Title': 'Title ' + str(i + 1)
             })
+
+    def test_parse_shard(self):
+        self.assertEqual(mediasite_utils.parse_shard('2/4'), (2, 4))
+        for shard in ['0/4', '5/4', '2', 'a/b']:
+            with self.assertRaises(ValueError):
+                mediasite_utils.parse_shard(shard)
+
+    def test_select_folders(self):
+        data = DatasetGenerator(300, seed=1).generate()
+        folders = data['Folders']
+        paths = mediasite_utils.get_folders_paths(folders)
+        self.assertEqual(paths, get_folders_paths(folders))
+
+        # shards are disjoint and cover all folders
+        selected_ids = list()
+        for index in range(1, 4):
+            shard_folders = mediasite_utils.select_folders(folders, shard=(index, 3))
+            self.assertGreater(len(shard_folders), 0)
+            selected_ids.extend(f['Id'] for f in shard_folders)
+        self.assertEqual(sorted(selected_ids), sorted(f['Id'] for f in folders))
+
+        users_folder = next(f for f in folders if paths[f['Id']] == '/Mediasite Users')
+        subtree = mediasite_utils.select_folders(folders, subtrees=['/Mediasite Users/'])
+        self.assertEqual(subtree, mediasite_utils.select_folders(folders, subtrees=[users_folder['Id']]))
+        self.assertEqual(
+            [f['Id'] for f in subtree],
+            [f['Id'] for f in folders if paths[f['Id']].startswith('/Mediasite Users')]
+        )
+
+    def test_merge_collected_data(self):
+        data = DatasetGenerator(100, seed=1).generate()
+        folders = data['Folders']
+        user = next(iter(data['UserProfiles'].values()))
+        shards_data = [
+            {'Folders': mediasite_utils.select_folders(folders, shard=(index, 2)), 'UserProfiles': [user, user]}
+            for index in range(1, 3)
+        ]
+        # overlapping subtree, with a presentation collected since
+        overlap = dict(folders[-1], Presentations=folders[-1]['Presentations'] + [{'Id': 'new'}])
+        # collected since users are keyed by username
+        users = data['UserProfiles']
+        shards_data.append({'Folders': [overlap], 'UserProfiles': users})
+
+        merged = mediasite_utils.merge_collected_data(shards_data)
+        self.assertEqual(sorted(f['Id'] for f in merged['Folders']), sorted(f['Id'] for f in folders))
+        merged_folder = next(f for f in merged['Folders'] if f['Id'] == overlap['Id'])
+        self.assertEqual(len(merged_folder['Presentations']), len(folders[-1]['Presentations']) + 1)
+        self.assertEqual(merged['UserProfiles'], users)
+
+    def test_get_users_by_username(self):
+        users = [{'UserName': 'a', 'Email': 'a@test'}, {'UserName': 'b'}, {'UserName': 'a', 'Email': 'a@test'}]
+        by_username = mediasite_utils.get_users_by_username(users)
+        self.assertEqual(list(by_username), ['a', 'b'])
+        self.assertIs(mediasite_utils.get_users_by_username(by_username), by_username)
+        self.assertEqual(mediasite_utils.get_users_by_username(None), {})
+
+    def test_get_redirected_ids(self):
+        redirections = {
+            'https://mediasite.test/Site1/Play/abc1d': 'https://tube.test/permalink/v1/iframe/',
+            'https://mediasite.test/Site1/Play/def1d/?catalog=c1': 'https://tube.test/permalink/v2/iframe/',
+            'https://mediasite.test/Site1/Channel/chan': 'https://tube.test/permalink/c1/iframe/?header=no',
+            'https://mediasite.test/Site1/Play/bad': 'https://tube.test/',
+        }
+        self.assertEqual(mediasite_utils.get_redirected_ids(redirections), {'abc1d': 'v1', 'def1d': 'v2', 'chan': 'c1'})
+
+    def test_collect_profiles(self):
+        self.assertEqual(mediasite_utils.get_collect_profile('full')['resources'], mediasite_utils.PRESENTATION_RESOURCES)
+        self.assertEqual(mediasite_utils.get_collect_profile('analyze'), {'resources': [], 'users': []})
+        with self.assertRaises(ValueError):
+            mediasite_utils.get_collect_profile('minimal')
+
+        presentation = {'Id': 'p1', 'TimedEvents': [], 'NotCollected': ['PresentationAnalytics', 'Availability']}
+        self.assertTrue(mediasite_utils.is_collected(presentation, 'TimedEvents'))
+        self.assertFalse(mediasite_utils.is_collected(presentation, 'Availability'))
+        self.assertTrue(mediasite_utils.is_collected({'Id': 'p2'}, 'Availability'))
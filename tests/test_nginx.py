@@ -0,0 +1,60 @@
+from unittest import TestCase
+import logging
+import tempfile
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils import nginx
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestNginx(TestCase):
+
+    def setUp(self):
+        super(TestNginx)
+        self.root = 'https://mediasite.test'
+        self.redirections = {
+            f'{self.root}/Mediasite/Play/{i:032x}1d': f'https://tube.test/permalink/v1{i}/iframe/' for i in range(500)
+        }
+
+    def test_get_map_entries(self):
+        pid = f'{0:032x}1d'
+        additional = {pid: [f'{self.root}/Site1/MyMediasite/presentations/{pid}', f'{self.root}/Mediasite/Play/{pid}/']}
+        exact, regexes = nginx.get_map_entries(self.redirections, self.root, additional)
+        self.assertEqual(len(exact), 1000)
+        self.assertEqual(exact[f'/Mediasite/Play/{pid}/'], 'https://tube.test/permalink/v10/iframe/')
+        # the trailing slash variant is already an exact entry
+        self.assertEqual(regexes, [(f'~*/Site1/MyMediasite/presentations/{pid}', 'https://tube.test/permalink/v10/iframe/')])
+
+        with self.assertRaises(ValueError):
+            nginx.get_map_entries({'https://other.test/Mediasite/Play/1': 'https://tube.test'}, self.root)
+
+    def test_get_map_hash_sizes(self):
+        exact, regexes = nginx.get_map_entries(self.redirections, self.root)
+        bucket_size, max_size = nginx.get_map_hash_sizes(list(exact))
+        self.assertIn(bucket_size, [64, 128, 256, 512])
+        self.assertEqual(max_size, nginx.DEFAULT_MAX_SIZE)
+        hashes = [nginx.hash_key_lc(key) for key in exact]
+        sizes = [nginx.elt_size(key) for key in exact]
+        self.assertTrue(nginx.fits(hashes, sizes, max_size, bucket_size - nginx.POINTER_SIZE))
+
+        self.redirections = {f'{self.root}/Mediasite/Play/{i:032x}1d': 'https://tube.test/' for i in range(5000)}
+        exact, regexes = nginx.get_map_entries(self.redirections, self.root)
+        bucket_size, max_size = nginx.get_map_hash_sizes(list(exact))
+        self.assertLessEqual(max_size, 2 * len(exact))
+        self.assertEqual(nginx.elt_size('/a'), 16)
+        self.assertEqual(nginx.get_map_hash_sizes([]), (64, 2048))
+
+    def test_write_map(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'redirections.map'
+            nginx.write_map(path, {'/Mediasite/Play/a"b': 'https://tube.test/a'}, [('~*/presentations/a\\.b', 'https://tube.test/a')])
+            lines = path.read_text().splitlines()
+        self.assertEqual(lines, ['"/Mediasite/Play/a\\"b" "https://tube.test/a";', '"~*/presentations/a\\\\.b" "https://tube.test/a";'])
@@ -0,0 +1,119 @@
+from unittest import TestCase
+import logging
+import time
+import requests
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.ratelimit import RateLimiter
+from mediasite_migration_scripts.utils.http import create_session
+from tests.emulators import MediasiteEmulator
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestRateLimiter(TestCase):
+
+    def test_from_config(self):
+        self.assertIsNone(RateLimiter.from_config({'mediasite_rate_limit': False}, 'mediasite'))
+        limiter = RateLimiter.from_config({'mediasite_max_rps': 5, 'mediaserver_max_rps': 1}, 'mediasite')
+        self.assertEqual(limiter.name, 'mediasite')
+        self.assertEqual(limiter.max_rate, 5)
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(initial_rps=40, max_rps=40, burst=1)
+        before = time.monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - before, 0.2)
+
+    def test_aimd(self):
+        limiter = RateLimiter(initial_rps=2, min_rps=1, max_rps=10, target_latency_ms=100)
+        # slow start, until the first slowdown
+        for _ in range(6):
+            limiter.record(200, latency=0.01)
+        self.assertEqual(limiter.rate, 8)
+
+        limiter.record(503)
+        self.assertEqual(limiter.rate, 4)
+        # failures within a second are the same congestion event
+        limiter.record(None)
+        self.assertEqual(limiter.rate, 4)
+
+        limiter.last_decrease = 0
+        limiter.record(200, latency=0.5)
+        self.assertEqual(limiter.rate, 2)
+        self.assertEqual(limiter.stats['slow'], 1)
+
+        for _ in range(100):
+            limiter.record(200, latency=0.01)
+        self.assertEqual(limiter.rate, 10)
+        self.assertEqual(limiter.stats['requests'], 109)
+        self.assertEqual(limiter.stats['min_rps'], 2)
+
+    def test_call(self):
+        limiter = RateLimiter()
+
+        def fail(exception):
+            raise exception
+
+        with self.assertRaises(ValueError):
+            limiter.call(fail, ValueError('Media has no usable ressources'))
+        # ids in messages are not status codes
+        with self.assertRaises(RuntimeError):
+            limiter.call(fail, RuntimeError('Failed to get presentation 5003b9c1d'))
+        self.assertEqual(limiter.stats['errors'], 0)
+        # failures are not successes
+        self.assertEqual(limiter.rate, 10)
+        self.assertEqual(limiter.stats['requests'], 2)
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            limiter.call(fail, requests.exceptions.ConnectionError())
+        self.assertEqual(limiter.stats['errors'], 1)
+        response = requests.Response()
+        response.status_code = 404
+        with self.assertRaises(requests.exceptions.HTTPError):
+            limiter.call(fail, requests.exceptions.HTTPError(response=response))
+        self.assertEqual(limiter.stats['errors'], 1)
+        response.status_code = 503
+        with self.assertRaises(requests.exceptions.HTTPError):
+            limiter.call(fail, requests.exceptions.HTTPError(response=response))
+        self.assertEqual(limiter.stats['errors'], 2)
+        self.assertEqual(limiter.call(lambda x: x * 2, 2), 4)
+
+
+class TestRateLimitedSession(TestCase):
+
+    def setUp(self):
+        super(TestRateLimitedSession)
+        self.emulator = MediasiteEmulator(utils.read_json('tests/mediasite_test_data.json'))
+        self.emulator.start()
+        self.limiter = RateLimiter(initial_rps=20, max_backoff_s=0.05)
+        self.session = create_session(rate_limiter=self.limiter, retries=2)
+
+    def tearDown(self):
+        self.session.close()
+        self.emulator.stop()
+
+    def test_retries(self):
+        self.emulator.error_rate = 1
+        self.emulator.error_codes = [429]
+        r = self.session.get(f'{self.emulator.api_url}/Folders')
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(self.emulator.get_stats()['injected_errors'], 3)
+        self.assertEqual(self.limiter.stats['throttled'], 3)
+        self.assertLess(self.limiter.rate, 20)
+
+        # not idempotent
+        r = self.session.post(f'{self.emulator.api_url}/Folders')
+        self.assertEqual(self.emulator.get_stats()['injected_errors'], 4)
+
+        self.emulator.error_rate = 0
+        r = self.session.get(f'{self.emulator.api_url}/Folders')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.limiter.stats['requests'], 5)
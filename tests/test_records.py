@@ -0,0 +1,94 @@
+from unittest import TestCase
+import json
+import logging
+import tempfile
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.records import MediaData, MediaRecord, MediaRef, PayloadStore, StoredPayload
+from mediasite_migration_scripts.utils.state import StateStore
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestRecords(TestCase):
+
+    def setUp(self):
+        super(TestRecords)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state = StateStore(Path(self.tmp_dir.name) / 'state.sqlite')
+        self.store = PayloadStore(self.state)
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp_dir.cleanup()
+
+    def test_payload_store(self):
+        refs = [self.store.write({'Id': str(i), 'SlideDetails': list(range(i))}) for i in range(10)]
+        self.assertIsInstance(refs[0], StoredPayload)
+        self.assertEqual(refs[3].load(), {'Id': '3', 'SlideDetails': [0, 1, 2]})
+        self.assertEqual(self.store.read(refs[9])['Id'], '9')
+
+    def test_media_data(self):
+        presentation = {'Id': 'p1', 'Title': 'Presentation', 'TagList': ['a']}
+        chapters = [{'Position': 0, 'Title': 'Chapter'}]
+        data = MediaData(
+            presentation_id='p1',
+            title='Presentation',
+            external_data=self.store.write(presentation),
+            slides=None,
+            chapters=self.store.write(chapters),
+        )
+        self.assertEqual(data['external_data'], json.dumps(presentation, indent=2, sort_keys=True))
+        self.assertEqual(data['chapters'], chapters)
+        self.assertIsNone(data['slides'])
+        self.assertNotIn('presentation_id', data)
+        self.assertEqual(data.presentation_id, 'p1')
+
+        data.update({'speaker_id': 'user', 'unknown_key': 1})
+        data['detect_slides'] = 'yes'
+        data.pop('speaker_id')
+        self.assertNotIn('speaker_id', data)
+        self.assertIsNone(data.get('file_url'))
+        self.assertEqual(dict(data), {
+            'title': 'Presentation',
+            'detect_slides': 'yes',
+            'unknown_key': 1,
+            'external_data': json.dumps(presentation, indent=2, sort_keys=True),
+            'slides': None,
+            'chapters': chapters,
+        })
+
+        small_ext_data = {'Id': 'p1', 'TotalViews': 3}
+        data['external_data'] = small_ext_data
+        self.assertEqual(json.loads(data['external_data']), small_ext_data)
+        with self.assertRaises(AttributeError):
+            data.not_a_slot = 1
+
+    def test_media_record(self):
+        media = MediaRecord(MediaData(title='Presentation'), MediaRef(channel_path='/Folder', folder_path='/Folder'))
+        self.assertIsNone(media.get('ref').get('media_oid'))
+        media['ref']['media_oid'] = 'v1'
+        self.assertEqual(media['ref'], {'channel_path': '/Folder', 'folder_path': '/Folder', 'media_oid': 'v1'})
+        self.assertEqual(media['data']['title'], 'Presentation')
+        self.assertEqual(media.get('unknown', {}), {})
+
+    def test_record_state(self):
+        slides = {'Length': '2', 'SlideDetails': [{'Number': 1}, {'Number': 2}]}
+        data = MediaData(presentation_id='p1', title='Presentation', external_data={'Id': 'p1'}, slides=self.store.write(slides), chapters=[])
+        media = MediaRecord(data, MediaRef(channel_path='/Folder', folder_path='/Folder'))
+        state = media.to_state()
+        # stored payloads are not copied into the record state
+        self.assertNotIn('SlideDetails', json.dumps(state))
+
+        loaded = MediaRecord.from_state(json.loads(json.dumps(state)), self.store)
+        self.assertEqual(loaded['data'].presentation_id, 'p1')
+        self.assertEqual(dict(loaded['data']), dict(data))
+        self.assertEqual(loaded['data']['slides'], slides)
+        self.assertEqual(dict(loaded['ref']), dict(media['ref']))
@@ -0,0 +1,143 @@
+from unittest import TestCase
+import csv
+import logging
+import tempfile
+import requests
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.report import ReportVerifier
+from mediasite_migration_scripts.utils.state import StateStore
+from tests.emulators import MediaServerEmulator
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestReportVerifier(TestCase):
+
+    def setUp(self):
+        super(TestReportVerifier)
+        self.emulator = MediaServerEmulator()
+        self.emulator.start()
+        self.session = requests.Session()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = Path(self.tmp_dir.name) / 'report.csv'
+        self.state = StateStore(Path(self.tmp_dir.name) / 'report_state.sqlite')
+        self.play_url = 'https://mediasite.test/Site1/Play/'
+
+        self.presentations = list()
+        self.redirections = dict()
+        self.mediasite = dict()
+        for i in range(2):
+            channel = self.call('channels/add', 'post', {'title': f'channel {i}', 'parent': self.emulator.root_oid})
+            for j in range(10):
+                pid = f'p{i}{j}'
+                media = self.call('medias/add', 'post', {'channel': f'mscid-{channel["oid"]}', 'title': pid, 'validated': 'yes'})
+                self.presentations.append((f'/folder {i}', pid))
+                self.redirections[self.play_url + pid] = f'https://tube.test/permalink/{media["oid"]}/iframe/'
+                self.mediasite[pid] = {'Status': 'Viewable', 'Private': j == 0}
+        # media deleted after the migration, presentation not migrated
+        self.presentations.append(('/folder 2', 'p-deleted'))
+        self.redirections[self.play_url + 'p-deleted'] = 'https://tube.test/permalink/v-deleted/iframe/'
+        self.presentations.append(('/folder 2', 'p-skipped'))
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp_dir.cleanup()
+        self.session.close()
+        self.emulator.stop()
+
+    def call(self, suffix, method='get', params=None, data=None):
+        # like the MediaServer client with ignored_status_codes=[404]
+        url = f'{self.emulator.url}/api/v2/{suffix}'
+        if method == 'post':
+            response = self.session.post(url, data=params or data)
+        else:
+            response = self.session.get(url, params=params)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def get_verifier(self, **kwargs):
+        return ReportVerifier(
+            self.call, self.redirections, self.play_url, get_presentation=self.mediasite.get,
+            state=self.state, mediasite_workers=2, mediaserver_workers=4, **kwargs
+        )
+
+    def read_csv(self):
+        with open(self.csv_path, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_run(self):
+        verifier = self.get_verifier(fix_private=True, apply_changes=True)
+        results = verifier.run(self.presentations, self.csv_path)
+        rows = self.read_csv()
+        self.assertEqual([row['mediasite_url'] for row in rows], [self.play_url + pid for _, pid in self.presentations])
+        first_oid = self.redirections[self.play_url + 'p00'].split('/')[4]
+        self.assertEqual(rows[0]['mediaserver_path'], f'Emulated root channel/channel 0/{first_oid}')
+        self.assertEqual(rows[-1]['mediaserver_path'], 'SKIPPED')
+        self.assertTrue(results['p-deleted']['missing'])
+        self.assertEqual(
+            verifier.stats,
+            {'verified': 22, 'resumed': 0, 'skipped': 1, 'missing': 1, 'mismatches': 2, 'fixed': 2, 'errors': 0}
+        )
+        self.assertFalse(self.emulator.medias[first_oid]['validated'])
+        # one request per channel, root included
+        self.assertEqual(self.emulator.get_stats()['channels/get'], 3)
+
+    def test_resume(self):
+        self.emulator.error_rate = 0.3
+        verifier = self.get_verifier()
+        verifier.run(self.presentations, self.csv_path)
+        self.assertGreater(verifier.stats['errors'], 0)
+        self.assertEqual(len(self.read_csv()), 22 - verifier.stats['errors'])
+
+        self.emulator.error_rate = 0
+        verifier = self.get_verifier()
+        verifier.run(self.presentations, self.csv_path)
+        self.assertEqual(verifier.stats['errors'], 0)
+        self.assertEqual(verifier.stats['resumed'] + verifier.stats['verified'], 22)
+        # resumed and verified rows are merged in the order of the presentations
+        rows = self.read_csv()
+        self.assertEqual([row['mediasite_url'] for row in rows], [self.play_url + pid for _, pid in self.presentations])
+
+        medias_get = self.emulator.get_stats()['medias/get']
+        verifier = self.get_verifier()
+        verifier.run(self.presentations, self.csv_path)
+        self.assertEqual(verifier.stats['verified'], 0)
+        self.assertEqual(self.emulator.get_stats()['medias/get'], medias_get)
+
+        verifier = self.get_verifier()
+        verifier.run(self.presentations, self.csv_path, reset=True)
+        self.assertEqual(verifier.stats['verified'], 22)
+
+    def test_resume_options(self):
+        verifier = self.get_verifier(fix_private=True)
+        verifier.run(self.presentations, self.csv_path)
+        self.assertEqual(verifier.stats['mismatches'], 2)
+        self.assertEqual(verifier.stats['fixed'], 0)
+
+        # mismatches not fixed by the dry run are verified again
+        verifier = self.get_verifier(fix_private=True)
+        verifier.run(self.presentations, self.csv_path)
+        self.assertEqual(verifier.stats['resumed'], 20)
+        self.assertEqual(verifier.stats['verified'], 2)
+
+        # recorded with other options
+        verifier = self.get_verifier(fix_private=True, apply_changes=True)
+        verifier.run(self.presentations, self.csv_path)
+        self.assertEqual(verifier.stats['resumed'], 0)
+        self.assertEqual(verifier.stats['verified'], 22)
+        self.assertEqual(verifier.stats['fixed'], 2)
+
+        verifier = self.get_verifier(fix_private=True, apply_changes=True)
+        verifier.run(self.presentations, self.csv_path)
+        self.assertEqual(verifier.stats['resumed'], 22)
+        self.assertEqual(verifier.stats['fixed'], 2)
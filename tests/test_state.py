@@ -0,0 +1,69 @@
+from unittest import TestCase
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.state import StateStore
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestStateStore(TestCase):
+
+    def setUp(self):
+        super(TestStateStore)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'sub' / 'state.sqlite'
+        self.state = StateStore(self.path)
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp_dir.cleanup()
+
+    def test_namespaces(self):
+        self.state.set('mapping', 'p1', {'data': {'title': 'Presentation'}})
+        self.state.set_many('mapping', [('p2', {'skipped': True}), ('p3', None)])
+        self.state.set('channels', 'p1', 'c1')
+
+        self.assertEqual(self.state.get('mapping', 'p1'), {'data': {'title': 'Presentation'}})
+        self.assertIsNone(self.state.get('mapping', 'p3', default='missing'))
+        self.assertEqual(self.state.get('mapping', 'p4', default='missing'), 'missing')
+        self.assertEqual(self.state.count('mapping'), 3)
+        self.assertEqual(self.state.items('channels'), [('p1', 'c1')])
+
+        self.state.delete('mapping', 'p1')
+        self.state.clear('channels')
+        self.assertEqual(self.state.count('mapping'), 2)
+        self.assertEqual(self.state.count('channels'), 0)
+
+    def test_persistence(self):
+        payload_id = self.state.add_payload({'SlideDetails': [1, 2]})
+        self.state.set('mapping_meta', 'fingerprint', {'external_data': False})
+        self.state.close()
+
+        self.state = StateStore(self.path)
+        self.assertEqual(self.state.get_payload(payload_id), {'SlideDetails': [1, 2]})
+        self.assertEqual(self.state.get('mapping_meta', 'fingerprint'), {'external_data': False})
+        self.state.clear_payloads()
+        with self.assertRaises(KeyError):
+            self.state.get_payload(payload_id)
+
+    def test_threads(self):
+        def worker(index):
+            for i in range(50):
+                self.state.set('mapping', f'{index}-{i}', i)
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.state.count('mapping'), 200)
@@ -0,0 +1,147 @@
+from unittest import TestCase
+import logging
+import tempfile
+import threading
+import time
+import requests
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.ratelimit import RateLimiter
+from mediasite_migration_scripts.utils.state import StateStore
+from mediasite_migration_scripts.utils.transcoding import TranscodeLauncher
+from tests.emulators import MediaServerEmulator
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestTranscodeLauncher(TestCase):
+
+    def setUp(self):
+        super(TestTranscodeLauncher)
+        self.emulator = MediaServerEmulator(transcoding_seconds=0.2)
+        self.emulator.start()
+        self.session = requests.Session()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state = StateStore(Path(self.tmp_dir.name) / 'transcode_state.sqlite')
+        self.tasks = list()
+        self.depths = list()
+        self.fail_after = None
+        self.launcher = None
+
+        self.to_transcode = list()
+        for i in range(30):
+            creation = f'2020-01-01 00:00:{i:02d}'
+            oid = self.call('medias/add', params={'title': f'media {i}', 'validated': 'no' if i % 10 == 1 else 'yes', 'creation': creation})['oid']
+            if i % 10 == 2:
+                self.emulator.medias[oid]['origin'] = 'upload'
+            elif i % 10 == 3:
+                self.emulator.medias[oid]['resources'] = [{'file': 'index.m3u8'}]
+            elif i == 4:
+                # task refused
+                self.emulator.medias[oid]['resources'] = []
+                self.to_transcode.append(oid)
+            elif i % 10 != 1:
+                self.to_transcode.append(oid)
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp_dir.cleanup()
+        self.session.close()
+        self.emulator.stop()
+
+    def call(self, suffix, method='post', params=None, data=None, timeout=None):
+        # like the MediaServer client, errors are raised
+        url = f'{self.emulator.url}/api/v2/{suffix}'
+        if method == 'post':
+            result = self.session.post(url, data=params or data, timeout=timeout).json()
+        else:
+            result = self.session.get(url, params=params, timeout=timeout).json()
+        if not result.get('success'):
+            raise Exception(result.get('error'))
+        return result
+
+    def api(self, suffix, method='get', params=None, data=None, timeout=None):
+        if suffix == 'medias/task/':
+            if self.fail_after is not None and len(self.tasks) >= self.fail_after:
+                raise KeyboardInterrupt()
+            self.tasks.append(data['oid'])
+            self.depths.append(len(self.launcher.pending))
+        return self.call(suffix, method, params, data, timeout)
+
+    def get_launcher(self, **kwargs):
+        self.launcher = TranscodeLauncher(self.api, state=self.state, page_size=5, check_workers=4, target_depth=3, poll_seconds=0.05, **kwargs)
+        return self.launcher
+
+    def test_run(self):
+        limiter = RateLimiter('mediaserver')
+        launcher = self.get_launcher(rate_limiter=limiter)
+        launcher.run()
+        self.assertEqual(sorted(self.tasks), sorted(self.to_transcode))
+        self.assertLess(max(self.depths), 3)
+        self.assertEqual(launcher.stats, {'checked': 24, 'transcoded': 3, 'launched': 20, 'failed': 0, 'non_transcodable': 1, 'timed_out': 0})
+        # 30 medias by pages of 5
+        stats = self.emulator.get_stats()
+        self.assertEqual(stats['latest'], 6)
+        # launches are paced by the queue depth, not by the rate limiter
+        self.assertEqual(limiter.stats['requests'], stats['latest'] + stats['medias/resources-list'])
+
+        # migrated after the first run, with the creation date of the presentation
+        oid = self.call('medias/add', params={'title': 'media new', 'validated': 'yes', 'creation': '2019-01-01 00:00:00'})['oid']
+        launcher = self.get_launcher()
+        launcher.run()
+        # new pass from the newest medias, only the new media and the refused one are checked again
+        self.assertEqual(launcher.stats['checked'], 2)
+        self.assertEqual(sorted(self.tasks[21:]), sorted([self.to_transcode[1], oid]))
+        self.assertEqual(self.emulator.get_stats()['latest'], 13)
+
+        # tasks launched at the end of the run are done
+        time.sleep(0.3)
+        launcher = self.get_launcher()
+        launcher.reset()
+        launcher.run()
+        self.assertEqual(self.emulator.get_stats()['latest'], 20)
+        self.assertEqual(launcher.stats['transcoded'], 24)
+
+    def test_resume(self):
+        self.fail_after = 7
+        with self.assertRaises(KeyboardInterrupt):
+            self.get_launcher().run()
+        self.assertEqual(len(self.tasks), 7)
+        cursor = self.state.get(TranscodeLauncher.NAMESPACE, 'cursor')
+        self.assertFalse(cursor['complete'])
+
+        self.fail_after = None
+        launcher = self.get_launcher()
+        launcher.run()
+        # launched tasks are still running and not launched again
+        self.assertEqual(sorted(self.tasks), sorted(self.to_transcode))
+        self.assertLess(max(self.depths), 3)
+        self.assertLess(self.emulator.get_stats()['latest'], 12)
+        self.assertTrue(self.state.get(TranscodeLauncher.NAMESPACE, 'cursor')['complete'])
+
+    def test_wait(self):
+        calls = {'main': 0, 'prefetcher': 0}
+
+        def wait(stop):
+            if threading.current_thread() is threading.main_thread():
+                calls['main'] += 1
+            else:
+                calls['prefetcher'] += 1
+                if calls['prefetcher'] == 3:
+                    # daytime, until the run stops
+                    stop.wait(3600)
+
+        self.fail_after = 2
+        before = time.time()
+        with self.assertRaises(KeyboardInterrupt):
+            self.get_launcher(wait=wait).run()
+        self.assertLess(time.time() - before, 5)
+        # checks of the first page and 3 launches
+        self.assertEqual(calls['main'], 4)
@@ -0,0 +1,220 @@
+from unittest import TestCase
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import mediasite_migration_scripts.utils.common as utils
+from mediasite_migration_scripts.utils.workqueue import RemoteWorkQueue, WorkQueue, WorkQueueServer, open_work_queue
+
+logging.getLogger('root').handlers = []
+utils.set_logger(verbose=True)
+logger = logging.getLogger(__name__)
+
+
+def setUpModule():
+    print('-> ', __name__)
+
+
+class TestWorkQueue(TestCase):
+
+    def setUp(self):
+        super(TestWorkQueue)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'work_queue.sqlite'
+        self.queue = WorkQueue(self.path, lease_seconds=60, max_attempts=2)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp_dir.cleanup()
+
+    def test_from_config(self):
+        queue = WorkQueue.from_config({'download_folder': self.tmp_dir.name, 'work_queue_lease_seconds': 10})
+        self.assertEqual(queue.path, self.path)
+        self.assertEqual(queue.lease_seconds, 10)
+        queue.close()
+
+    def test_claim_ack(self):
+        self.assertEqual(self.queue.add_tasks(['a', 'b', 'c']), 3)
+        # the coordinator can be run again
+        self.assertEqual(self.queue.add_tasks(['a', 'd']), 1)
+
+        self.assertEqual(self.queue.claim('w1', 2), ['a', 'b'])
+        self.assertEqual(self.queue.claim('w2', 5), ['c', 'd'])
+        self.assertEqual(self.queue.claim('w2', 5), [])
+        self.queue.ack('w1', 'a', 'uploaded')
+        self.queue.release('w1', ['b'])
+        self.assertEqual(self.queue.get_counts(), {'pending': 1, 'leased': 2, 'done': 1, 'failed': 0})
+        self.assertEqual(self.queue.count_remaining(exclude_worker='w2'), 1)
+        self.assertEqual(self.queue.claim('w2', 5), ['b'])
+
+    def test_lease_expiry(self):
+        self.queue.add_tasks(['a'])
+        self.assertEqual(self.queue.claim('dead', 1), ['a'])
+        self.assertEqual(self.queue.claim('w1', 1), [])
+
+        self.queue.db.execute('UPDATE tasks SET lease_until = ?', (time.time() - 1,))
+        self.assertEqual(self.queue.claim('w1', 1), ['a'])
+        # the dead worker cannot ack anymore
+        self.queue.ack('dead', 'a')
+        self.assertEqual(self.queue.get_counts()['leased'], 1)
+        self.queue.ack('w1', 'a')
+        self.assertEqual(self.queue.get_counts()['done'], 1)
+
+    def test_fail(self):
+        self.queue.add_tasks(['a', 'b'])
+        self.queue.claim('w1', 1)
+        self.queue.fail('w1', 'a', 'timeout')
+        self.assertEqual(self.queue.get_counts()['pending'], 2)
+        self.assertEqual(self.queue.claim('w1', 1), ['a'])
+        self.queue.fail('w1', 'a', 'timeout')
+        self.assertEqual(self.queue.get_failed(), [('a', 'timeout')])
+
+        # workers dying on the same task
+        self.queue.claim('w1', 1)
+        self.queue.db.execute('UPDATE tasks SET lease_until = ?, attempts = 2', (time.time() - 1,))
+        self.assertEqual(self.queue.claim('w1', 1), [])
+        self.assertEqual(self.queue.count_remaining(), 0)
+
+    def test_single_host(self):
+        self.assertEqual(self.queue.db.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+        # processes of the same host share the queue
+        WorkQueue(self.path).close()
+        with self.assertRaises(ValueError):
+            WorkQueue(self.path, host='other-host')
+        self.queue.reset()
+        with self.assertRaises(ValueError):
+            WorkQueue(self.path, host='other-host')
+
+    def test_lock(self):
+        other = WorkQueue(self.path)
+        self.assertTrue(self.queue.acquire_lock('channels', 'w1'))
+        self.assertFalse(other.acquire_lock('channels', 'w2'))
+        self.queue.release_lock('channels', 'w1')
+        self.assertTrue(other.acquire_lock('channels', 'w2', lease_seconds=-1))
+        # expired
+        self.assertTrue(self.queue.acquire_lock('channels', 'w1'))
+        other.close()
+
+    def test_concurrent_claims(self):
+        task_ids = [str(i) for i in range(200)]
+        self.queue.add_tasks(task_ids)
+        claimed = dict()
+
+        def work(worker):
+            queue = WorkQueue(self.path)
+            claimed[worker] = list()
+            while True:
+                tasks = queue.claim(worker, 3)
+                if not tasks:
+                    break
+                for task_id in tasks:
+                    claimed[worker].append(task_id)
+                    queue.ack(worker, task_id)
+            queue.close()
+
+        threads = [threading.Thread(target=work, args=(f'w{i}',)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        all_claimed = [task_id for tasks in claimed.values() for task_id in tasks]
+        self.assertEqual(sorted(all_claimed), sorted(task_ids))
+        self.assertEqual(self.queue.get_counts()['done'], 200)
+
+
+class TestRemoteWorkQueue(TestCase):
+
+    def setUp(self):
+        super(TestRemoteWorkQueue)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue = WorkQueue(Path(self.tmp_dir.name) / 'work_queue.sqlite', lease_seconds=60, max_attempts=2)
+        self.server = WorkQueueServer(self.queue, host='127.0.0.1', port=0, token='secret')
+        self.server.start()
+        self.remote = RemoteWorkQueue(self.server.url, token='secret')
+
+    def tearDown(self):
+        self.remote.close()
+        self.server.stop()
+        self.queue.close()
+        self.tmp_dir.cleanup()
+
+    def test_open_work_queue(self):
+        config = {'download_folder': self.tmp_dir.name, 'work_queue_url': self.server.url, 'work_queue_token': 'secret'}
+        queue = open_work_queue(config)
+        self.assertIsInstance(queue, RemoteWorkQueue)
+        self.assertEqual(queue.token, 'secret')
+        queue.close()
+        queue = open_work_queue({'download_folder': self.tmp_dir.name})
+        self.assertIsInstance(queue, WorkQueue)
+        queue.close()
+
+    def test_claim_ack(self):
+        self.assertEqual(self.remote.add_tasks(iter(['a', 'b', 'c'])), 3)
+        self.assertEqual(self.remote.claim('w1', 2), ['a', 'b'])
+        # workers of the coordinator host use the file
+        self.assertEqual(self.queue.claim('w2', 2), ['c'])
+        self.remote.ack('w1', 'a', 'uploaded')
+        self.remote.fail('w1', 'b', 'timeout')
+        self.remote.release('w2', ['c'])
+        self.assertEqual(self.remote.get_counts(), {'pending': 2, 'leased': 0, 'done': 1, 'failed': 0})
+        self.assertEqual(self.remote.count_remaining(exclude_worker='w1'), 2)
+
+        # leases are timed by the coordinator
+        self.assertEqual(self.remote.claim('dead', 2), ['b', 'c'])
+        self.queue.db.execute('UPDATE tasks SET lease_until = ?', (time.time() - 1,))
+        self.assertEqual(self.remote.claim('w1', 2), ['c'])
+        self.assertEqual(self.remote.get_failed(), [('b', 'lease expired')])
+
+    def test_shared_state(self):
+        self.remote.set_many('redirections', {'a': 'x', 'b': 'y'}.items())
+        self.queue.set('redirections', 'c', 'z')
+        self.assertEqual(dict(self.remote.items('redirections')), {'a': 'x', 'b': 'y', 'c': 'z'})
+        self.assertEqual(self.remote.count('redirections'), 3)
+        self.assertEqual(self.remote.get('channels', '/a', 'none'), 'none')
+        self.remote.set('channels', '/a', 'c-1')
+        self.assertEqual(self.queue.get('channels', '/a'), 'c-1')
+        self.remote.clear('channels')
+        self.assertIsNone(self.remote.get('channels', '/a'))
+
+        with self.remote.locked('channels', 'w1'):
+            self.assertFalse(self.queue.acquire_lock('channels', 'w2'))
+        self.assertTrue(self.queue.acquire_lock('channels', 'w2'))
+
+    def test_token(self):
+        queue = RemoteWorkQueue(self.server.url, token='wrong')
+        with self.assertRaises(RuntimeError):
+            queue.claim('w1')
+        queue.close()
+        # only the queue methods are served
+        with self.assertRaises(RuntimeError):
+            self.remote._call('close')
+
+    def test_concurrent_claims(self):
+        task_ids = [str(i) for i in range(100)]
+        self.remote.add_tasks(task_ids)
+        claimed = dict()
+
+        def work(worker):
+            claimed[worker] = list()
+            while True:
+                tasks = self.remote.claim(worker, 3)
+                if not tasks:
+                    break
+                for task_id in tasks:
+                    claimed[worker].append(task_id)
+                    self.remote.ack(worker, task_id)
+
+        threads = [threading.Thread(target=work, args=(f'w{i}',)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        all_claimed = [task_id for tasks in claimed.values() for task_id in tasks]
+        self.assertEqual(sorted(all_claimed), sorted(task_ids))
+        self.assertEqual(self.queue.get_counts()['done'], 100)
+        # one session per thread
+        self.assertEqual(len(self.remote.sessions), 5)